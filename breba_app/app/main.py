@@ -4,21 +4,25 @@ import os
 import uuid
 from pathlib import Path
 
-import httpx
 from chainlit.utils import mount_chainlit
-from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, Body
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, Body, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
+from pydantic import TypeAdapter
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.staticfiles import StaticFiles
 
 from act_agent.agent import invoke_act_agent
+from common import encoding
 from common.constants import CHAT_AGENT_TOPIC, ASK_CHAT_AGENT_TOPIC, BUILDER_AGENT_TOPIC, GENERATOR_AGENT_TOPIC
-from common.google_pub_sub import extract_pubsub_message
-from common.model import SendTaskResponse, TaskState, SendTaskRequest, FilePart, TextPart, A2AResponse, \
-    SendTaskStreamingResponse, TaskStatusUpdateEvent, JSONRPCMessage, TaskArtifactUpdateEvent, A2ARequest, Artifact
-from common.utils import send_task_to_builder_indirect, subscribe_to_agent
+from common.google_pub_sub import process_push_batch, validate_push
+from common.http_client import get_client
+from common.idempotency import IdempotencyCache
+from common.model import SendTaskResponse, TaskState, SendTaskRequest, FilePart, TextPart, A2AResponsePush, \
+    SendTaskStreamingResponse, TaskStatusUpdateEvent, JSONRPCMessage, TaskArtifactUpdateEvent, A2ARequestPush, Artifact, \
+    SendTaskRequestPush, SendTaskResponsePush, SendTaskStreamingRequest
+from common.utils import send_task_to_builder_indirect, subscribe_to_agent, AgentStream, lifespan
 
 logging.basicConfig(level=logging.INFO, )
 logger = logging.getLogger(__name__)
@@ -26,7 +30,7 @@ logger = logging.getLogger(__name__)
 HOST = os.environ.get("HOST", "0.0.0.0")
 PORT = int(os.environ.get("PORT", "8080"))
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -49,20 +53,81 @@ connected_input_sockets: dict[str, WebSocket] = {}
 connected_processing_sockets: dict[str, WebSocket] = {}
 connected_status_sockets: dict[str, WebSocket] = {}
 
+# Pubsub may deliver a message more than once, pushes carry an Idempotency-Key header to drop the duplicates
+processed_messages = IdempotencyCache()
+
+
+# "push" has pubsub post to RECEIVE_URL, "stream" reads the topics over websockets and needs no RECEIVE_URL
+PUBSUB_TRANSPORT: str = os.getenv("PUBSUB_TRANSPORT", "push")
+
+# Push subscriptions expire unless renewed within this many seconds, so pubsub stops pushing to dead instances
+SUBSCRIPTION_LEASE_S: float = float(os.getenv("SUBSCRIPTION_LEASE_S", "300"))
+
+# Sessions served by this instance, pubsub only pushes messages of these sessions
+hosted_sessions: set[str] = set()
+agent_streams: list[AgentStream] = []
+lease_renewal: asyncio.Task | None = None
+
 
 async def subscribe_to_agents():
     """
-    Subscribe to all the agents for the application
+    Subscribe to all the agents for the application, filtered down to the sessions hosted here
     """
+    session_ids = sorted(hosted_sessions)
+    if PUBSUB_TRANSPORT == "stream":
+        await stream_from_agents(session_ids)
+        return
     if not RECEIVE_URL:
         return
 
     await asyncio.gather(
-        asyncio.create_task(subscribe_to_agent(CHAT_AGENT_TOPIC, f"{RECEIVE_URL}/agent/chat/push")),
-        asyncio.create_task(subscribe_to_agent(ASK_CHAT_AGENT_TOPIC, f"{RECEIVE_URL}/agent/chat/ask")),
-        asyncio.create_task(subscribe_to_agent(BUILDER_AGENT_TOPIC, f"{RECEIVE_URL}/agent/builder/push")),
-        asyncio.create_task(subscribe_to_agent(GENERATOR_AGENT_TOPIC, f"{RECEIVE_URL}/agent/generator/push")),
+        asyncio.create_task(subscribe_to_agent(CHAT_AGENT_TOPIC, f"{RECEIVE_URL}/agent/chat/push",
+                                               session_ids=session_ids, lease_s=SUBSCRIPTION_LEASE_S)),
+        asyncio.create_task(subscribe_to_agent(ASK_CHAT_AGENT_TOPIC, f"{RECEIVE_URL}/agent/chat/ask",
+                                               session_ids=session_ids, lease_s=SUBSCRIPTION_LEASE_S)),
+        asyncio.create_task(subscribe_to_agent(BUILDER_AGENT_TOPIC, f"{RECEIVE_URL}/agent/builder/push",
+                                               session_ids=session_ids, lease_s=SUBSCRIPTION_LEASE_S)),
+        # Streamed html tags arrive in bursts, batching them saves a request per tag
+        asyncio.create_task(subscribe_to_agent(GENERATOR_AGENT_TOPIC, f"{RECEIVE_URL}/agent/generator/push",
+                                               batch_max_messages=50, batch_max_latency_ms=20,
+                                               session_ids=session_ids, lease_s=SUBSCRIPTION_LEASE_S,
+                                               content_type=encoding.MSGPACK, content_encoding=encoding.ZSTD)),
     )
+    global lease_renewal
+    if lease_renewal is None:
+        lease_renewal = asyncio.create_task(renew_subscriptions())
+
+
+async def renew_subscriptions():
+    """
+    Heartbeat keeping the push subscriptions of this instance alive. Subscribing again is idempotent in pubsub.
+    """
+    while True:
+        await asyncio.sleep(SUBSCRIPTION_LEASE_S / 3)
+        try:
+            await subscribe_to_agents()
+        except Exception as e:
+            logger.warning(f"Failed to renew subscriptions: {e}")
+
+
+async def stream_from_agents(session_ids: list[str]):
+    """
+    Streaming counterpart of the push endpoints below, the streams are opened on first use and then only updated
+    """
+    if not agent_streams:
+        agent_streams.extend([
+            AgentStream(CHAT_AGENT_TOPIC, lambda payload, key: process_push(
+                SendTaskRequestPush.validate_python(payload), key, handle_chat_agent_message)),
+            AgentStream(ASK_CHAT_AGENT_TOPIC, lambda payload, key: process_push(
+                SendTaskResponsePush.validate_python(payload), key, handle_chat_agent_ask)),
+            AgentStream(BUILDER_AGENT_TOPIC, lambda payload, key: process_push(
+                A2ARequestPush.validate_python(payload), key, handle_builder_agent_message)),
+            AgentStream(GENERATOR_AGENT_TOPIC, lambda payload, key: process_push(
+                A2AResponsePush.validate_python(payload), key, handle_generator_agent_message)),
+        ])
+    for stream in agent_streams:
+        await stream.update(session_ids=session_ids)
+        stream.start()
 
 
 async def handle_socket_connection(
@@ -107,10 +172,34 @@ async def index(request: Request):
     # Hardcode to simulate a user logging in
     request.session["sessionId"] = f"user-1-session-1"
     logger.info(f"Session ID: {request.session.get('sessionId')}")
-    await subscribe_to_agents()
+    # Subscriptions only change when a new session shows up, renewals happen in the background
+    if request.session["sessionId"] not in hosted_sessions:
+        hosted_sessions.add(request.session["sessionId"])
+        await subscribe_to_agents()
     return templates.TemplateResponse("base.html", {"request": request, "chat_url": os.getenv("CHAT_URL")})
 
 
+async def read_push(request: Request, adapter: TypeAdapter) -> JSONRPCMessage | list[JSONRPCMessage]:
+    """
+    Validates a push body with one of the precompiled *Push adapters of common.model, see validate_push
+    """
+    return validate_push(await request.body(), adapter, request.headers.get("content-type"),
+                         request.headers.get("content-encoding"))
+
+
+async def process_push(messages: JSONRPCMessage | list[JSONRPCMessage], idempotency_key: str | None,
+                       handler) -> dict | list:
+    """
+    Runs the handler for every message of a single or batched push, skipping messages that were already processed.
+    Messages are only recorded as processed once handled, see process_push_batch
+    :param messages: a single message, or a list of messages for batched subscriptions
+    :param idempotency_key: Idempotency-Key header, comma separated for batches
+    :param handler: coroutine handling a single message
+    :return: the handler result, or a list of results for batches
+    """
+    return await process_push_batch(messages, idempotency_key, handler, processed_messages)
+
+
 # TODO: source should be part of the model
 async def update_status(session_id: str, source: str, model: JSONRPCMessage):
     """
@@ -157,27 +246,33 @@ async def ws_input(websocket: WebSocket):
 
 
 @app.post("/agent/chat/push")
-async def message_from_chat_agent(payload: dict = Body(...)):
+async def message_from_chat_agent(request: Request, idempotency_key: str | None = Header(None)):
     """
     Handles push from chat agent. Usually to starting or confirming a user's task
-    :param payload: Should be a SendTaskRequest
+    :param request: body should be a SendTaskRequest, or a batch of them
     """
-    logger.info(f"Received payload from chat agent: {payload}")
-    payload = extract_pubsub_message(payload)
     # TODO: handle validation errors
-    task = SendTaskRequest.model_validate(payload)
+    messages = await read_push(request, SendTaskRequestPush)
+    logger.info(f"Received payload from chat agent: {messages}")
+    return await process_push(messages, idempotency_key, handle_chat_agent_message)
+
+
+async def handle_chat_agent_message(task: SendTaskRequest):
     await update_status(task.params.sessionId, "chat", task)
 
 
 @app.post("/agent/chat/ask")
-async def push_to_chat_agent(payload: dict = Body(...)):
+async def push_to_chat_agent(request: Request, idempotency_key: str | None = Header(None)):
     """
     Handles push to chat agent. Usually to ask for input
-    :param payload: Should be a SendTaskResponse
+    :param request: body should be a SendTaskResponse, or a batch of them
     """
-    logger.info(f"Received payload for chat agent: {payload}")
-    payload = extract_pubsub_message(payload)
-    task_response = SendTaskResponse.model_validate(payload)
+    messages = await read_push(request, SendTaskResponsePush)
+    logger.info(f"Received payload for chat agent: {messages}")
+    return await process_push(messages, idempotency_key, handle_chat_agent_ask)
+
+
+async def handle_chat_agent_ask(task_response: SendTaskResponse):
     session_id = task_response.result.sessionId
     logger.info(f"Chat agent received task for session_id: {session_id}")
     # TODO: again this we need to add source of the model
@@ -227,14 +322,18 @@ async def send_spec_to_builder(data: dict = Body(...)):
 
 
 @app.post("/agent/builder/push")
-async def push_from_builder_agent(payload: dict = Body(...)):
+async def push_from_builder_agent(request: Request, idempotency_key: str | None = Header(None)):
     """
     Handles push from builder agent. This is the final spec that is expected to be picked up by the generator agent
-    :param payload: The request to the generator agent (or whoever needs to know about builder spec)
+    :param request: body should be the request to the generator agent (or whoever needs to know about builder spec),
+    or a batch of them
     """
-    logger.info(f"Received payload from builder agent: {payload}")
-    payload = extract_pubsub_message(payload)
-    task_request = A2ARequest.validate_python(payload)
+    messages = await read_push(request, A2ARequestPush)
+    logger.info(f"Received payload from builder agent: {messages}")
+    return await process_push(messages, idempotency_key, handle_builder_agent_message)
+
+
+async def handle_builder_agent_message(task_request: SendTaskRequest | SendTaskStreamingRequest):
     session_id = task_request.params.sessionId
     logger.info(f"Received task session_id: {session_id}")
     websocket = connected_processing_sockets.get(session_id)
@@ -256,16 +355,19 @@ async def ws_generator(websocket: WebSocket):
 
 
 @app.post("/agent/generator/push")
-async def push_from_generator_agent(payload: dict = Body(...)):
+async def push_from_generator_agent(request: Request, idempotency_key: str | None = Header(None)):
     """
-    Handles push from the generator agent. This will be streaming html tags or a complete html page
-    :param payload: Should be task response of some kind
+    Handles push from the generator agent. This will be streaming html tags or a complete html page.
+    Pushed as zstd compressed msgpack, since complete pages are large
+    :param request: body should be task response of some kind, or a batch of them
     :return:
     """
-    logger.info(f"Received payload from generator agent: {payload}")
-    payload = extract_pubsub_message(payload)
-    task_response = A2AResponse.validate_python(payload)
+    messages = await read_push(request, A2AResponsePush)
+    logger.info(f"Received payload from generator agent: {messages}")
+    return await process_push(messages, idempotency_key, handle_generator_agent_message)
+
 
+async def handle_generator_agent_message(task_response: SendTaskResponse | SendTaskStreamingResponse):
     if isinstance(task_response, SendTaskResponse):
         return await handle_send_task_response(task_response)
 
@@ -335,7 +437,7 @@ async def send_artifact_to_websocket(session_id: str, artifact: Artifact | None,
 
 async def handle_file_part(part: FilePart, websocket: WebSocket):
     """Download and store the image, then trigger a client reload."""
-    response = await httpx.AsyncClient().get(part.file.uri)
+    response = await get_client().get(part.file.uri)
     image = response.content
     images_dir = Path("images")
     images_dir.mkdir(parents=True, exist_ok=True)
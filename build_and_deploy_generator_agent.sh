@@ -8,6 +8,8 @@ REPO_NAME="breba-repo"
 SERVICE_NAME="generator-agent"
 IMAGE_URI="us-west1-docker.pkg.dev/${PROJECT_ID}/${REPO_NAME}/${SERVICE_NAME}"
 PORT=8080
+# Stored images are copied here, so they can be fetched whichever instance generated them. Must be publicly readable
+IMAGE_BUCKET="${PROJECT_ID}-generator-images"
 
 cp generator_agent.Dockerfile Dockerfile
 
@@ -25,6 +27,7 @@ gcloud run deploy "${SERVICE_NAME}" \
   --platform managed \
   --allow-unauthenticated \
   --port "${PORT}" \
+  --update-env-vars "GENERATOR_IMAGE_BUCKET=${IMAGE_BUCKET}" \
   --project "${PROJECT_ID}"
 
 echo "✅ Done. generator-agent deployed"
@@ -8,6 +8,7 @@ from uvicorn import Server, Config
 
 from common.client import A2AClient
 from common.constants import ASK_CHAT_AGENT_TOPIC, CHAT_AGENT_TOPIC
+from common.http_client import close_client
 from common.model import TaskSendParams, TextPart, Message, SendTaskRequest, SendTaskResponse, TaskState
 from common.utils import subscribe_to_agent, publish_to_topic
 
@@ -61,7 +62,7 @@ async def send_task_to_builder_indirect(session_id: str, task_id: str, response:
         id=str(uuid.uuid4())  # or pass your own
     )
 
-    await publish_to_topic(CHAT_AGENT_TOPIC, request.model_dump(exclude_none=True), task_id)
+    await publish_to_topic(CHAT_AGENT_TOPIC, request, task_id)
 
 
 builder_response: SendTaskResponse | None = None
@@ -72,6 +73,7 @@ async def lifespan(app: FastAPI):
     await subscribe_to_agent(ASK_CHAT_AGENT_TOPIC, ASK_CHAT_AGENT_URL)
     yield
     # TODO: unsubscribe
+    await close_client()
 
 
 app = FastAPI(lifespan=lifespan)
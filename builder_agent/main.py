@@ -7,9 +7,11 @@ from fastapi import FastAPI, Request, BackgroundTasks, Body
 from fastapi.responses import JSONResponse
 
 from builder_agent.agent import BuilderAgent
-from common.google_pub_sub import extract_pubsub_message
+from common.google_pub_sub import push_request_id, validate_push
+from common.idempotency import IdempotencyCache, IDEMPOTENCY_KEY_HEADER
 from common.model import JSONRPCResponse, JSONRPCError, A2ARequest, SendTaskRequest, AgentCard, AgentSkill, \
     AgentCapabilities
+from common.utils import lifespan
 from task_manager import AgentTaskManager
 
 logging.basicConfig(level=logging.INFO, )
@@ -19,9 +21,12 @@ load_dotenv()
 
 RECEIVE_URL = os.getenv("RECEIVE_URL", "http://0.0.0.0:8080")
 
+# Pubsub may deliver a task more than once, drop the duplicates instead of running the agent again
+processed_messages = IdempotencyCache()
+
 task_manager = AgentTaskManager()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 
 @app.get("/.well-known/agent.json")
@@ -59,16 +64,21 @@ async def handle_jsonrpc(request: Request, background_tasks: BackgroundTasks):
     :param request: The request to process
     :param background_tasks: used for async tasks (not used yet)
     """
-    body = await request.json()
-    logger.info(f"Received request: {body}")
-    pub_sub_message = extract_pubsub_message(body)
+    body = await request.body()
+    logger.info(f"Received request: {body.decode(errors='replace')}")
+    idempotency_key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+    if processed_messages.contains(idempotency_key):
+        logger.info(f"Skipping duplicate request {idempotency_key}")
+        return JSONResponse({"status": "duplicate"}, status_code=200)
 
     try:
-        json_rpc_request = A2ARequest.validate_python(pub_sub_message)
+        json_rpc_request = validate_push(body, A2ARequest, request.headers.get("content-type"),
+                                         request.headers.get("content-encoding"))
     except Exception as e:
         return JSONResponse(
             JSONRPCResponse(
-                id=body.get("id"),
+                id=push_request_id(body, request.headers.get("content-type"),
+                                   request.headers.get("content-encoding")),
                 error=JSONRPCError(code=-32600, message="Invalid JSON-RPC request", data=str(e))
             ).model_dump(exclude_none=True),
             status_code=400
@@ -77,6 +87,8 @@ async def handle_jsonrpc(request: Request, background_tasks: BackgroundTasks):
     if isinstance(json_rpc_request, SendTaskRequest):
         # Assuming that execute_task is instantaneous and creates asyncio tasks for any difficult computations
         response = await task_manager.on_send_task(json_rpc_request)
+        # Recorded only once handled, a task that failed is processed again when pubsub redelivers it
+        processed_messages.mark(idempotency_key)
 
         logger.info(
             f"returning acknowledgement for session={json_rpc_request.params.sessionId} and task_id={json_rpc_request.params.id}")
@@ -84,10 +96,10 @@ async def handle_jsonrpc(request: Request, background_tasks: BackgroundTasks):
     else:
         response: JSONRPCResponse = JSONRPCResponse(
             response_method="tasks/send",
-            id=body.get("id"),
+            id=json_rpc_request.id,
             error=JSONRPCError(code=-32600, message="Invalid JSON-RPC request")
         )
-        await task_manager.handle_error(response.model_dump(exclude_none=True), body.get("params", {}).get("id"))
+        await task_manager.handle_error(response, json_rpc_request.params.id)
         return JSONResponse(response.model_dump(exclude_none=True), status_code=400)
 
 
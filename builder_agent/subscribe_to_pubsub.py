@@ -5,6 +5,7 @@ import os
 import httpx
 
 from common.constants import CHAT_AGENT_TOPIC
+from common.http_client import get_client
 from common.utils import subscribe_to_agent
 
 logger = logging.getLogger(__name__)
@@ -19,16 +20,15 @@ RECEIVE_URL: str = os.getenv("RECEIVE_URL", "")
 
 async def wait_for_server_ready(url: str, timeout: float = 30.0):
     logger.info(f"Waiting for server to start at {url}")
-    async with httpx.AsyncClient() as client:
-        for _ in range(int(timeout * 10)):
-            try:
-                response = await client.get(url)
-                if response.status_code < 500:
-                    logger.info("✅ Server is ready.")
-                    return
-            except httpx.RequestError:
-                pass
-            await asyncio.sleep(0.1)
+    for _ in range(int(timeout * 10)):
+        try:
+            response = await get_client().get(url)
+            if response.status_code < 500:
+                logger.info("✅ Server is ready.")
+                return
+        except httpx.RequestError:
+            pass
+        await asyncio.sleep(0.1)
     raise TimeoutError(f"Server did not start within {timeout} seconds")
 
 
@@ -39,7 +39,7 @@ class AgentTaskManager:
         )
         request = SendTaskStreamingRequest(params=task_params)
 
-        await publish_to_topic(BUILDER_AGENT_TOPIC, request.model_dump(exclude_none=True), task_id)
+        await publish_to_topic(BUILDER_AGENT_TOPIC, request, task_id)
 
     async def publish_task_response(self, task_id: str, session_id: str, content: str, task_state: TaskState):
         """
@@ -70,7 +70,7 @@ class AgentTaskManager:
 
         response = SendTaskResponse(result=task)
 
-        await publish_to_topic(ASK_CHAT_AGENT_TOPIC, response.model_dump(exclude_none=True), task_id)
+        await publish_to_topic(ASK_CHAT_AGENT_TOPIC, response, task_id)
 
     async def on_send_task(self, request: SendTaskRequest):
         """
@@ -1,31 +1,145 @@
+import asyncio
+import os
+import random
 import uuid
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterable
+
 import httpx
+
+from common.http_client import HTTP_TIMEOUT_S, get_client
 from common.model import SendTaskRequest, SendTaskResponse, JSONRPCMessage, TaskSendParams, SendTaskStreamingRequest, \
-    SendTaskStreamingResponse
+    SendTaskStreamingResponse, dump_json
+
+# Max seconds between two events of a streamed task, the agent may be busy with tools for a while
+STREAM_READ_TIMEOUT_S = float(os.getenv("A2A_STREAM_READ_TIMEOUT_S", "300"))
+JSON_HEADERS = {"Content-Type": "application/json"}
+# Marks tasks in TaskSendParams.metadata["priority"], agents admit bulk tasks only while they have room for them
+PRIORITY = "priority"
+BULK = "bulk"
+
+
+@dataclass
+class BulkTaskResult:
+    params: TaskSendParams
+    # SendTaskResponse, or the last event of a streamed task. None if the task failed
+    response: SendTaskResponse | SendTaskStreamingResponse | None
+    error: Exception | None
+    attempts: int
+
+
+def _retryable(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+def _retry_delay(error: Exception, attempt: int, base_delay: float) -> float:
+    """
+    Exponential backoff with jitter, or the Retry-After of an agent that turned the task away
+    """
+    if isinstance(error, httpx.HTTPStatusError) and error.response.headers.get("retry-after", "").isdigit():
+        return float(error.response.headers["retry-after"])
+    delay = base_delay * 2 ** (attempt - 1)
+    return delay / 2 + random.uniform(0, delay / 2)
 
 
 class A2AClient:
     def __init__(self, agent_url: str):
         self.url = agent_url.rstrip("/") + "/"
 
-    async def _send_request(self, request: JSONRPCMessage) -> dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(self.url, json=request.model_dump(exclude_none=True))
-            response.raise_for_status()
-            return response.json()
+    async def _send_request(self, request: JSONRPCMessage) -> bytes:
+        response = await get_client().post(self.url, content=dump_json(request), headers=JSON_HEADERS)
+        response.raise_for_status()
+        return response.content
 
     async def send_task(self, payload: TaskSendParams) -> SendTaskResponse:
         request = SendTaskRequest(
             params=payload,
             id=str(uuid.uuid4())
         )
-        response_data = await self._send_request(request)
-        return SendTaskResponse(**response_data)
+        return SendTaskResponse.model_validate_json(await self._send_request(request))
 
-    async def send_task_streaming(self, payload: TaskSendParams) -> SendTaskStreamingResponse:
+    async def send_task_streaming(self, payload: TaskSendParams) -> AsyncIterator[SendTaskStreamingResponse]:
+        """
+        Sends the task and yields its events as the agent streams them as server-sent events.
+        Agents that do not stream answer with a single json body, which is yielded as the only event.
+        """
         request = SendTaskStreamingRequest(
             params=payload,
             id=str(uuid.uuid4())
         )
-        response_data = await self._send_request(request)
-        return SendTaskStreamingResponse(**response_data)
+        timeout = httpx.Timeout(HTTP_TIMEOUT_S, read=STREAM_READ_TIMEOUT_S)
+        async with get_client().stream("POST", self.url, content=dump_json(request),
+                                       headers={**JSON_HEADERS, "Accept": "text/event-stream"},
+                                       timeout=timeout) as response:
+            response.raise_for_status()
+            if not response.headers.get("content-type", "").startswith("text/event-stream"):
+                yield SendTaskStreamingResponse.model_validate_json(await response.aread())
+                return
+
+            data: list[str] = []
+            async for line in response.aiter_lines():
+                # An event is its data lines up to a blank line, other fields and comments are not used by agents
+                if line.startswith("data:"):
+                    data.append(line[5:].removeprefix(" "))
+                elif not line and data:
+                    yield SendTaskStreamingResponse.model_validate_json("\n".join(data))
+                    data = []
+            if data:
+                yield SendTaskStreamingResponse.model_validate_json("\n".join(data))
+
+    async def send_tasks_bulk(self, tasks: Iterable[TaskSendParams], concurrency: int = 4, retries: int = 2,
+                              timeout_s: float = 600, streaming: bool = True,
+                              retry_base_delay_s: float = 1.0) -> AsyncIterator[BulkTaskResult]:
+        """
+        Runs many tasks, at most `concurrency` at a time, and yields their results as they complete.
+        Tasks are marked as bulk, so agents can turn them away with a 429 while busy with interactive sessions.
+        A task failing with a connection error, timeout, 5xx or 429 is retried, other errors are final.
+        :param tasks: tasks to run, read lazily
+        :param retries: retries per task after the first attempt
+        :param timeout_s: max seconds per attempt
+        :param streaming: send tasks/sendSubscribe and wait for the last event, otherwise tasks/send
+        """
+        tasks = iter(tasks)
+        running: set[asyncio.Task] = set()
+        try:
+            while True:
+                for params in tasks:
+                    running.add(asyncio.create_task(
+                        self._run_bulk_task(params, retries, timeout_s, streaming, retry_base_delay_s)))
+                    if len(running) >= concurrency:
+                        break
+                if not running:
+                    return
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def _run_bulk_task(self, params: TaskSendParams, retries: int, timeout_s: float, streaming: bool,
+                             retry_base_delay_s: float) -> BulkTaskResult:
+        params = params.model_copy(update={"metadata": {**(params.metadata or {}), PRIORITY: BULK}})
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                if streaming:
+                    response = await asyncio.wait_for(self._last_event(params), timeout_s)
+                else:
+                    response = await asyncio.wait_for(self.send_task(params), timeout_s)
+                return BulkTaskResult(params, response, None, attempt)
+            except Exception as e:
+                if attempt > retries or not _retryable(e):
+                    return BulkTaskResult(params, None, e, attempt)
+                await asyncio.sleep(_retry_delay(e, attempt, retry_base_delay_s))
+
+    async def _last_event(self, params: TaskSendParams) -> SendTaskStreamingResponse:
+        last = None
+        async for event in self.send_task_streaming(params):
+            if event.error is not None:
+                raise RuntimeError(f"Task {params.id} failed: {event.error.message}")
+            last = event
+        return last
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import os
+from typing import AsyncIterable, Awaitable, Callable
+
+from common.model import Artifact, TextPart
+
+logger = logging.getLogger(__name__)
+
+# Streamed text is published at most once per window, or as soon as this many characters are buffered
+ARTIFACT_COALESCE_WINDOW_MS = int(os.getenv("ARTIFACT_COALESCE_WINDOW_MS", "40"))
+ARTIFACT_COALESCE_MAX_CHARS = int(os.getenv("ARTIFACT_COALESCE_MAX_CHARS", "16384"))
+
+
+class ArtifactCoalescer:
+    """
+    Buffers the text chunks streamed for one task and publishes them as fewer, larger artifact updates.
+    The first chunk goes out right away so the page starts rendering, later chunks are buffered and flushed once the
+    window has passed, the buffer is full, or the task completes.
+    Every update is a chunk of the same artifact: `append` is set on all but the first, and `lastChunk` on the one
+    published by close().
+    """
+
+    def __init__(self,
+                 publish: Callable[[Artifact], Awaitable[None]],
+                 index: int = 0,
+                 window_ms: int = ARTIFACT_COALESCE_WINDOW_MS,
+                 max_chars: int = ARTIFACT_COALESCE_MAX_CHARS):
+        """
+        :param publish: publishes an artifact update, called one at a time in chunk order
+        :param index: index of the artifact the chunks belong to
+        """
+        self._publish = publish
+        self.index = index
+        self._window = window_ms / 1000
+        self._max_chars = max_chars
+        self._buffer: list[str] = []
+        self._size = 0
+        self._published = False
+        self._closed = False
+        self._timer: asyncio.Task | None = None
+        # Keeps flushes from the timer and from add() in order
+        self._lock = asyncio.Lock()
+
+    async def add(self, text: str):
+        if not text:
+            return
+        if self._closed:
+            raise RuntimeError("Artifact coalescer is closed")
+        self._buffer.append(text)
+        self._size += len(text)
+        if not self._published or self._size >= self._max_chars:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_after_window())
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self._window)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self, last_chunk: bool = False):
+        """
+        Publishes everything buffered as one artifact update
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # The last chunk is published even if empty, so the artifact always gets its lastChunk
+        if not self._buffer and not (last_chunk and self._published):
+            return
+        artifact = Artifact(parts=[TextPart(text="".join(self._buffer))], index=self.index,
+                            append=True if self._published else None, lastChunk=True if last_chunk else None)
+        self._buffer = []
+        self._size = 0
+        self._published = True
+        async with self._lock:
+            await self._publish(artifact)
+
+    async def close(self):
+        """
+        Publishes what is left as the last chunk, an empty one if everything was flushed already.
+        Nothing is published if nothing was added, or if it was closed already.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        await self.flush(last_chunk=True)
+
+
+async def publish_coalesced(chunks: AsyncIterable[tuple[str, bool]], coalescer: ArtifactCoalescer,
+                            publish_completed: Callable[[str], Awaitable[None]]):
+    """
+    Publishes a streamed task: its text chunks through the coalescer, then the completed content once the coalescer
+    published the last chunk, so receivers have the whole artifact before the task completes
+    :param chunks: (text, is task completed) as they are streamed
+    :param publish_completed: publishes the final response with the completed content
+    """
+    try:
+        async for text, completed in chunks:
+            if completed:
+                await coalescer.close()
+                await publish_completed(text)
+            else:
+                await coalescer.add(text)
+    finally:
+        # Whatever is still buffered if the stream ended without completing
+        await coalescer.close()
@@ -0,0 +1,99 @@
+import functools
+import gzip
+import os
+from typing import Any
+
+import pydantic_core
+
+# Message encodings understood by pubsub, which has its own copy of this module since it is built without common
+
+# Content types, as used in Content-Type headers
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+# Content encodings, as used in Content-Encoding headers. Identity means uncompressed
+IDENTITY = "identity"
+GZIP = "gzip"
+ZSTD = "zstd"
+
+CONTENT_TYPES = (JSON, MSGPACK)
+CONTENT_ENCODINGS = (IDENTITY, GZIP, ZSTD)
+
+# Payloads smaller than this are not worth compressing, e.g. a single streamed html tag
+COMPRESSION_THRESHOLD = int(os.getenv("PUBSUB_COMPRESSION_THRESHOLD", "4096"))
+
+
+@functools.cache
+def _zstd():
+    # msgpack and zstandard are only imported once a message actually uses them
+    import zstandard
+    return zstandard.ZstdCompressor(), zstandard.ZstdDecompressor()
+
+
+def serialize(value: Any, content_type: str) -> bytes:
+    """
+    Serializes dicts, lists and pydantic models, including models nested in dicts such as a publish request.
+    Json is written by pydantic-core in one pass, so models are not dumped to a dict and encoded again.
+    None fields of models are left out, like model_dump(exclude_none=True), None values of plain dicts are kept.
+    """
+    if content_type == MSGPACK:
+        import msgpack
+        return msgpack.packb(pydantic_core.to_jsonable_python(value, exclude_none=True))
+    if content_type == JSON:
+        return pydantic_core.to_json(value, exclude_none=True)
+    raise ValueError(f"Unsupported content type: {content_type}")
+
+
+def deserialize(data: bytes, content_type: str) -> Any:
+    if content_type == MSGPACK:
+        import msgpack
+        return msgpack.unpackb(data)
+    if content_type == JSON:
+        return pydantic_core.from_json(data)
+    raise ValueError(f"Unsupported content type: {content_type}")
+
+
+def compress(data: bytes, content_encoding: str) -> bytes:
+    if content_encoding == ZSTD:
+        return _zstd()[0].compress(data)
+    if content_encoding == GZIP:
+        # Level 6 is gzip's default, trading a little ratio for a lot of speed over 9
+        return gzip.compress(data, compresslevel=6)
+    if content_encoding == IDENTITY:
+        return data
+    raise ValueError(f"Unsupported content encoding: {content_encoding}")
+
+
+def decompress(data: bytes, content_encoding: str) -> bytes:
+    if content_encoding == ZSTD:
+        return _zstd()[1].decompress(data)
+    if content_encoding == GZIP:
+        return gzip.decompress(data)
+    if content_encoding == IDENTITY:
+        return data
+    raise ValueError(f"Unsupported content encoding: {content_encoding}")
+
+
+def encode(value: Any, content_type: str = JSON, content_encoding: str = IDENTITY,
+           threshold: int = COMPRESSION_THRESHOLD) -> tuple[bytes, str, str]:
+    """
+    Serializes the value, compressing it when it is at least `threshold` bytes
+    :return: (data, content type, content encoding actually applied)
+    """
+    data = serialize(value, content_type)
+    if content_encoding == IDENTITY or len(data) < threshold:
+        return data, content_type, IDENTITY
+    return compress(data, content_encoding), content_type, content_encoding
+
+
+def decode(data: bytes, content_type: str | None = None, content_encoding: str | None = None) -> Any:
+    """
+    Reverses encode. Missing headers mean uncompressed json, which is what older messages and clients use.
+    """
+    return deserialize(decompress(data, content_encoding or IDENTITY), content_type or JSON)
+
+
+def media_type(header: str | None) -> str:
+    """
+    Content-Type header without parameters like charset
+    """
+    return header.split(";", 1)[0].strip().lower() if header else JSON
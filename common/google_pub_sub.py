@@ -1,6 +1,16 @@
 import base64
 import json
+import logging
+from typing import Any, Awaitable, Callable
+
 from fastapi import HTTPException
+from pydantic import TypeAdapter, ValidationError
+
+from common import encoding
+from common.idempotency import IdempotencyCache
+
+logger = logging.getLogger(__name__)
+
 
 def extract_pubsub_message(payload: dict) -> dict:
     """
@@ -20,4 +30,83 @@ def extract_pubsub_message(payload: dict) -> dict:
             raise HTTPException(status_code=400, detail=f"Invalid Pub/Sub message format: {e}")
 
     # If it's a direct normal payload (e.g., from localhost testing)
-    return payload
\ No newline at end of file
+    return payload
+
+
+def split_push_batch(payload: dict | list, idempotency_key: str | None = None) -> list[tuple[dict, str | None]]:
+    """
+    Splits a push body into individual messages.
+
+    - Batched pushes are a json array of payloads, with the idempotency keys comma separated in the same order.
+    - Anything else is a single message.
+    :return: list of (payload, idempotency key)
+    """
+    if not isinstance(payload, list):
+        return [(payload, idempotency_key)]
+
+    keys = idempotency_key.split(",") if idempotency_key else []
+    if len(keys) != len(payload):
+        keys = [None] * len(payload)
+    return list(zip(payload, keys))
+
+
+async def process_push_batch(messages: Any | list, idempotency_key: str | None,
+                             handler: Callable[[Any], Awaitable[Any]], processed: IdempotencyCache) -> Any | list:
+    """
+    Runs the handler for every message of a single or batched push, skipping messages that were already processed.
+    A message is only recorded as processed once its handler returns, so when a handler fails the push fails, and
+    pubsub redelivers the messages that were not processed yet.
+    :param messages: a single message, or a list of messages for batched subscriptions
+    :param idempotency_key: Idempotency-Key header, comma separated for batches
+    :param handler: coroutine handling a single message
+    :param processed: keys of the messages processed so far
+    :return: the handler result, or a list of results for batches
+    """
+    results = []
+    for message, key in split_push_batch(messages, idempotency_key):
+        if processed.contains(key):
+            logger.info(f"Skipping duplicate message {key}")
+            results.append({"status": "duplicate"})
+            continue
+        results.append(await handler(message))
+        processed.mark(key)
+    return results if isinstance(messages, list) else results[0]
+
+
+def validate_push(data: bytes, adapter: TypeAdapter, content_type: str | None = None,
+                  content_encoding: str | None = None) -> Any:
+    """
+    Validates a push body into A2A models, straight from the json bytes when it is json.
+
+    - Local pubsub pushes are validated with adapter.validate_json, without parsing them into dicts first.
+    - Google Pub/Sub push envelopes do not validate as messages, their decoded message data is validated instead.
+    - Msgpack pushes are decoded first and validated as python objects.
+    :param adapter: precompiled adapter, e.g. A2AResponsePush to accept single messages and batches
+    :param content_type: Content-Type header of the push
+    :param content_encoding: Content-Encoding header of the push
+    """
+    data = encoding.decompress(data, content_encoding or encoding.IDENTITY)
+    content_type = encoding.media_type(content_type)
+    if content_type != encoding.JSON:
+        return adapter.validate_python(extract_pubsub_message(encoding.deserialize(data, content_type)))
+    try:
+        return adapter.validate_json(data)
+    except ValidationError:
+        payload = encoding.deserialize(data, content_type)
+        if not isinstance(payload, dict) or "message" not in payload:
+            raise
+        return adapter.validate_python(extract_pubsub_message(payload))
+
+
+def push_request_id(data: bytes, content_type: str | None = None, content_encoding: str | None = None) -> Any:
+    """
+    JSON-RPC id of a push that failed validate_push, decoded the same way, to answer it with an error.
+    None when the body cannot be decoded or is not a JSON-RPC object
+    """
+    try:
+        payload = encoding.decode(data, encoding.media_type(content_type), content_encoding)
+        if isinstance(payload, dict) and "message" in payload:
+            payload = extract_pubsub_message(payload)
+        return payload.get("id") if isinstance(payload, dict) else None
+    except Exception:
+        return None
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+import os
+import weakref
+from contextlib import asynccontextmanager
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Connection pool of the shared client. Keep-alive connections are reused across requests, so publishing a streamed tag
+# does not pay for a new TCP connection (and TLS handshake) every time
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY_S = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_S", "30"))
+HTTP_TIMEOUT_S = float(os.getenv("HTTP_TIMEOUT_S", "5"))
+# Multiplexes requests over a single connection per host, needs the h2 package (pip install httpx[http2])
+HTTP2 = os.getenv("HTTP2", "false").lower() == "true"
+
+# One client per event loop, a client cannot be used from a loop other than the one it connected on
+_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient] = weakref.WeakKeyDictionary()
+
+
+def _http2_available() -> bool:
+    if not HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logger.warning("HTTP2 is set but the h2 package is not installed, falling back to HTTP/1.1")
+        return False
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Shared client of the running event loop, created on first use. Do not close it, close_client does on shutdown.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        limits = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                              max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                              keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_S)
+        client = httpx.AsyncClient(limits=limits, timeout=HTTP_TIMEOUT_S, http2=_http2_available())
+        _clients[loop] = client
+    return client
+
+
+async def close_client():
+    """
+    Closes the shared client of the running event loop and its connections
+    """
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    FastAPI lifespan closing the shared client on shutdown, app = FastAPI(lifespan=lifespan)
+    """
+    yield
+    await close_client()
@@ -0,0 +1,36 @@
+from collections import OrderedDict
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+
+
+class IdempotencyCache:
+    """
+    Remembers the most recent idempotency keys pushed by pubsub, so that a message redelivered by at-least-once
+    delivery is only processed once.
+    """
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._keys: OrderedDict[str, None] = OrderedDict()
+
+    def contains(self, key: str | None) -> bool:
+        """
+        :param key: idempotency key of the message, messages without one are never considered duplicates
+        :return: True if a message with the key has been processed
+        """
+        if not key or key not in self._keys:
+            return False
+        self._keys.move_to_end(key)
+        return True
+
+    def mark(self, key: str | None):
+        """
+        Records the key of a processed message. Only call once the message was handled, a message that failed must
+        be processed again when pubsub redelivers it
+        """
+        if not key:
+            return
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        if len(self._keys) > self.max_keys:
+            self._keys.popitem(last=False)
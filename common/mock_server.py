@@ -6,6 +6,7 @@ from starlette.middleware.cors import CORSMiddleware
 from uvicorn import Config, Server
 
 from common.constants import GENERATOR_AGENT_TOPIC
+from common.http_client import get_client
 from common.utils import subscribe_to_agent
 
 PORT = 7999
@@ -22,16 +23,15 @@ async def push_from_generator_agent(payload: dict = Body(...)):
 
 
 async def wait_for_server_ready(url: str, timeout: float = 10.0):
-    async with httpx.AsyncClient() as client:
-        for _ in range(int(timeout * 10)):
-            try:
-                response = await client.get(url)
-                if response.status_code < 500:
-                    print("✅ Server is ready.")
-                    return
-            except httpx.RequestError:
-                pass
-            await asyncio.sleep(0.1)
+    for _ in range(int(timeout * 10)):
+        try:
+            response = await get_client().get(url)
+            if response.status_code < 500:
+                print("✅ Server is ready.")
+                return
+        except httpx.RequestError:
+            pass
+        await asyncio.sleep(0.1)
     raise TimeoutError(f"Server did not start within {timeout} seconds")
 
 
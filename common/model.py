@@ -186,22 +186,36 @@ class AgentCard(BaseModel):
     skills: List[AgentSkill]
 
 
-A2ARequest = TypeAdapter(
-    Annotated[
-        Union[
-            SendTaskRequest,
-            SendTaskStreamingRequest
-        ],
-        Field(discriminator="method")
-    ]
-)
-
-A2AResponse = TypeAdapter(
-    Annotated[
-        Union[
-            SendTaskStreamingResponse,
-            SendTaskResponse
-        ],
-        Field(discriminator="response_method")
-    ]
-)
\ No newline at end of file
+A2ARequestType = Annotated[
+    Union[
+        SendTaskRequest,
+        SendTaskStreamingRequest
+    ],
+    Field(discriminator="method")
+]
+
+A2AResponseType = Annotated[
+    Union[
+        SendTaskStreamingResponse,
+        SendTaskResponse
+    ],
+    Field(discriminator="response_method")
+]
+
+# Adapters are built once here, validating with them does not rebuild the validator.
+# Prefer validate_json on raw bodies over validate_python on an already parsed dict, it skips the intermediate objects
+A2ARequest = TypeAdapter(A2ARequestType)
+A2AResponse = TypeAdapter(A2AResponseType)
+
+# Push bodies: a single message, or a json array of them for batched subscriptions
+SendTaskRequestPush = TypeAdapter(SendTaskRequest | List[SendTaskRequest])
+SendTaskResponsePush = TypeAdapter(SendTaskResponse | List[SendTaskResponse])
+A2ARequestPush = TypeAdapter(A2ARequestType | List[A2ARequestType])
+A2AResponsePush = TypeAdapter(A2AResponseType | List[A2AResponseType])
+
+
+def dump_json(model: BaseModel) -> bytes:
+    """
+    Serializes the model straight to json bytes, like model_dump_json but without the round trip through str
+    """
+    return model.__pydantic_serializer__.to_json(model, exclude_none=True)
@@ -0,0 +1,172 @@
+import asyncio
+
+import pytest
+
+from common.coalescer import ArtifactCoalescer, publish_coalesced
+from common.model import Artifact, SendTaskResponse, SendTaskStreamingResponse, Task, TaskArtifactUpdateEvent, \
+    TaskState, TaskStatus, TextPart
+
+
+class Published(list):
+    def __init__(self, delay_s: float = 0):
+        super().__init__()
+        self.delay_s = delay_s
+
+    async def __call__(self, artifact):
+        await asyncio.sleep(self.delay_s)
+        self.append(artifact)
+
+    @property
+    def texts(self) -> list[str]:
+        return [artifact.parts[0].text for artifact in self]
+
+
+def test_first_chunk_goes_out_right_away_and_the_rest_once_per_window():
+    async def run():
+        published = Published()
+        coalescer = ArtifactCoalescer(published, window_ms=50, max_chars=1000)
+        await coalescer.add("<h1>Title</h1>")
+        assert published.texts == ["<h1>Title</h1>"]
+
+        await coalescer.add("<p>one</p>")
+        await coalescer.add("<p>two</p>")
+        assert len(published) == 1
+        await asyncio.sleep(0.1)
+        assert published.texts == ["<h1>Title</h1>", "<p>one</p><p>two</p>"]
+        assert [artifact.append for artifact in published] == [None, True]
+        assert all(artifact.lastChunk is None for artifact in published)
+
+    asyncio.run(run())
+
+
+def test_full_buffer_is_flushed_before_the_window_ends():
+    async def run():
+        published = Published()
+        coalescer = ArtifactCoalescer(published, window_ms=10_000, max_chars=10)
+        await coalescer.add("first")
+        await coalescer.add("12345")
+        assert len(published) == 1
+        await coalescer.add("67890")
+        assert published.texts == ["first", "1234567890"]
+        await coalescer.close()
+
+    asyncio.run(run())
+
+
+def test_close_publishes_the_rest_as_last_chunk():
+    async def run():
+        published = Published()
+        coalescer = ArtifactCoalescer(published, index=2, window_ms=10_000)
+        await coalescer.add("<head></head>")
+        await coalescer.add("<body></body>")
+        await coalescer.close()
+        assert published.texts == ["<head></head>", "<body></body>"]
+        assert published[-1].lastChunk is True
+        assert published[-1].append is True
+        assert {artifact.index for artifact in published} == {2}
+        with pytest.raises(RuntimeError):
+            await coalescer.add("<html>")
+        # The pending window timer was cancelled, nothing else goes out
+        await asyncio.sleep(0.05)
+        assert len(published) == 2
+
+    asyncio.run(run())
+
+
+def test_close_after_a_full_flush_still_marks_the_last_chunk():
+    async def run():
+        published = Published()
+        coalescer = ArtifactCoalescer(published, window_ms=10_000, max_chars=4)
+        await coalescer.add("<p>")
+        await coalescer.add("</p>")
+        await coalescer.close()
+        assert published.texts == ["<p>", "</p>", ""]
+        assert [artifact.lastChunk for artifact in published] == [None, None, True]
+
+    asyncio.run(run())
+
+
+def test_close_without_text_publishes_nothing():
+    async def run():
+        published = Published()
+        coalescer = ArtifactCoalescer(published, window_ms=10)
+        await coalescer.add("")
+        await coalescer.close()
+        assert published == []
+
+    asyncio.run(run())
+
+
+def test_slow_publishes_keep_chunk_order():
+    async def run():
+        published = Published(delay_s=0.02)
+        coalescer = ArtifactCoalescer(published, window_ms=5, max_chars=4)
+        for n in range(20):
+            await coalescer.add(f"<{n}>")
+            await asyncio.sleep(0.003)
+        await coalescer.close()
+        assert "".join(published.texts) == "".join(f"<{n}>" for n in range(20))
+        assert published[-1].lastChunk is True
+
+    asyncio.run(run())
+
+
+class Topic(list):
+    """
+    Responses in the order the streamed task published them, each publish taking a while like a pubsub round trip
+    """
+
+    async def publish(self, response):
+        await asyncio.sleep(0.005)
+        self.append(response)
+
+    async def publish_artifact(self, artifact: Artifact):
+        await self.publish(SendTaskStreamingResponse(result=TaskArtifactUpdateEvent(id="task-1", artifact=artifact)))
+
+    async def publish_completed(self, content: str):
+        task = Task(id="task-1", sessionId="session-1", status=TaskStatus(state=TaskState.COMPLETED),
+                    artifacts=[Artifact(parts=[TextPart(text=content)])])
+        await self.publish(SendTaskResponse(result=task))
+
+
+async def streamed(pieces: list[str], delay_s: float):
+    for piece in pieces:
+        await asyncio.sleep(delay_s)
+        yield piece, False
+    yield "".join(pieces), True
+
+
+def test_streamed_artifact_is_published_before_the_task_completes():
+    async def run():
+        topic = Topic()
+        pieces = [f"<p>{n}</p>" for n in range(20)]
+        coalescer = ArtifactCoalescer(topic.publish_artifact, window_ms=10, max_chars=1000)
+        await publish_coalesced(streamed(pieces, 0.002), coalescer, topic.publish_completed)
+
+        *updates, completed = topic
+        assert isinstance(completed, SendTaskResponse)
+        assert completed.result.status.state == TaskState.COMPLETED
+        assert all(isinstance(update.result, TaskArtifactUpdateEvent) for update in updates)
+        assert "".join(update.result.artifact.parts[0].text for update in updates) == "".join(pieces)
+        assert len(updates) < len(pieces)
+        assert [update.result.artifact.lastChunk for update in updates] == [None] * (len(updates) - 1) + [True]
+
+    asyncio.run(run())
+
+
+def test_stream_ending_without_completion_still_closes_the_artifact():
+    async def run():
+        topic = Topic()
+
+        async def cut_short():
+            yield "<h1>Title</h1>", False
+            yield "<p>one</p>", False
+            raise RuntimeError("model went away")
+
+        coalescer = ArtifactCoalescer(topic.publish_artifact, window_ms=1000, max_chars=1000)
+        with pytest.raises(RuntimeError):
+            await publish_coalesced(cut_short(), coalescer, topic.publish_completed)
+        assert [update.result.artifact.parts[0].text for update in topic] == ["<h1>Title</h1>", "<p>one</p>"]
+        assert topic[-1].result.artifact.lastChunk is True
+
+    asyncio.run(run())
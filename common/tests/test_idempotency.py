@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from common.google_pub_sub import process_push_batch
+from common.idempotency import IdempotencyCache
+
+
+class Handler:
+    """
+    Records the messages it handled, failing on the messages listed in `fail` the first time they are handled
+    """
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.handled = []
+
+    async def __call__(self, message):
+        if message in self.fail:
+            self.fail.discard(message)
+            raise RuntimeError(f"failed to handle {message}")
+        self.handled.append(message)
+        return {"handled": message}
+
+
+def test_only_marked_keys_are_duplicates():
+    processed = IdempotencyCache()
+    assert not processed.contains("key-1")
+    assert not processed.contains("key-1")
+    processed.mark("key-1")
+    assert processed.contains("key-1")
+    processed.mark(None)
+    assert not processed.contains(None)
+
+
+def test_least_recently_used_keys_are_forgotten():
+    processed = IdempotencyCache(max_keys=2)
+    processed.mark("key-1")
+    processed.mark("key-2")
+    assert processed.contains("key-1")
+    processed.mark("key-3")
+    assert processed.contains("key-1")
+    assert not processed.contains("key-2")
+    assert processed.contains("key-3")
+
+
+def test_failed_delivery_is_processed_on_redelivery():
+    processed = IdempotencyCache()
+    handler = Handler(fail=["message"])
+    with pytest.raises(RuntimeError):
+        asyncio.run(process_push_batch("message", "key-1", handler, processed))
+    assert not processed.contains("key-1")
+
+    assert asyncio.run(process_push_batch("message", "key-1", handler, processed)) == {"handled": "message"}
+    assert asyncio.run(process_push_batch("message", "key-1", handler, processed)) == {"status": "duplicate"}
+    assert handler.handled == ["message"]
+
+
+def test_partly_failed_batch_only_processes_the_rest_on_redelivery():
+    processed = IdempotencyCache()
+    handler = Handler(fail=["b"])
+    with pytest.raises(RuntimeError):
+        asyncio.run(process_push_batch(["a", "b", "c"], "key-a,key-b,key-c", handler, processed))
+
+    results = asyncio.run(process_push_batch(["a", "b", "c"], "key-a,key-b,key-c", handler, processed))
+    assert results == [{"status": "duplicate"}, {"handled": "b"}, {"handled": "c"}]
+    assert handler.handled == ["a", "b", "c"]
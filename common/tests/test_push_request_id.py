@@ -0,0 +1,37 @@
+import base64
+import json
+
+import pytest
+
+from common import encoding
+from common.google_pub_sub import push_request_id
+
+REQUEST = {"jsonrpc": "2.0", "id": "request-1", "method": "tasks/unknown"}
+
+
+@pytest.mark.parametrize("content_type, content_encoding", [
+    (encoding.JSON, encoding.IDENTITY),
+    (encoding.JSON, encoding.GZIP),
+    (encoding.MSGPACK, encoding.ZSTD),
+    (encoding.MSGPACK, encoding.IDENTITY),
+])
+def test_id_is_decoded_like_the_push(content_type, content_encoding):
+    body, _, applied = encoding.encode(REQUEST, content_type, content_encoding, threshold=0)
+    assert applied == content_encoding
+    assert push_request_id(body, f"{content_type}; charset=utf-8", applied) == "request-1"
+
+
+def test_id_of_a_google_pub_sub_envelope():
+    body = json.dumps({"message": {"data": base64.b64encode(json.dumps(REQUEST).encode()).decode()}}).encode()
+    assert push_request_id(body, encoding.JSON) == "request-1"
+
+
+@pytest.mark.parametrize("body, content_type, content_encoding", [
+    (b"not json", encoding.JSON, None),
+    (b"[1, 2]", encoding.JSON, None),
+    (b'"text"', None, None),
+    (b"\x00\x01", encoding.MSGPACK, encoding.ZSTD),
+    (b'{"message": {"data": "not base64"}}', encoding.JSON, None),
+])
+def test_undecodable_bodies_have_no_id(body, content_type, content_encoding):
+    assert push_request_id(body, content_type, content_encoding) is None
@@ -3,25 +3,63 @@ import json
 import logging
 import os
 import uuid
-from typing import Any
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable
 
-import httpx
+import websockets
 from google.cloud import pubsub_v1
+from pydantic import BaseModel
 
 import common
+from common import encoding
 from common.constants import CHAT_AGENT_TOPIC
+from common import http_client
+from common.http_client import get_client
 from common.model import TextPart, TaskSendParams, SendTaskRequest
 
 PUBSUB_URL = os.getenv("PUBSUB_URL", "http://localhost:8000")
 SUBSCRIBE_URL: str = f"{PUBSUB_URL}/subscribe"
+STREAM_URL: str = f"{PUBSUB_URL.replace('http', 'ws', 1)}/subscribe/stream"
+# Opt in to compact publishing, e.g. application/msgpack and zstd. Compression only applies above the threshold
+PUBLISH_CONTENT_TYPE: str = os.getenv("PUBSUB_PUBLISH_CONTENT_TYPE", encoding.JSON)
+PUBLISH_CONTENT_ENCODING: str = os.getenv("PUBSUB_PUBLISH_CONTENT_ENCODING", encoding.IDENTITY)
+
+GOOGLE_PROJECT_ID: str = os.getenv("GOOGLE_PROJECT_ID", "breba-458921")
+# Google Pub/Sub client batching, a batch is sent once any of the limits is reached
+GOOGLE_PUBSUB_MAX_MESSAGES = int(os.getenv("GOOGLE_PUBSUB_MAX_MESSAGES", "100"))
+GOOGLE_PUBSUB_MAX_BYTES = int(os.getenv("GOOGLE_PUBSUB_MAX_BYTES", str(1024 * 1024)))
+GOOGLE_PUBSUB_MAX_LATENCY_S = float(os.getenv("GOOGLE_PUBSUB_MAX_LATENCY_S", "0.01"))
+# Publishes messages of a session with the session id as ordering key, so they are delivered in order like a session
+# partition of the local pubsub. Subscriptions need message ordering enabled for it to matter
+GOOGLE_PUBSUB_ORDERING: bool = os.getenv("GOOGLE_PUBSUB_ORDERING", "true").lower() == "true"
+# Where the A2A models keep the session id, same as pubsub routing
+SESSION_ID_PATHS = (("params", "sessionId"), ("result", "sessionId"), ("result", "metadata", "sessionId"),
+                    ("metadata", "sessionId"))
 
 logging.basicConfig(level=logging.INFO, )
 logger = logging.getLogger(__name__)
 
 publisher = None
+# Google publishes not awaited by their caller, flushed on shutdown
+pending_google_publishes: set[asyncio.Future] = set()
 
 if os.environ.get("PUBSUB_URL") is None:
-    publisher = pubsub_v1.PublisherClient()
+    publisher = pubsub_v1.PublisherClient(
+        batch_settings=pubsub_v1.types.BatchSettings(max_messages=GOOGLE_PUBSUB_MAX_MESSAGES,
+                                                     max_bytes=GOOGLE_PUBSUB_MAX_BYTES,
+                                                     max_latency=GOOGLE_PUBSUB_MAX_LATENCY_S),
+        publisher_options=pubsub_v1.types.PublisherOptions(enable_message_ordering=GOOGLE_PUBSUB_ORDERING),
+    )
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    FastAPI lifespan for agents: waits for pending Google Pub/Sub publishes and closes the shared http client
+    """
+    async with http_client.lifespan(app):
+        yield
+        await asyncio.gather(*pending_google_publishes, return_exceptions=True)
 
 
 async def send_task_to_builder_indirect(session_id: str, task_id: str, response: str):
@@ -45,72 +83,219 @@ async def send_task_to_builder_indirect(session_id: str, task_id: str, response:
         id=str(uuid.uuid4())  # or pass your own
     )
 
-    await publish_to_topic(CHAT_AGENT_TOPIC, request.model_dump(exclude_none=True), task_id)
+    await publish_to_topic(CHAT_AGENT_TOPIC, request, task_id)
 
 
-async def subscribe_to_agent(topic, endpoint):
+async def subscribe_to_agent(topic, endpoint, batch_max_messages: int = 1, batch_max_latency_ms: int = 0,
+                             session_ids: list[str] | None = None, session_prefix: str | None = None,
+                             lease_s: float | None = None, content_type: str = encoding.JSON,
+                             content_encoding: str = encoding.IDENTITY):
     """
     Helper function to subscribe to a pubsub topic. Should ideally be inside pubsub SDK.
     :param topic: topic name to listen to
     :param endpoint: endpoint to which pubsub will push data to
+    :param batch_max_messages: when greater than 1, pubsub pushes json arrays of up to this many messages
+    :param batch_max_latency_ms: how long pubsub waits for a batch to fill up
+    :param session_ids: only receive messages of these sessions
+    :param session_prefix: only receive messages of sessions starting with this prefix
+    :param lease_s: pubsub drops the subscription unless it is renewed, by subscribing again, within this many seconds
+    :param content_type: how pushes are serialized, the endpoint has to decode them with encoding.decode
+    :param content_encoding: compression of large pushes
     :return: coroutine
     """
-    payload = {"topic": topic, "endpoint": endpoint}
+    payload = {"topic": topic, "endpoint": endpoint, "batch_max_messages": batch_max_messages,
+               "batch_max_latency_ms": batch_max_latency_ms, "lease_s": lease_s, "content_type": content_type,
+               "content_encoding": content_encoding}
+    if session_ids is not None or session_prefix is not None:
+        payload["filter"] = {"attribute": "sessionId", "values": session_ids, "prefix": session_prefix}
     headers = {"Content-Type": "application/json"}
-    async with httpx.AsyncClient() as client:
-        response = await client.post(SUBSCRIBE_URL, json=payload, headers=headers)
+    response = await get_client().post(SUBSCRIBE_URL, json=payload, headers=headers)
+    response.raise_for_status()
+    logger.info(f"Subscribed to: {SUBSCRIBE_URL}, payload: {json.dumps(payload)}")
+
+
+async def unsubscribe_from_agent(topic, endpoint):
+    """
+    Stops pubsub from pushing the topic to the endpoint
+    :param topic: topic name to stop listening to
+    :param endpoint: endpoint that was subscribed
+    """
+    payload = {"topic": topic, "endpoint": endpoint}
+    response = await get_client().post(f"{PUBSUB_URL}/unsubscribe", json=payload)
+    if response.status_code != 404:
         response.raise_for_status()
-        logger.info(f"Subscribed to: {SUBSCRIBE_URL}, payload: {json.dumps(payload)}")
+    logger.info(f"Unsubscribed from: {PUBSUB_URL}/unsubscribe, payload: {json.dumps(payload)}")
+
+
+class AgentStream:
+    """
+    Streaming alternative to subscribe_to_agent. Reads a pubsub topic over a websocket, so the subscriber does not need
+    an endpoint reachable from pubsub and every message is a frame instead of a request.
+    Messages are acknowledged once the handler returns, which also gives pubsub credit for the next one.
+    """
+
+    def __init__(self, topic: str, handler: Callable[[dict, str], Awaitable[Any]], name: str | None = None,
+                 credit: int = 100, batch_max_messages: int = 1, batch_max_latency_ms: int = 0,
+                 reconnect_delay: float = 1.0):
+        """
+        :param topic: topic name to listen to
+        :param handler: coroutine called with the payload and idempotency key of every message
+        :param name: identifies the subscriber, a reconnect with the same name takes over an old connection that pubsub
+            has not noticed is closed yet
+        :param credit: messages pubsub may send ahead of acknowledgements
+        """
+        self.topic = topic
+        self._handler = handler
+        self._subscribe = {"type": "subscribe", "topic": topic, "name": name or f"{topic}-{uuid.uuid4().hex}",
+                           "credit": credit, "batch_max_messages": batch_max_messages,
+                           "batch_max_latency_ms": batch_max_latency_ms}
+        self._reconnect_delay = reconnect_delay
+        self._websocket = None
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def update(self, session_ids: list[str] | None = None, session_prefix: str | None = None):
+        """
+        Changes the session filter, on the open connection and for reconnects
+        """
+        self._subscribe["filter"] = {"attribute": "sessionId", "values": session_ids, "prefix": session_prefix}
+        if self._websocket is not None:
+            await self._websocket.send(json.dumps(self._subscribe))
 
+    async def _run(self):
+        while True:
+            try:
+                async with websockets.connect(STREAM_URL) as websocket:
+                    await websocket.send(json.dumps(self._subscribe))
+                    self._websocket = websocket
+                    logger.info(f"Streaming from: {STREAM_URL}, payload: {json.dumps(self._subscribe)}")
+                    async for frame in websocket:
+                        frame = json.loads(frame)
+                        if frame.get("type") == "messages":
+                            await self._handle(websocket, frame["messages"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Stream of {self.topic} disconnected: {e}")
+            finally:
+                self._websocket = None
+            await asyncio.sleep(self._reconnect_delay)
 
-async def publish_to_topic(topic: str, payload: dict[str, Any], task_id: str):
+    async def _handle(self, websocket, messages: list[dict]):
+        acked, failed = [], []
+        for message in messages:
+            try:
+                await self._handler(message["data"], message["idempotency_key"])
+                acked.append(message["id"])
+            except Exception as e:
+                logger.exception(f"Failed to handle message of {self.topic}: {e}")
+                failed.append(message["id"])
+        if acked:
+            await websocket.send(json.dumps({"type": "ack", "ids": acked}))
+        if failed:
+            await websocket.send(json.dumps({"type": "nack", "ids": failed, "error": "Handler failed"}))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+async def publish_to_topic(topic: str, payload: dict[str, Any] | BaseModel, task_id: str,
+                           content_type: str | None = None, content_encoding: str | None = None):
     """
     Helper for publishing to Google Pub/Sub topic.
+    Pass A2A models as they are rather than model_dump'd, they are serialized straight to bytes without a dict in between.
+    :param content_type: local pubsub only, overrides PUBSUB_PUBLISH_CONTENT_TYPE
+    :param content_encoding: local pubsub only, overrides PUBSUB_PUBLISH_CONTENT_ENCODING
+    Google Pub/Sub publishes return once the message is queued in the client's batch, see publish_to_google_topic.
     """
     if os.environ.get("PUBSUB_URL") is None:
         logger.info("PUBSUB_URL not set. Using google pubsub.")
         await publish_to_google_topic(topic, payload, task_id)
     else:
         logger.info("PUBSUB_URL set. Using local pubsub.")
-        await publish_to_local_topic(topic, payload, task_id)
+        await publish_to_local_topic(topic, payload, task_id, content_type or PUBLISH_CONTENT_TYPE,
+                                     content_encoding or PUBLISH_CONTENT_ENCODING)
 
 
-async def publish_to_local_topic(topic: str, payload: dict[str, Any], task_id: str):
+async def publish_to_local_topic(topic: str, payload: dict[str, Any] | BaseModel, task_id: str,
+                                 content_type: str = encoding.JSON, content_encoding: str = encoding.IDENTITY):
     """
     Helper for publishing to pubsub topic.
     :param topic: topic to  publish to
-    :param payload: teh payload to publish to the topic
+    :param payload: teh payload to publish to the topic, a dict or an A2A model
     :param task_id: for logging
+    :param content_type: serialization of the request, application/json or application/msgpack
+    :param content_encoding: compression of the request when it is large enough, identity, gzip or zstd
     """
     # TODO: should be in a pubsub SDK (or use google pub sub locally)
     payload = {"topic": topic, "payload": payload}
+    body, content_type, content_encoding = encoding.encode(payload, content_type, content_encoding)
+    headers = {"Content-Type": content_type}
+    if content_encoding != encoding.IDENTITY:
+        headers["Content-Encoding"] = content_encoding
 
-    async with httpx.AsyncClient() as client:
-        try:
-            logger.info(f"[{task_id}] Publishing to pubsub: {payload}")
-            await client.post(f"{PUBSUB_URL}/publish", json=payload)
-        except Exception as e:
-            logger.error(f"[{task_id}] Failed to publish to pubsub: {e}")
+    try:
+        logger.info(f"[{task_id}] Publishing to pubsub: {payload}")
+        await get_client().post(f"{PUBSUB_URL}/publish", content=body, headers=headers)
+    except Exception as e:
+        logger.error(f"[{task_id}] Failed to publish to pubsub: {e}")
+
+
+def _session_id(payload: dict[str, Any] | BaseModel) -> str | None:
+    for path in SESSION_ID_PATHS:
+        value = payload
+        for part in path:
+            value = value.get(part) if isinstance(value, dict) else getattr(value, part, None)
+        if value:
+            return str(value)
+    return None
 
 
-async def publish_to_google_topic(topic: str, payload: dict[str, Any], task_id: str):
+async def publish_to_google_topic(topic: str, payload: dict[str, Any] | BaseModel, task_id: str,
+                                  confirm: bool = False):
     """
     Helper for publishing to Google Pub/Sub topic.
+    The client batches messages in its own thread, so by default this only queues the message and failures are logged
+    once the batch is sent. Messages of a session keep their order through the session ordering key.
+    :param confirm: wait until Google acknowledges the message, without blocking the event loop
     """
-    project_id = "breba-458921"
-
-    topic_path = publisher.topic_path(project_id, topic)
+    topic_path = publisher.topic_path(GOOGLE_PROJECT_ID, topic)
 
     # Serialize and encode the payload
-    payload_bytes = json.dumps(payload).encode("utf-8")
+    payload_bytes = encoding.serialize(payload, encoding.JSON)
+    ordering_key = (_session_id(payload) or "") if GOOGLE_PUBSUB_ORDERING else ""
 
+    logger.info(f"[{task_id}] Publishing to pubsub topic {topic}: {payload}")
     try:
-        logger.info(f"[{task_id}] Publishing to pubsub topic {topic}: {payload}")
-        future = publisher.publish(topic_path, payload_bytes)
-        future.result()  # Block until the message is actually published
-        logger.info(f"[{task_id}] Published to pubsub topic {topic}: {payload}")
+        # The google future is a concurrent.futures.Future resolved by the client's batch thread
+        future = asyncio.wrap_future(publisher.publish(topic_path, payload_bytes, ordering_key=ordering_key))
     except Exception as e:
         logger.error(f"[{task_id}] Failed to publish to pubsub: {e}")
+        return
+
+    def on_published(published: asyncio.Future):
+        pending_google_publishes.discard(published)
+        if published.cancelled():
+            return
+        error = published.exception()
+        if error is None:
+            logger.info(f"[{task_id}] Published to pubsub topic {topic}")
+            return
+        logger.error(f"[{task_id}] Failed to publish to pubsub: {error}")
+        if ordering_key:
+            # A failed ordered publish pauses its key, later messages of the session would fail right away otherwise
+            publisher.resume_publish(topic_path, ordering_key)
+
+    pending_google_publishes.add(future)
+    future.add_done_callback(on_published)
+    if confirm:
+        await asyncio.gather(future, return_exceptions=True)
 
 
 if __name__ == "__main__":
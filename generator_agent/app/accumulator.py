@@ -1,12 +1,37 @@
 import re
 
+# Tokens the accumulator looks for in markup: comment starts, closing tags and opening tags of the elements whose content
+# is raw text, where anything looking like a tag is just text until the element's own closing tag
+TOKEN_RE = re.compile(r"<(?:(!--)|/([^>]*)>|(script|style)(?=[\s/>])[^>]*>)", re.IGNORECASE)
+RAW_TEXT_END_RE = {name: re.compile(rf"</{name}(?=[\s/>])", re.IGNORECASE) for name in ("script", "style")}
+# Held back at the end of raw text when they may be the start of its closing tag, e.g. "</scr"
+MAX_PARTIAL_TOKEN = len("</script")
+
+DATA = "data"
+COMMENT = "comment"
+RAW_TEXT = "raw_text"
+
 
 class TagAccumulator:
-    CLOSE_TAG_RE = re.compile(r"</[^>]+>")
+    """
+    Buffers streamed html and hands it back in pieces that end with a closing tag.
+    Scans every character once: text already scanned is only kept to be returned, and each chunk resumes scanning where
+    the last one stopped, in the same state. Closing tags split across chunks are completed by the next chunk, and
+    closing tags inside comments or <script>/<style> content do not end a piece.
+    """
 
     def __init__(self):
-        self.buffer = ""
         self.done = False
+        # Scanned text not returned yet, kept as chunks so a long element does not copy the buffer on every chunk
+        self._held: list[str] = []
+        # Not scanned yet, the start of a token that may continue in the next chunk
+        self._tail = ""
+        self._state = DATA
+        self._raw_text_end: re.Pattern | None = None
+
+    @property
+    def buffer(self) -> str:
+        return "".join(self._held) + self._tail
 
     def append_and_return_html(self, chunk: str) -> str:
         """
@@ -16,24 +41,67 @@ class TagAccumulator:
         """
         if self.done:
             return ""
-        self.buffer += chunk
-
-        matches = list(self.CLOSE_TAG_RE.finditer(self.buffer))
-        if not matches:
+        text = self._tail + chunk
+        end, scanned = self._scan(text)
+        self._tail = text[scanned:]
+        if end < 0:
+            self._held.append(text[:scanned])
             return ""
 
-        last_match = matches[-1]
-        end = last_match.end()
-        result = self.buffer[:end]
-        if "</html>" in result:
-            self.done = True
-        self.buffer = self.buffer[end:]
+        result = "".join(self._held) + text[:end]
+        self._held.clear()
+        if end < scanned:
+            self._held.append(text[end:scanned])
         return result
 
+    def _scan(self, text: str) -> tuple[int, int]:
+        """
+        Advances the tokenizer over text
+        :return: (end of the last closing tag or -1, how much of text was scanned)
+        """
+        end = -1
+        pos = 0
+        while True:
+            if self._state == COMMENT:
+                close = text.find("-->", pos)
+                if close < 0:
+                    return end, max(pos, len(text) - 2)
+                pos = close + 3
+                self._state = DATA
+            elif self._state == RAW_TEXT:
+                match = self._raw_text_end.search(text, pos)
+                if match is None:
+                    return end, max(pos, len(text) - MAX_PARTIAL_TOKEN)
+                close = text.find(">", match.end())
+                if close < 0:
+                    return end, match.start()
+                end = pos = close + 1
+                self._state = DATA
+            else:
+                match = TOKEN_RE.search(text, pos)
+                if match is None:
+                    # A tag without its ">" yet is scanned again once the next chunk completes it
+                    partial = text.rfind("<", pos)
+                    if partial >= 0 and text.find(">", partial) < 0:
+                        return end, partial
+                    return end, len(text)
+                pos = match.end()
+                if match.group(1):
+                    self._state = COMMENT
+                elif match.group(3):
+                    self._raw_text_end = RAW_TEXT_END_RE[match.group(3).lower()]
+                    self._state = RAW_TEXT
+                else:
+                    end = pos
+                    if match.group(2).strip().lower() == "html":
+                        self.done = True
+                        return end, end
+
     def drain_buffer(self) -> str:
         """
         Returns whatever remains in the buffer and clears it.
         """
         leftover = self.buffer
-        self.buffer = ""
+        self._held = []
+        self._tail = ""
         return leftover
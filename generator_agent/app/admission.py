@@ -0,0 +1,65 @@
+import os
+from typing import Callable
+
+from fastapi.responses import StreamingResponse
+
+from common.client import BULK, PRIORITY
+from common.model import SendTaskStreamingRequest
+
+# Bulk tasks, marked with metadata priority "bulk", run at most this many at once so pre-generating many sites does not
+# starve interactive sessions, which are always admitted. Bulk tasks turned away are retried by the client or pubsub
+MAX_BULK_TASKS = int(os.getenv("MAX_BULK_TASKS", "2"))
+BULK_RETRY_AFTER_S = int(os.getenv("BULK_RETRY_AFTER_S", "5"))
+
+
+def is_bulk(task_request: SendTaskStreamingRequest) -> bool:
+    return (task_request.params.metadata or {}).get(PRIORITY) == BULK
+
+
+class BulkSlots:
+    """
+    Counts the bulk tasks running. Every admitted task gets a release callback, which frees its slot the first time it
+    is called, so the code paths that may end a task can all call it without freeing more slots than were taken.
+    """
+
+    def __init__(self, max_tasks: int = MAX_BULK_TASKS):
+        self.max_tasks = max_tasks
+        self.running = 0
+
+    def admit(self, task_request: SendTaskStreamingRequest) -> Callable[[], None] | None:
+        """
+        Takes a bulk slot for the task
+        :return: callback releasing the slot, to be called once the task is done.
+                 None if the task is bulk and all bulk slots are taken
+        """
+        if not is_bulk(task_request):
+            return lambda: None
+        if self.running >= self.max_tasks:
+            return None
+        self.running += 1
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.running -= 1
+
+        return release
+
+
+class ReleasingStreamingResponse(StreamingResponse):
+    """
+    Streaming response that calls `release` once the response is over: streamed to the end, failed, or cut short by
+    a client that went away, even before the first event, when the event generator never runs
+    """
+
+    def __init__(self, content, release: Callable[[], None], **kwargs):
+        super().__init__(content, **kwargs)
+        self._release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
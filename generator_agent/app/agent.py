@@ -1,4 +1,6 @@
+import hashlib
 import logging
+import os
 from typing import Any, Dict, AsyncIterable, Literal
 
 from langchain_community.tools import TavilySearchResults
@@ -8,6 +10,7 @@ from langgraph.prebuilt import create_react_agent
 from pydantic import BaseModel, Field
 
 from generate_image import generate_image
+from generation_cache import normalize
 from instruction_reader import get_instructions
 
 logging.basicConfig(level=logging.INFO, )
@@ -15,6 +18,15 @@ logger = logging.getLogger(__name__)
 
 memory = MemorySaver()
 
+# Has the model answer once more after streaming, re-emitting the whole page as a structured response with a status.
+# Off by default: that doubles the output tokens of every page, instead the page is assembled from the streamed output
+# and a complete page (ending with </html>) means the task is completed
+STRUCTURED_RESPONSE = os.getenv("GENERATOR_STRUCTURED_RESPONSE", "false").lower() == "true"
+MODEL = "gpt-4.1"
+# Messages telling the agent the ids it passes to its tools, they precede every query
+SESSION_ID_PREFIX = "Your session id is: "
+TASK_ID_PREFIX = "Your task id is: "
+
 class ResponseFormat(BaseModel):
     """Respond to the user in this format."""
     status: Literal["input_required", "completed", "error"] = "input_required"
@@ -22,39 +34,89 @@ class ResponseFormat(BaseModel):
 
 
 class HTMLAgent:
-    SYSTEM_INSTRUCTION = get_instructions("generator_system_prompt")
 
-    def __init__(self):
+    def __init__(self, structured_response: bool = STRUCTURED_RESPONSE):
+        """
+        :param structured_response: get the final page and status from a structured output pass after streaming
+        """
+        self.structured_response = structured_response
+        system_instruction = get_instructions("generator_system_prompt", structured_response=structured_response)
+        # Changes with the model or the prompt, so pages generated by an older version are not reused
+        self.version = hashlib.sha256(f"{MODEL}\0{system_instruction}".encode("utf-8")).hexdigest()[:16]
         search_tool = TavilySearchResults(
             max_results=5,
             include_raw_content=True,
             include_images=True,
         )
 
-        self.model = ChatOpenAI(model="gpt-4.1", temperature=0)
+        self.model = ChatOpenAI(model=MODEL, temperature=0)
         self.tools = [generate_image, search_tool]
 
         self.graph = create_react_agent(
-            self.model, tools=self.tools, checkpointer=memory, prompt=self.SYSTEM_INSTRUCTION,
-            response_format=ResponseFormat
+            self.model, tools=self.tools, checkpointer=memory, prompt=system_instruction,
+            response_format=ResponseFormat if structured_response else None
         )
 
     def invoke(self, query, sessionId):
         config = {"configurable": {"thread_id": sessionId}}
-        self.graph.invoke({"messages": [("user", query)]}, config)
+        result = self.graph.invoke({"messages": [("user", query)]}, config)
+        if not self.structured_response:
+            return self.get_streamed_response(result["messages"][-1].content)
         return self.get_agent_response(config)
 
+    @staticmethod
+    def _messages(query: str, session_id: str, task_id: str) -> list[tuple[str, str]]:
+        return [("user", f"{SESSION_ID_PREFIX}{session_id}."),
+                ("user", f"{TASK_ID_PREFIX}{task_id}."),
+                ("user", query)]
+
+    async def history(self, session_id: str, query: str) -> str:
+        """
+        Digest of the queries the session had before, empty if there were none. Session and task ids, answers and
+        repeats of the query itself are left out, so re-running a query, or replaying it with remember, keeps the digest
+        """
+        state = await self.graph.aget_state({"configurable": {"thread_id": session_id}})
+        messages = state.values.get("messages", []) if state else []
+        query = normalize(query)
+        queries: dict[str, None] = {}
+        for message in messages:
+            if message.type != "human" or not isinstance(message.content, str):
+                continue
+            if message.content.startswith((SESSION_ID_PREFIX, TASK_ID_PREFIX)):
+                continue
+            earlier = normalize(message.content)
+            if earlier != query:
+                queries[earlier] = None
+        if not queries:
+            return ""
+        return hashlib.sha256("\0".join(queries).encode("utf-8")).hexdigest()
+
+    async def remember(self, query: str, session_id: str, task_id: str, answer: str):
+        """
+        Adds a turn answered without running the agent, e.g. from a cache, to the session's messages, so follow-up
+        queries of the session see it
+        """
+        config = {"configurable": {"thread_id": session_id}}
+        messages = self._messages(query, session_id, task_id) + [("ai", answer)]
+        await self.graph.aupdate_state(config, {"messages": messages}, as_node="agent")
+
     async def stream(self, query: str, session_id: str, task_id: str) -> AsyncIterable[Dict[str, Any]]:
-        inputs = {"messages": [("user", f"Your session id is: {session_id}."),
-                               ("user", f"Your task id is: {task_id}."),
-                               ("user", query)]}
+        inputs = {"messages": self._messages(query, session_id, task_id)}
 
         config = {"configurable": {"thread_id": session_id}}
 
+        # Content of the agent message being streamed, the answer once the graph is done. Earlier messages of the run
+        # are the agent's text before tool calls
+        message_id = None
+        answer: list[str] = []
         async for mode, data  in self.graph.astream(inputs, config, stream_mode=["messages", "values"]):
             if mode == "messages":
                 chunk, metadata = data
                 if metadata["langgraph_node"] == "agent" and chunk.content:
+                    if chunk.id != message_id:
+                        message_id = chunk.id
+                        answer = []
+                    answer.append(chunk.content)
                     yield {
                         "is_task_complete": False,
                         "require_user_input": False,
@@ -63,7 +125,28 @@ class HTMLAgent:
             if mode == "values":
                 logger.info(data["messages"][-1].pretty_repr())
 
-        yield self.get_agent_response(config)
+        if self.structured_response:
+            yield self.get_agent_response(config)
+        else:
+            yield self.get_streamed_response("".join(answer))
+
+    @staticmethod
+    def get_streamed_response(content: str) -> Dict[str, Any]:
+        """
+        Status of an answer without structured output: a complete page is a completed task, anything else is the
+        agent asking the user for more information
+        """
+        if "</html>" in content.lower():
+            return {
+                "is_task_complete": True,
+                "require_user_input": False,
+                "content": content
+            }
+        return {
+            "is_task_complete": False,
+            "require_user_input": True,
+            "content": content or "We are unable to process your request at the moment. Please try again."
+        }
 
     def get_agent_response(self, config):
         current_state = self.graph.get_state(config)
@@ -73,13 +156,13 @@ class HTMLAgent:
                 return {
                     "is_task_complete": False,
                     "require_user_input": True,
-                    "content": structured_response.message
+                    "content": structured_response.html_output
                 }
             elif structured_response.status == "error":
                 return {
                     "is_task_complete": False,
                     "require_user_input": True,
-                    "content": structured_response.message
+                    "content": structured_response.html_output
                 }
             elif structured_response.status == "completed":
                 return {
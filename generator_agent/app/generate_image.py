@@ -1,24 +1,83 @@
 import asyncio
-import json
+import hashlib
 import logging
 import os
+import time
 import uuid
+from collections import OrderedDict
 
 from dotenv import load_dotenv
 from langchain_core.tools import tool
 from openai import AsyncOpenAI
 
 from common.constants import GENERATOR_AGENT_TOPIC
+from common.http_client import get_client
 from common.model import Artifact, Task, TaskState, TaskStatus, SendTaskResponse, FilePart, FileContent
 from common.utils import publish_to_topic
+from image_bucket import ImageBucket
+from image_cache import ImageCache
 
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
 PUBSUB_URL = os.environ.get("PUBSUB_URL", "http://localhost:8000")
+# Where this agent serves stored images. Only the instance that stored an image serves it
+IMAGE_URL = os.getenv("GENERATOR_IMAGE_URL", os.getenv("RECEIVE_URL", "http://localhost:8080"))
+# Cloud Storage bucket stored images are copied to and sent from, so that every instance's images can be fetched when
+# the agent runs on several instances
+IMAGE_BUCKET = os.getenv("GENERATOR_IMAGE_BUCKET", "")
+# Address the bucket is read from, defaults to its public storage.googleapis.com url
+IMAGE_BUCKET_URL = os.getenv("GENERATOR_IMAGE_BUCKET_URL", "")
+# DALL-E urls expire after an hour. Without a bucket, images are sent with their DALL-E url until then, which receivers
+# can fetch whichever instance generated the image
+DALLE_URL_TTL_S = float(os.getenv("GENERATOR_DALLE_URL_TTL_S", "3000"))
+MAX_DALLE_URLS = 1000
+
+IMAGE_MODEL = "dall-e-3"
+IMAGE_SIZE = "1024x1024"
+IMAGE_QUALITY = "standard"
+
+# Images generated per task are remembered for this many tasks, so a generation replayed from the cache can send its
+# images again
+MAX_TASK_IMAGES = 1000
 
 client = AsyncOpenAI()
+images = ImageCache()
+bucket = ImageBucket(IMAGE_BUCKET, IMAGE_BUCKET_URL) if IMAGE_BUCKET else None
+task_images: OrderedDict[str, list[FileContent]] = OrderedDict()
+# image digest -> (DALL-E url, time.monotonic() when it stops being sent)
+dalle_urls: OrderedDict[str, tuple[str, float]] = OrderedDict()
+
+
+def images_of(task_id: str) -> list[FileContent]:
+    """
+    Images generated for the task, with the uri of their stored copy. The same list is filled in as later images of the
+    task complete
+    """
+    sent = task_images.get(task_id)
+    if sent is None:
+        sent = task_images[task_id] = []
+        if len(task_images) > MAX_TASK_IMAGES:
+            task_images.popitem(last=False)
+    return sent
+
+
+async def image_location(digest: str) -> str:
+    """
+    Uri to send for a stored image: its copy in the bucket, without one its DALL-E url while it is valid, then the copy
+    served by this instance
+    """
+    if bucket is not None:
+        try:
+            return await bucket.upload(digest, images.path(digest))
+        except Exception as e:
+            logger.error(f"Error copying image {digest} to bucket {bucket.name}: {e}")
+    url, expires_at = dalle_urls.get(digest, ("", 0.0))
+    if url and time.monotonic() < expires_at:
+        return url
+    dalle_urls.pop(digest, None)
+    return f"{IMAGE_URL}/images/{digest}.png"
 
 
 # TODO: this is a task manager responsibility, but need to properly engineer task manager to move it there
@@ -39,28 +98,54 @@ async def send_task_response(task_id: str, session_id: str, image_name: str, ima
 
     response = SendTaskResponse(result=task)
 
-    await publish_to_topic(GENERATOR_AGENT_TOPIC, response.model_dump(exclude_none=True), task_id)
+    await publish_to_topic(GENERATOR_AGENT_TOPIC, response, task_id)
 
 
 async def _generate_and_send_image(session_id: str, task_id: str, prompt: str, image_name: str):
-    try:
+    dalle_url = None
+
+    async def generate() -> bytes:
+        nonlocal dalle_url
         result = await client.images.generate(
-            model="dall-e-3",
+            model=IMAGE_MODEL,
             prompt=prompt,
             n=1,
-            size="1024x1024",
+            size=IMAGE_SIZE,
             response_format="url",
-            quality="standard"
+            quality=IMAGE_QUALITY
         )
+        dalle_url = result.data[0].url
+        response = await get_client().get(dalle_url, timeout=60)
+        response.raise_for_status()
+        image = response.content
+        dalle_urls[hashlib.sha256(image).hexdigest()] = (dalle_url, time.monotonic() + DALLE_URL_TTL_S)
+        if len(dalle_urls) > MAX_DALLE_URLS:
+            dalle_urls.popitem(last=False)
+        return image
 
-        json_response = json.loads(result.model_dump_json())
-        image_url = json_response["data"][0]["url"]
-
-        # Send task response
-        await send_task_response(task_id, session_id, image_name, image_url)
+    try:
+        # An image already generated for the same prompt is sent right away, and the same prompt asked for again while
+        # it is being generated waits for that image
+        key = images.key(prompt, IMAGE_MODEL, IMAGE_SIZE, IMAGE_QUALITY)
+        digest, reused = await images.get_or_generate(key, generate)
+        logger.info(f"[{task_id}] {'Reusing' if reused else 'Generated'} image {digest} for {image_name}")
+        location = await image_location(digest)
+        # Replays of the page come later, when the DALL-E url may have expired
+        in_bucket = bucket is not None and location == bucket.uri(digest)
+        stored = location if in_bucket else f"{IMAGE_URL}/images/{digest}.png"
+        images_of(task_id).append(FileContent(name=image_name, uri=stored, mimeType="image/png"))
+    except Exception as e:
+        if dalle_url is None:
+            logger.error(f"[{task_id}] Error generating image: {e}")
+            return
+        # The image was generated but could not be stored, its DALL-E url still works for an hour
+        logger.error(f"[{task_id}] Error storing image, sending its DALL-E url: {e}")
+        location = dalle_url
 
+    try:
+        await send_task_response(task_id, session_id, image_name, location)
     except Exception as e:
-        logger.error(f"[{task_id}] Error generating or sending image: {e}")
+        logger.error(f"[{task_id}] Error sending image: {e}")
 
 
 @tool
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+from common.model import FileContent
+
+# Generated sites are kept this long, 0 disables the cache
+GENERATION_CACHE_TTL_S = float(os.getenv("GENERATION_CACHE_TTL_S", "86400"))
+# Least recently used generations are evicted once the cached html adds up to more characters than this
+GENERATION_CACHE_MAX_CHARS = int(os.getenv("GENERATION_CACHE_MAX_CHARS", str(50_000_000)))
+# Specs about things that change during the day are only cached briefly, 0 to never cache them
+GENERATION_CACHE_TIME_SENSITIVE_PATTERN = os.getenv(
+    "GENERATION_CACHE_TIME_SENSITIVE_PATTERN",
+    r"\b(weather|forecasts?|prices?|stocks?|exchange rates?|news|scores?|today|tonight|tomorrow)\b")
+GENERATION_CACHE_TIME_SENSITIVE_TTL_S = float(os.getenv("GENERATION_CACHE_TIME_SENSITIVE_TTL_S", "600"))
+# TaskSendParams.metadata key shortening the ttl of a task's generation, 0 opts the task out of the cache
+CACHE_TTL_METADATA = "cacheTtlSeconds"
+# TaskSendParams.metadata key marking a query that refers to earlier turns of its session, e.g. "make the header blue".
+# Only those are keyed by the session's history, other queries are complete specs
+FOLLOW_UP_METADATA = "followUp"
+
+
+@dataclass
+class Generation:
+    # Html pieces in the order they were streamed, each ending with a closing tag
+    pieces: list[str]
+    # Content of the completed task
+    page: str
+    # time.monotonic() when it was generated
+    created_at: float
+    ttl_s: float
+    size: int
+    # Images the agent generated for the page, filled in as they complete, which may be after the page
+    images: list[FileContent]
+
+
+def normalize(spec: str) -> str:
+    """
+    Spec text as it is hashed: unicode normalized, with runs of whitespace collapsed, so re-running a spec that was
+    only re-wrapped or re-indented still hits the cache
+    """
+    return " ".join(unicodedata.normalize("NFC", spec).split())
+
+
+class GenerationCache:
+    """
+    Generated sites by a hash of their normalized spec and the version of the agent that generated them, and of the
+    session's history for follow-up queries, so re-running an unchanged spec replays the site instead of running the
+    model, search and image generation again.
+    Generations expire after their ttl and the least recently used ones are evicted past `max_chars` of html.
+    """
+
+    def __init__(self,
+                 ttl_s: float = GENERATION_CACHE_TTL_S,
+                 max_chars: int = GENERATION_CACHE_MAX_CHARS,
+                 time_sensitive_pattern: str = GENERATION_CACHE_TIME_SENSITIVE_PATTERN,
+                 time_sensitive_ttl_s: float = GENERATION_CACHE_TIME_SENSITIVE_TTL_S):
+        self.ttl_s = ttl_s
+        self.max_chars = max_chars
+        self._time_sensitive = re.compile(time_sensitive_pattern, re.IGNORECASE) if time_sensitive_pattern else None
+        self._time_sensitive_ttl_s = time_sensitive_ttl_s
+        self._generations: OrderedDict[str, Generation] = OrderedDict()
+        self._size = 0
+
+    @staticmethod
+    def key(spec: str, version: str, history: str = "") -> str:
+        """
+        :param version: identifies the model and prompt template, generations of other versions are never hit
+        :param history: digest of the session's earlier queries, for follow-ups such as "make the header blue", which
+                        only hit in a session with the same history
+        """
+        return hashlib.sha256(f"{version}\0{history}\0{normalize(spec)}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_follow_up(metadata: dict[str, Any] | None = None) -> bool:
+        return bool((metadata or {}).get(FOLLOW_UP_METADATA))
+
+    def ttl_for(self, spec: str, metadata: dict[str, Any] | None = None) -> float:
+        """
+        How long the generation of a spec is cached, 0 if it must not be cached nor replayed
+        :param metadata: task metadata, CACHE_TTL_METADATA sets a shorter ttl
+        """
+        ttl_s = (metadata or {}).get(CACHE_TTL_METADATA)
+        if ttl_s is not None:
+            return max(0.0, min(float(ttl_s), self.ttl_s))
+        if self._time_sensitive is not None and self._time_sensitive.search(spec):
+            return min(self._time_sensitive_ttl_s, self.ttl_s)
+        return self.ttl_s
+
+    def get(self, key: str, max_age_s: float) -> Generation | None:
+        """
+        :param max_age_s: ttl of the task asking, a generation cached for longer is not replayed if older than this
+        """
+        generation = self._generations.get(key)
+        if generation is None:
+            return None
+        age_s = time.monotonic() - generation.created_at
+        if age_s >= generation.ttl_s:
+            self._remove(key)
+            return None
+        if age_s >= max_age_s:
+            return None
+        self._generations.move_to_end(key)
+        return generation
+
+    def put(self, key: str, pieces: list[str], page: str, ttl_s: float, images: list[FileContent] | None = None):
+        """
+        :param images: images of the page, kept by reference so images completing later are replayed as well
+        """
+        if ttl_s <= 0:
+            return
+        generation = Generation(list(pieces), page, time.monotonic(), ttl_s,
+                                sum(len(piece) for piece in pieces) + len(page), images if images is not None else [])
+        if generation.size > self.max_chars:
+            return
+        self._remove(key)
+        self._generations[key] = generation
+        self._size += generation.size
+        while self._size > self.max_chars:
+            self._remove(next(iter(self._generations)))
+
+    def _remove(self, key: str):
+        generation = self._generations.pop(key, None)
+        if generation is not None:
+            self._size -= generation.size
@@ -0,0 +1,50 @@
+import asyncio
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class ImageBucket:
+    """
+    Copies of stored images in a Cloud Storage bucket, by digest. Every instance of the agent stores images on its own
+    disk, the copies give them an address receivers can fetch whichever instance stored the image.
+    The bucket must be readable by the receivers, e.g. public, or `url` points at something serving it.
+    Needs the google-cloud-storage package.
+    """
+
+    def __init__(self, name: str, url: str = ""):
+        self.name = name
+        self.url = url or f"https://storage.googleapis.com/{name}"
+        # Created on first upload, so the agent starts without credentials when no image is generated
+        self._bucket = None
+        self._uploaded: set[str] = set()
+
+    def uri(self, digest: str) -> str:
+        return f"{self.url}/images/{digest}.png"
+
+    async def upload(self, digest: str, path: Path | None) -> str:
+        """
+        Copies a stored image to the bucket unless it is there already
+        :param path: the stored image, None if it is not stored
+        :return: uri of the copy
+        """
+        if digest not in self._uploaded:
+            if path is None:
+                raise FileNotFoundError(f"Image {digest} is not stored")
+            await asyncio.to_thread(self._upload, digest, path)
+            self._uploaded.add(digest)
+        return self.uri(digest)
+
+    def _upload(self, digest: str, path: Path):
+        if self._bucket is None:
+            from google.cloud import storage
+            self._bucket = storage.Client().bucket(self.name)
+        blob = self._bucket.blob(f"images/{digest}.png")
+        # Images are stored by content, another instance may have copied it already
+        if blob.exists():
+            return
+        # Stored by content, the image under a name never changes
+        blob.cache_control = "public, max-age=31536000, immutable"
+        blob.upload_from_filename(str(path), content_type="image/png")
+        logger.info(f"Copied image {digest} to bucket {self.name}")
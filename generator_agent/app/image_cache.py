@@ -0,0 +1,159 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# Generated images are stored here by the sha256 of their content, with a small file per prompt pointing at its image
+IMAGE_CACHE_DIR = os.getenv("GENERATOR_IMAGE_CACHE_DIR", "./image_cache")
+# Least recently used images are deleted once the stored images take more than this
+IMAGE_CACHE_MAX_MB = int(os.getenv("GENERATOR_IMAGE_CACHE_MAX_MB", "1024"))
+
+DIGEST_RE = re.compile(r"[0-9a-f]{64}")
+
+
+def normalize(prompt: str) -> str:
+    """
+    Prompt text as it is hashed: unicode normalized, case folded, with runs of whitespace collapsed and trailing
+    punctuation dropped, so the same image asked for again with a slightly different wording of the same text is reused
+    """
+    return " ".join(unicodedata.normalize("NFKC", prompt).casefold().split()).rstrip(" .!")
+
+
+class ImageCache:
+    """
+    Content addressed store of generated images on local disk.
+    Prompts map to the digest of their image, so identical prompts and different prompts that produced the same bytes
+    share a file. Concurrent requests for a prompt that is not stored yet wait for a single generation.
+    Images are evicted least recently used first, by file modification time, which hits refresh, so the order
+    survives restarts.
+    """
+
+    def __init__(self, directory: str = IMAGE_CACHE_DIR, max_bytes: int = IMAGE_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._blobs = self.directory / "blobs"
+        self._keys = self.directory / "keys"
+        # digest -> size, least recently used first. Loaded from disk on first use
+        self._sizes: OrderedDict[str, int] | None = None
+        self._size = 0
+        self._in_flight: dict[str, asyncio.Future] = {}
+        # The disk work runs in worker threads, one at a time
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(prompt: str, model: str, size: str, quality: str) -> str:
+        return hashlib.sha256(f"{model}\0{size}\0{quality}\0{normalize(prompt)}".encode("utf-8")).hexdigest()
+
+    def path(self, digest: str) -> Path | None:
+        """
+        File of a stored image, None if the digest is not a digest or the image is not stored
+        """
+        if not DIGEST_RE.fullmatch(digest):
+            return None
+        path = self._blobs / f"{digest}.png"
+        return path if path.is_file() else None
+
+    async def get(self, key: str) -> str | None:
+        """
+        :return: digest of the image stored for the key
+        """
+        return await asyncio.to_thread(self._get, key)
+
+    async def get_or_generate(self, key: str, generate: Callable[[], Awaitable[bytes]]) -> tuple[str, bool]:
+        """
+        Returns the stored image of the key, generating and storing it if there is none.
+        Callers asking for a key while it is being generated wait for that generation, and see its error if it fails.
+        :param generate: returns the png bytes of a new image
+        :return: (digest, True if the image was stored or generated by another caller)
+        """
+        digest = await self.get(key)
+        if digest is not None:
+            return digest, True
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            return await asyncio.shield(in_flight), True
+
+        in_flight = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = in_flight
+        try:
+            digest = await asyncio.to_thread(self._put, key, await generate())
+            in_flight.set_result(digest)
+            return digest, False
+        except asyncio.CancelledError:
+            in_flight.cancel()
+            raise
+        except Exception as e:
+            in_flight.set_exception(e)
+            # Nobody may be waiting, which would log the exception as never retrieved
+            in_flight.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    def _load(self) -> OrderedDict[str, int]:
+        if self._sizes is None:
+            self._blobs.mkdir(parents=True, exist_ok=True)
+            self._keys.mkdir(parents=True, exist_ok=True)
+            blobs = sorted((path.stat().st_mtime, path.stem, path.stat().st_size) for path in self._blobs.glob("*.png"))
+            self._sizes = OrderedDict((digest, size) for _, digest, size in blobs)
+            self._size = sum(self._sizes.values())
+        return self._sizes
+
+    def _get(self, key: str) -> str | None:
+        with self._lock:
+            return self._get_locked(key)
+
+    def _get_locked(self, key: str) -> str | None:
+        sizes = self._load()
+        key_path = self._keys / key
+        if not key_path.is_file():
+            return None
+        digest = key_path.read_text().strip()
+        if digest not in sizes:
+            # The image was evicted
+            key_path.unlink(missing_ok=True)
+            return None
+        sizes.move_to_end(digest)
+        os.utime(self._blobs / f"{digest}.png")
+        return digest
+
+    def _put(self, key: str, image: bytes) -> str:
+        with self._lock:
+            return self._put_locked(key, image)
+
+    def _put_locked(self, key: str, image: bytes) -> str:
+        sizes = self._load()
+        digest = hashlib.sha256(image).hexdigest()
+        path = self._blobs / f"{digest}.png"
+        if digest in sizes:
+            os.utime(path)
+            sizes.move_to_end(digest)
+        else:
+            # Written aside and renamed, so a crash never leaves a partial image under its digest
+            partial = path.with_suffix(".partial")
+            partial.write_bytes(image)
+            partial.replace(path)
+            sizes[digest] = len(image)
+            self._size += len(image)
+        (self._keys / key).write_text(digest)
+        self._evict(keep=digest)
+        return digest
+
+    def _evict(self, keep: str):
+        sizes = self._sizes
+        while self._size > self.max_bytes and len(sizes) > 1:
+            digest, size = next(iter(sizes.items()))
+            if digest == keep:
+                break
+            del sizes[digest]
+            self._size -= size
+            (self._blobs / f"{digest}.png").unlink(missing_ok=True)
+            logger.info(f"Evicted image {digest}, {self._size} bytes stored")
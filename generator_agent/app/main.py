@@ -4,21 +4,29 @@ import os
 import uvicorn
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request, BackgroundTasks, Body
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, FileResponse
 
-from common.google_pub_sub import extract_pubsub_message
-from common.model import JSONRPCResponse, JSONRPCError, A2ARequest, SendTaskStreamingRequest
-from task_manager import execute_task, handle_error
+from common.google_pub_sub import push_request_id, validate_push
+from common.idempotency import IdempotencyCache, IDEMPOTENCY_KEY_HEADER
+from common.model import JSONRPCResponse, JSONRPCError, A2ARequest, SendTaskStreamingRequest, dump_json
+from common.utils import lifespan
+from generate_image import images
+from admission import BulkSlots, ReleasingStreamingResponse, BULK_RETRY_AFTER_S
+from task_manager import execute_task, handle_error, stream_task
 
 logging.basicConfig(level=logging.INFO, )
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 RECEIVE_URL = os.getenv("RECEIVE_URL", "http://0.0.0.0:8080")
 
+# Pubsub may deliver a task more than once, drop the duplicates instead of running the agent again
+processed_messages = IdempotencyCache()
+bulk_slots = BulkSlots()
+
 
 @app.get("/.well-known/agent.json")
 async def get_agent_card():
@@ -53,38 +61,82 @@ async def get_agent_card():
 
 @app.post("/")
 async def handle_jsonrpc(request: Request, background_tasks: BackgroundTasks):
-    body = await request.json()
-    pub_sub_message = extract_pubsub_message(body)
+    body = await request.body()
 
     try:
-        json_rpc_request = A2ARequest.validate_python(pub_sub_message)
+        json_rpc_request = validate_push(body, A2ARequest, request.headers.get("content-type"),
+                                         request.headers.get("content-encoding"))
     except Exception as e:
         # TODO: properly handle error
         return JSONResponse(
             JSONRPCResponse(
-                id=body.get("id"),
+                id=push_request_id(body, request.headers.get("content-type"),
+                                   request.headers.get("content-encoding")),
                 error=JSONRPCError(code=-32600, message="Invalid JSON-RPC request", data=str(e))
             ).model_dump(exclude_none=True),
             status_code=400
         )
 
+    release = lambda: None
+    if isinstance(json_rpc_request, SendTaskStreamingRequest):
+        release = bulk_slots.admit(json_rpc_request)
+        # A turned away task is not recorded as processed, so its redelivery is not dropped
+        if release is None:
+            logger.info(f"Turning away bulk task {json_rpc_request.params.id}, all bulk slots are taken")
+            return JSONResponse({"status": "busy"}, status_code=429,
+                                headers={"Retry-After": str(BULK_RETRY_AFTER_S)})
+    idempotency_key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+    if processed_messages.contains(idempotency_key):
+        release()
+        logger.info(f"Skipping duplicate request {idempotency_key}")
+        return JSONResponse({"status": "duplicate"}, status_code=200)
+
+    streams_events = "text/event-stream" in request.headers.get("accept", "")
+    if isinstance(json_rpc_request, SendTaskStreamingRequest) and streams_events:
+        # Direct callers that accept server-sent events get the stream on this response instead of through pubsub.
+        # The response releases the bulk slot, also when the caller goes away before the stream started
+        response = ReleasingStreamingResponse(_sse(stream_task(json_rpc_request)), release,
+                                              media_type="text/event-stream")
+        processed_messages.mark(idempotency_key)
+        return response
+
     if isinstance(json_rpc_request, SendTaskStreamingRequest):
         # Assuming that execute_task is instantaneous and creates asyncio tasks for any difficult computations
-        response = await execute_task(json_rpc_request)
+        try:
+            response = await execute_task(json_rpc_request, release)
+        except Exception:
+            release()
+            raise
+        # Recorded only once the task started, a task that failed is processed again when pubsub redelivers it
+        processed_messages.mark(idempotency_key)
 
         logger.info(
             f"returning acknowledgement for session={json_rpc_request.params.sessionId} and task_id={json_rpc_request.params.id}")
-        return JSONResponse(response, status_code=200)
+        return Response(dump_json(response), status_code=200, media_type="application/json")
     else:
         response: JSONRPCResponse = JSONRPCResponse(
             response_method="tasks/send",
-            id=body.get("id"),
+            id=json_rpc_request.id,
             error=JSONRPCError(code=-32600, message="Invalid JSON-RPC request")
         )
-        await handle_error(response.model_dump(exclude_none=True), body.get("params", {}).get("id"))
+        await handle_error(response, json_rpc_request.params.id)
         return JSONResponse(response.model_dump(exclude_none=True), status_code=400)
 
 
+async def _sse(events):
+    async for event in events:
+        yield f"data: {event.model_dump_json(exclude_none=True)}\n\n"
+
+
+@app.get("/images/{name}")
+async def get_image(name: str):
+    path = images.path(name.removesuffix(".png"))
+    if path is None:
+        return JSONResponse(status_code=404, content={"detail": "Image not found"})
+    # Stored by content, the image under a name never changes
+    return FileResponse(path, media_type="image/png", headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+
 @app.get("/health")
 async def health():
     return {"status": "ok"}
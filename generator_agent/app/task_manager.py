@@ -1,12 +1,16 @@
 import asyncio
 import logging
+import re
+from typing import AsyncIterable, Callable
 
 from dotenv import load_dotenv
 
 from accumulator import TagAccumulator
+from generation_cache import GenerationCache
+from common.coalescer import ArtifactCoalescer, publish_coalesced
 from common.constants import GENERATOR_AGENT_TOPIC
 from common.model import TextPart, Message, Artifact, TaskStatus, TaskState, Task, SendTaskResponse, \
-    SendTaskStreamingRequest, SendTaskStreamingResponse, TaskStatusUpdateEvent, TaskArtifactUpdateEvent
+    SendTaskStreamingRequest, SendTaskStreamingResponse, TaskStatusUpdateEvent, TaskArtifactUpdateEvent, JSONRPCError
 from common.utils import publish_to_topic
 
 load_dotenv()
@@ -14,21 +18,20 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 
 from agent import agent
+from generate_image import images_of, send_task_response
 
+# Where the page starts in the streamed output, the agent may write some text before calling tools
+PAGE_START_RE = re.compile(r"<!doctype|<html", re.IGNORECASE)
 
-async def handle_error(response, task_id: str):
-    asyncio.create_task(publish_to_topic(GENERATOR_AGENT_TOPIC, response, task_id))
+# Re-running an unchanged spec replays its site instead of generating it again
+generations = GenerationCache()
 
 
-async def execute_task(task_request: SendTaskStreamingRequest):
-    params = task_request.params
-    query = params.message.parts[0].text
-    session_id = params.sessionId
-    task_id = params.id
+async def handle_error(response, task_id: str):
+    asyncio.create_task(publish_to_topic(GENERATOR_AGENT_TOPIC, response, task_id))
 
-    # Start the streaming agent in the background
-    asyncio.create_task(start_streaming_task(task_id, session_id, query))
 
+def submitted_response(task_id: str, session_id: str) -> SendTaskStreamingResponse:
     status = TaskStatus(
         state=TaskState.SUBMITTED,
         message=Message(
@@ -37,12 +40,60 @@ async def execute_task(task_request: SendTaskStreamingRequest):
         )
     )
     update: TaskStatusUpdateEvent = TaskStatusUpdateEvent(id=task_id, status=status, metadata={"sessionId": session_id})
-    response = SendTaskStreamingResponse(result=update).model_dump(exclude_none=True)
+    return SendTaskStreamingResponse(result=update)
+
+
+async def execute_task(task_request: SendTaskStreamingRequest, release: Callable[[], None]):
+    """
+    Starts the agent in the background, publishing its events to pubsub
+    :param release: releases the task's bulk slot, called once the agent is done
+    """
+    params = task_request.params
+    query = params.message.parts[0].text
+    session_id = params.sessionId
+    task_id = params.id
+
+    # Start the streaming agent in the background
+    task = asyncio.create_task(start_streaming_task(task_id, session_id, query, params.metadata))
+    task.add_done_callback(lambda _: release())
+
+    response = submitted_response(task_id, session_id)
     asyncio.create_task(publish_to_topic(GENERATOR_AGENT_TOPIC, response, task_id))
 
     return response
 
 
+async def stream_task(task_request: SendTaskStreamingRequest) -> AsyncIterable[SendTaskStreamingResponse]:
+    """
+    Runs the agent and yields its events to the caller directly, instead of publishing them to pubsub.
+    Every closed html tag is an artifact update, the complete page comes with the final COMPLETED status.
+    The response streaming the events releases the task's bulk slot, the generator may never run if the caller goes
+    away before the first event.
+    """
+    params = task_request.params
+    session_id = params.sessionId
+    task_id = params.id
+    metadata = {"sessionId": session_id}
+
+    try:
+        yield submitted_response(task_id, session_id)
+        async for html, is_task_completed in stream_html(task_id, session_id, params.message.parts[0].text,
+                                                         params.metadata):
+            if is_task_completed:
+                message = Message(role="agent", parts=[TextPart(text=html)])
+                status = TaskStatus(state=TaskState.COMPLETED, message=message)
+                yield SendTaskStreamingResponse(
+                    id=task_request.id,
+                    result=TaskStatusUpdateEvent(id=task_id, status=status, final=True, metadata=metadata))
+            else:
+                artifact = Artifact(parts=[TextPart(text=html)])
+                update = TaskArtifactUpdateEvent(id=task_id, artifact=artifact, metadata=metadata)
+                yield SendTaskStreamingResponse(id=task_request.id, result=update)
+    except Exception as e:
+        logger.exception(f"[{task_id}] Streaming task failed: {e}")
+        yield SendTaskStreamingResponse(id=task_request.id, error=JSONRPCError(code=-32603, message=str(e)))
+
+
 async def publish_task_response(task_id: str, session_id: str, content: str):
     task_status = TaskStatus(state=TaskState.COMPLETED)
     artifact = Artifact(parts=[TextPart(text=content)])
@@ -56,40 +107,84 @@ async def publish_task_response(task_id: str, session_id: str, content: str):
     )
 
     response = SendTaskResponse(result=task)
-    await publish_to_topic(GENERATOR_AGENT_TOPIC, response.model_dump(exclude_none=True), task_id)
-
+    await publish_to_topic(GENERATOR_AGENT_TOPIC, response, task_id)
 
-async def publish_artifact_update(task_id: str, session_id: str, content: str):
-    artifact = Artifact(parts=[TextPart(text=content)])
 
+async def publish_artifact_update(task_id: str, session_id: str, artifact: Artifact):
     update = TaskArtifactUpdateEvent(id=task_id, artifact=artifact, metadata={"sessionId": session_id})
 
     response = SendTaskStreamingResponse(result=update)
 
-    await publish_to_topic(GENERATOR_AGENT_TOPIC, response.model_dump(exclude_none=True), task_id)
+    await publish_to_topic(GENERATOR_AGENT_TOPIC, response, task_id)
+
 
+async def stream_html(task_id: str, session_id: str, query: str,
+                      metadata: dict | None = None) -> AsyncIterable[tuple[str, bool]]:
+    """
+    Streams the agent output as html
+    :param metadata: task metadata, may shorten how long the generation is cached, see generation_cache
+    :return: (html, is task completed) - closed tags while the agent generates, then the complete content.
+    Without the agent's structured response pass, the complete content is the streamed page, as soon as </html> arrives
+    """
+    history = await agent.history(session_id, query) if generations.is_follow_up(metadata) else ""
+    cache_key = generations.key(query, agent.version, history)
+    cache_ttl_s = generations.ttl_for(query, metadata)
+    cached = generations.get(cache_key, cache_ttl_s)
+    if cached is not None:
+        logger.info(f"[{task_id}] Replaying cached generation {cache_key}")
+        try:
+            # Follow-ups of the session build on the replayed page as if it had been generated
+            await agent.remember(query, session_id, task_id, cached.page)
+        except Exception as e:
+            logger.warning(f"[{task_id}] Failed to add the replayed page to the session: {e}")
+        # The page refers to its images by name, receivers fetch them from the image artifacts
+        for image in list(cached.images):
+            await send_task_response(task_id, session_id, image.name, image.uri)
+        for piece in cached.pieces:
+            yield piece, False
+        yield cached.page, True
+        return
 
-async def start_streaming_task(task_id: str, session_id: str, query: str):
     accumulator = TagAccumulator()
+    # Pieces streamed so far, the complete page once </html> arrives
+    page: list[str] = []
+    completed = False
     async for chunk in agent.stream(query, session_id, task_id):
         logger.info(f"Processing chunk from agent: {chunk}")
         content = chunk.get("content")
-        if not content:
+        # Reads on after completion, so the agent run finishes and its answer is kept in the session memory
+        if not content or completed:
             continue
 
-        is_task_completed = chunk.get("is_task_complete")
-
-        # TODO: handle the case when input is required
-        if is_task_completed:
-            await publish_task_response(task_id, session_id, content)
+        if chunk.get("is_task_complete"):
+            completed = True
+            generations.put(cache_key, page, content, cache_ttl_s, images_of(task_id))
+            yield content, True
+        elif chunk.get("require_user_input"):
+            # TODO: handle the case when input is required. The content sums up the answer already streamed
+            logger.info(f"[{task_id}] Agent requires user input: {content}")
         else:
             tag_html = accumulator.append_and_return_html(content)
             if not tag_html:
                 # Accumulate more text before publishing chunk.
                 continue
             logger.info(f"HTML tag exists: {tag_html}")
-            await publish_artifact_update(task_id, session_id, tag_html)
-
+            page.append(tag_html)
+            yield tag_html, False
+            if accumulator.done and not agent.structured_response:
+                completed = True
+                html = "".join(page)
+                start = PAGE_START_RE.search(html)
+                html = html[start.start():] if start else html
+                generations.put(cache_key, page, html, cache_ttl_s, images_of(task_id))
+                yield html, True
+
+
+async def start_streaming_task(task_id: str, session_id: str, query: str, metadata: dict | None = None):
+    # Closed tags are published in batches instead of one message per tag
+    coalescer = ArtifactCoalescer(lambda artifact: publish_artifact_update(task_id, session_id, artifact))
+    await publish_coalesced(stream_html(task_id, session_id, query, metadata), coalescer,
+                            lambda html: publish_task_response(task_id, session_id, html))
 
 if __name__ == "__main__":
     query = """
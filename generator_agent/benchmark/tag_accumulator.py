@@ -0,0 +1,101 @@
+"""
+Time spent in TagAccumulator while a page streams in, against the previous implementation that appended every chunk to
+one string and ran the closing tag regex over the whole buffer. That is quadratic when a long element has no closing
+tags in it, e.g. a large <style> block or a table whose cells are never closed.
+
+python tag_accumulator.py --size-kb 300
+python tag_accumulator.py --size-kb 500 --chunk-chars 4  # token sized chunks, the previous implementation takes minutes
+"""
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from accumulator import TagAccumulator  # noqa: E402
+
+
+class PreviousTagAccumulator:
+    CLOSE_TAG_RE = re.compile(r"</[^>]+>")
+
+    def __init__(self):
+        self.buffer = ""
+        self.done = False
+
+    def append_and_return_html(self, chunk: str) -> str:
+        if self.done:
+            return ""
+        self.buffer += chunk
+        matches = list(self.CLOSE_TAG_RE.finditer(self.buffer))
+        if not matches:
+            return ""
+        end = matches[-1].end()
+        result = self.buffer[:end]
+        if "</html>" in result:
+            self.done = True
+        self.buffer = self.buffer[end:]
+        return result
+
+
+def repeat(fragment: str, size: int) -> str:
+    return fragment * (size // len(fragment) + 1)
+
+
+def pages(size: int) -> dict[str, str]:
+    head = "<!DOCTYPE html><html><head><meta charset='utf-8'><title>Bakery</title>"
+    sections = repeat("<section class='menu'><h2>Sourdough</h2><p>Baked every morning with local flour.</p>"
+                      "<!-- price list --><ul><li>Loaf <b>$6</b></li><li>Half <b>$3</b></li></ul></section>", size)
+    css = repeat(".menu li:hover > b { color: #c0392b; transition: color .2s ease-in; }\n", size)
+    rows = repeat("<tr><td>Croissant<td>Butter, flour<td>$3.50\n", size)
+    return {
+        "sections": f"{head}</head><body>{sections}</body></html>",
+        "large style": f"{head}<style>{css}</style></head><body><p>Open daily</p></body></html>",
+        "unclosed table": f"{head}</head><body><table>{rows}</table></body></html>",
+    }
+
+
+def split(page: str, chunk_chars: int) -> list[str]:
+    # Model output arrives in chunks of varying size
+    rng = random.Random(0)
+    chunks = []
+    pos = 0
+    while pos < len(page):
+        step = rng.randint(1, 2 * chunk_chars - 1)
+        chunks.append(page[pos:pos + step])
+        pos += step
+    return chunks
+
+
+def measure(accumulator, chunks: list[str]) -> tuple[float, int]:
+    pieces = 0
+    start = time.perf_counter()
+    for chunk in chunks:
+        if accumulator.append_and_return_html(chunk):
+            pieces += 1
+    return time.perf_counter() - start, pieces
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TagAccumulator time per streamed page")
+    parser.add_argument("--size-kb", type=int, default=300, help="approximate page size")
+    parser.add_argument("--chunk-chars", type=int, default=16, help="average characters per streamed chunk")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per page, the fastest is reported")
+    parser.add_argument("--skip-previous", action="store_true", help="only run the current implementation")
+    args = parser.parse_args()
+
+    for name, page in pages(args.size_kb * 1024).items():
+        chunks = split(page, args.chunk_chars)
+        print(f"{name}: {len(page) // 1024}KB in {len(chunks)} chunks")
+        implementations = [("incremental", TagAccumulator)]
+        if not args.skip_previous:
+            implementations.append(("previous", PreviousTagAccumulator))
+        for label, accumulator in implementations:
+            elapsed, pieces = min(measure(accumulator(), chunks) for _ in range(args.repeat))
+            print(f"  {label:<12} {elapsed * 1000:10.1f}ms  {pieces} pieces")
+
+
+if __name__ == "__main__":
+    main()
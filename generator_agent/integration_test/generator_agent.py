@@ -31,10 +31,9 @@ async def send_task_to_agent_direct(session_id: str):
         message=message
     )
 
-    # TODO: I don't think model_dump is needed here because it's a pydantic model and model dump occurs later inside the client
-    response = await client.send_task_streaming(task_params)
-
-    print(response.model_dump())
+    # Events arrive as the agent generates them, without going through pubsub
+    async for event in client.send_task_streaming(task_params):
+        print(event.model_dump(exclude_none=True))
 
 
 async def send_task_to_agent_indirect(session_id: str):
@@ -46,7 +45,7 @@ async def send_task_to_agent_indirect(session_id: str):
     task_params = TaskSendParams(id=task_id, sessionId=session_id, message=message)
     request = SendTaskStreamingRequest(params=task_params, id=str(uuid.uuid4()))
 
-    await publish_to_topic(BUILDER_AGENT_TOPIC, request.model_dump(exclude_none=True), task_id)
+    await publish_to_topic(BUILDER_AGENT_TOPIC, request, task_id)
 
 
 async def tasks_completed():
@@ -66,7 +65,7 @@ async def test_invalid_request_type():
     task_params = TaskSendParams(id="test-task", sessionId="user-1-session-1", message=message)
     request = SendTaskRequest(params=task_params, id=str(uuid.uuid4()))
 
-    await publish_to_topic(BUILDER_AGENT_TOPIC, request.model_dump(exclude_none=True), "test-task")
+    await publish_to_topic(BUILDER_AGENT_TOPIC, request, "test-task")
 
 
 async def test_success():
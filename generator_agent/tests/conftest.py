@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# The generator's modules import each other by name, the way they run from generator_agent/app, and common from the
+# repository root
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
@@ -0,0 +1,84 @@
+import random
+import re
+
+import pytest
+
+from accumulator import TagAccumulator
+
+
+class PreviousTagAccumulator:
+    """
+    The whole-buffer regex tokenizer TagAccumulator replaced
+    """
+    CLOSE_TAG_RE = re.compile(r"</[^>]+>")
+
+    def __init__(self):
+        self.buffer = ""
+        self.done = False
+
+    def append_and_return_html(self, chunk: str) -> str:
+        if self.done:
+            return ""
+        self.buffer += chunk
+        matches = list(self.CLOSE_TAG_RE.finditer(self.buffer))
+        if not matches:
+            return ""
+        end = matches[-1].end()
+        result = self.buffer[:end]
+        if "</html>" in result:
+            self.done = True
+        self.buffer = self.buffer[end:]
+        return result
+
+
+FRAGMENTS = ["<section class='menu'>", "<h2>Sourdough</h2>", "<p>Baked every <b>morning</b></p>", "<br/>",
+             "<ul><li>Loaf</li><li>Half</li></ul>", "</section>", "<td>Croissant", "<img src='/images/a.png'>",
+             "text with a < sign and a > sign", "\n  ", "<div\nclass='x'>", "</div >"]
+
+
+def page(rng: random.Random) -> str:
+    body = "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 40)))
+    return f"<!DOCTYPE html><html><head><title>Bakery</title></head><body>{body}</body></html>"
+
+
+def split(text: str, rng: random.Random) -> list[str]:
+    cuts = sorted(rng.sample(range(1, len(text)), rng.randint(0, min(len(text) - 1, 60))))
+    return [text[start:end] for start, end in zip([0, *cuts], [*cuts, len(text)])]
+
+
+def feed(accumulator, chunks: list[str]) -> list[str]:
+    return [accumulator.append_and_return_html(chunk) for chunk in chunks]
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_matches_the_previous_tokenizer_on_any_chunking(seed):
+    rng = random.Random(seed)
+    chunks = split(page(rng), rng)
+    previous = PreviousTagAccumulator()
+    accumulator = TagAccumulator()
+    assert feed(accumulator, chunks) == feed(previous, chunks)
+    assert accumulator.done == previous.done
+    assert accumulator.drain_buffer() == previous.buffer
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_closing_tags_in_comments_and_raw_text_do_not_end_pieces(seed):
+    rng = random.Random(seed)
+    html = ("<html><head><style>p::after { content: '</p>'; }</style>"
+            "<script>if (a </b) document.write('</div>');</script></head>"
+            "<body><!-- old </section> --><p>Open</p></body></html>")
+    pieces = [piece for piece in feed(TagAccumulator(), split(html, rng)) if piece]
+    assert "".join(pieces) == html
+    ends = {match.end() for match in re.finditer(r"</style>|</script>|</head>|</p>|</body>|</html>", html)}
+    offset = 0
+    for piece in pieces:
+        offset += len(piece)
+        assert offset in ends
+
+
+def test_stops_at_the_end_of_the_page():
+    accumulator = TagAccumulator()
+    assert accumulator.append_and_return_html("<html><p>a</p></html>trailing</p>") == "<html><p>a</p></html>"
+    assert accumulator.done
+    assert accumulator.append_and_return_html("<p>more</p>") == ""
+    assert accumulator.drain_buffer() == "trailing</p>"
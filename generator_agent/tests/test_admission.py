@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+from admission import BulkSlots, ReleasingStreamingResponse
+from common.client import BULK, PRIORITY
+from common.model import Message, SendTaskStreamingRequest, TaskSendParams, TextPart
+
+
+def task_request(task_id: str, bulk: bool) -> SendTaskStreamingRequest:
+    return SendTaskStreamingRequest(params=TaskSendParams(
+        id=task_id, sessionId="user-1-session-1", message=Message(role="user", parts=[TextPart(text="A bakery site")]),
+        metadata={PRIORITY: BULK} if bulk else None))
+
+
+class Releases:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+
+
+def test_interactive_tasks_are_always_admitted():
+    slots = BulkSlots(max_tasks=0)
+    release = slots.admit(task_request("task-1", bulk=False))
+    assert release is not None
+    release()
+    assert slots.running == 0
+
+
+def test_bulk_tasks_take_a_slot_until_released_once():
+    slots = BulkSlots(max_tasks=2)
+    first = slots.admit(task_request("task-1", bulk=True))
+    second = slots.admit(task_request("task-2", bulk=True))
+    assert slots.running == 2
+    assert slots.admit(task_request("task-3", bulk=True)) is None
+
+    first()
+    # Every path that may end the task releases it, only the first release frees the slot
+    first()
+    assert slots.running == 1
+    third = slots.admit(task_request("task-3", bulk=True))
+    assert third is not None
+    assert slots.admit(task_request("task-4", bulk=True)) is None
+
+    second()
+    third()
+    assert slots.running == 0
+
+
+async def events(started: list):
+    started.append(True)
+    for n in range(3):
+        yield f"data: {n}\n\n"
+
+
+def test_stream_releases_once_streamed():
+    async def run():
+        release, started, sent = Releases(), [], []
+
+        async def send(message):
+            sent.append(message)
+
+        async def receive():
+            await asyncio.sleep(10)
+
+        response = ReleasingStreamingResponse(events(started), release, media_type="text/event-stream")
+        await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+        assert [message.get("body") for message in sent[1:]] == [b"data: 0\n\n", b"data: 1\n\n", b"data: 2\n\n", b""]
+        assert release.count == 1
+
+    asyncio.run(run())
+
+
+def test_stream_releases_when_the_client_is_gone_before_the_first_event():
+    async def run():
+        release, started = Releases(), []
+
+        async def send(message):
+            raise OSError("connection reset")
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        response = ReleasingStreamingResponse(events(started), release, media_type="text/event-stream")
+        with pytest.raises(Exception):
+            await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+        assert started == []
+        assert release.count == 1
+
+    asyncio.run(run())
+
+
+def test_stream_releases_when_the_client_disconnects_mid_stream():
+    async def run():
+        release, sent = Releases(), []
+
+        async def slow_events():
+            yield "data: 0\n\n"
+            await asyncio.sleep(10)
+            yield "data: 1\n\n"
+
+        async def send(message):
+            sent.append(message)
+
+        async def receive():
+            await asyncio.sleep(0.05)
+            return {"type": "http.disconnect"}
+
+        response = ReleasingStreamingResponse(slow_events(), release, media_type="text/event-stream")
+        async with asyncio.timeout(2):
+            await response({"type": "http"}, receive, send)
+        assert release.count == 1
+
+    asyncio.run(run())
@@ -0,0 +1,99 @@
+import pytest
+
+import generation_cache
+from common.model import FileContent
+from generation_cache import CACHE_TTL_METADATA, FOLLOW_UP_METADATA, GenerationCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(generation_cache.time, "monotonic", clock)
+    return clock
+
+
+def test_generations_expire_after_their_ttl(clock):
+    cache = GenerationCache(ttl_s=60)
+    cache.put("key", ["<h1>Bakery</h1>"], "page", ttl_s=60)
+    clock.now += 59
+    assert cache.get("key", 60).page == "page"
+    clock.now += 1
+    assert cache.get("key", 60) is None
+    assert cache.get("key", 3600) is None
+
+
+def test_shorter_max_age_skips_but_keeps_older_generations(clock):
+    cache = GenerationCache(ttl_s=3600)
+    cache.put("key", [], "page", ttl_s=3600)
+    clock.now += 120
+    assert cache.get("key", 60) is None
+    assert cache.get("key", 3600).page == "page"
+
+
+def test_zero_ttl_is_not_stored():
+    cache = GenerationCache(ttl_s=60)
+    cache.put("key", [], "page", ttl_s=0)
+    assert cache.get("key", 60) is None
+
+
+def test_ttl_for_metadata_and_time_sensitive_specs():
+    cache = GenerationCache(ttl_s=3600, time_sensitive_ttl_s=600)
+    assert cache.ttl_for("A bakery site") == 3600
+    assert cache.ttl_for("A site with today's weather") == 600
+    assert cache.ttl_for("A bakery site", {CACHE_TTL_METADATA: 30}) == 30
+    assert cache.ttl_for("A bakery site", {CACHE_TTL_METADATA: 0}) == 0
+    # Metadata only shortens the ttl
+    assert cache.ttl_for("A bakery site", {CACHE_TTL_METADATA: 86400}) == 3600
+
+
+def test_least_recently_used_are_evicted_past_max_chars(clock):
+    cache = GenerationCache(ttl_s=60, max_chars=10)
+    cache.put("a", ["aa"], "aa", ttl_s=60)
+    cache.put("b", ["bb"], "bb", ttl_s=60)
+    assert cache.get("a", 60) is not None
+    cache.put("c", ["cc"], "cc", ttl_s=60)
+    assert cache.get("b", 60) is None
+    assert cache.get("a", 60) is not None
+    assert cache.get("c", 60) is not None
+
+
+def test_generations_larger_than_the_cache_are_not_stored(clock):
+    cache = GenerationCache(ttl_s=60, max_chars=10)
+    cache.put("a", ["aa"], "aa", ttl_s=60)
+    cache.put("big", ["x" * 6], "x" * 6, ttl_s=60)
+    assert cache.get("big", 60) is None
+    assert cache.get("a", 60) is not None
+
+
+def test_keys_differ_by_version_and_session_history():
+    key = GenerationCache.key("A bakery site", "v1")
+    assert GenerationCache.key("A bakery site", "v1", "") == key
+    assert GenerationCache.key("A bakery site", "v2") != key
+    assert GenerationCache.key("A bakery site", "v1", "earlier turns") != key
+
+
+def test_keys_ignore_whitespace_changes():
+    assert GenerationCache.key("A bakery\n  site ", "v1") == GenerationCache.key("A bakery site", "v1")
+    assert GenerationCache.key("A bakery site", "v1") != GenerationCache.key("A bakery shop", "v1")
+
+
+def test_images_completing_after_the_page_are_replayed(clock):
+    cache = GenerationCache(ttl_s=60)
+    images = []
+    cache.put("key", [], "page", ttl_s=60, images=images)
+    images.append(FileContent(name="task-1abc.png", uri="http://generator/images/abc.png", mimeType="image/png"))
+    assert [image.name for image in cache.get("key", 60).images] == ["task-1abc.png"]
+
+
+def test_only_follow_ups_are_keyed_by_history():
+    assert not GenerationCache.is_follow_up(None)
+    assert not GenerationCache.is_follow_up({CACHE_TTL_METADATA: 60})
+    assert GenerationCache.is_follow_up({FOLLOW_UP_METADATA: True})
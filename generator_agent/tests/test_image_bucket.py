@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from image_bucket import ImageBucket
+
+DIGEST = "a" * 64
+
+
+class Blob:
+    def __init__(self, bucket: "Bucket", name: str):
+        self.bucket = bucket
+        self.name = name
+        self.cache_control = None
+
+    def exists(self) -> bool:
+        return self.name in self.bucket.blobs
+
+    def upload_from_filename(self, filename: str, content_type: str):
+        self.bucket.blobs[self.name] = (open(filename, "rb").read(), content_type, self.cache_control)
+
+
+class Bucket:
+    def __init__(self):
+        self.blobs = {}
+
+    def blob(self, name: str) -> Blob:
+        return Blob(self, name)
+
+
+def bucket(fake: Bucket, url: str = "") -> ImageBucket:
+    images = ImageBucket("generator-images", url)
+    images._bucket = fake
+    return images
+
+
+def test_uploads_once_and_returns_the_copy_url(tmp_path):
+    path = tmp_path / f"{DIGEST}.png"
+    path.write_bytes(b"png")
+    fake = Bucket()
+    images = bucket(fake)
+
+    uri = asyncio.run(images.upload(DIGEST, path))
+    assert uri == f"https://storage.googleapis.com/generator-images/images/{DIGEST}.png"
+    assert fake.blobs[f"images/{DIGEST}.png"] == (b"png", "image/png", "public, max-age=31536000, immutable")
+
+    path.unlink()
+    # Already copied, the stored image is not needed any more
+    assert asyncio.run(images.upload(DIGEST, None)) == uri
+
+
+def test_copies_of_other_instances_are_reused(tmp_path):
+    fake = Bucket()
+    fake.blobs[f"images/{DIGEST}.png"] = (b"other", "image/png", None)
+    path = tmp_path / f"{DIGEST}.png"
+    path.write_bytes(b"png")
+    uri = asyncio.run(bucket(fake, "https://cdn.example.com").upload(DIGEST, path))
+    assert uri == f"https://cdn.example.com/images/{DIGEST}.png"
+    assert fake.blobs[f"images/{DIGEST}.png"][0] == b"other"
+
+
+def test_images_that_are_not_stored_fail():
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(bucket(Bucket()).upload(DIGEST, None))
@@ -0,0 +1,118 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+from image_cache import ImageCache, normalize
+
+
+def png(n: int, size: int = 10) -> bytes:
+    return bytes([n]) * size
+
+
+def test_concurrent_requests_for_a_prompt_generate_once(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=1000)
+    calls = 0
+
+    async def generate() -> bytes:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return png(1)
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_generate("key", generate) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert calls == 1
+    digest = hashlib.sha256(png(1)).hexdigest()
+    assert sorted(results) == [(digest, False)] + [(digest, True)] * 4
+    assert cache.path(digest).read_bytes() == png(1)
+
+
+def test_a_failed_generation_fails_all_waiters_and_is_retried(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=1000)
+
+    async def fail() -> bytes:
+        await asyncio.sleep(0.01)
+        raise RuntimeError("dall-e is down")
+
+    async def generate() -> bytes:
+        return png(1)
+
+    async def main():
+        results = await asyncio.gather(*(cache.get_or_generate("key", fail) for _ in range(3)), return_exceptions=True)
+        return results, await cache.get_or_generate("key", generate)
+
+    results, retried = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert retried == (hashlib.sha256(png(1)).hexdigest(), False)
+
+
+def test_least_recently_used_images_are_evicted(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=25)
+
+    async def main():
+        for n in (1, 2):
+            await cache.get_or_generate(f"key-{n}", lambda n=n: asyncio.sleep(0, png(n)))
+        # Hitting the first image makes the second the least recently used
+        assert await cache.get("key-1") is not None
+        await cache.get_or_generate("key-3", lambda: asyncio.sleep(0, png(3)))
+        return [await cache.get(f"key-{n}") for n in (1, 2, 3)]
+
+    first, second, third = asyncio.run(main())
+    assert first is not None and third is not None
+    assert second is None
+    assert cache.path(hashlib.sha256(png(2)).hexdigest()) is None
+
+
+def test_eviction_order_survives_a_restart(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=25)
+
+    async def store():
+        for n in (1, 2):
+            await cache.get_or_generate(f"key-{n}", lambda n=n: asyncio.sleep(0, png(n)))
+
+    asyncio.run(store())
+    # Make the first image the most recently used, as a hit would
+    first = cache.path(hashlib.sha256(png(1)).hexdigest())
+    second = cache.path(hashlib.sha256(png(2)).hexdigest())
+    os.utime(second, (1000, 1000))
+    os.utime(first, (2000, 2000))
+
+    restarted = ImageCache(str(tmp_path), max_bytes=25)
+
+    async def main():
+        await restarted.get_or_generate("key-3", lambda: asyncio.sleep(0, png(3)))
+        return await restarted.get("key-1"), await restarted.get("key-2")
+
+    kept, evicted = asyncio.run(main())
+    assert kept is not None
+    assert evicted is None
+
+
+def test_identical_images_share_a_file(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=1000)
+
+    async def main():
+        first, _ = await cache.get_or_generate("key-1", lambda: asyncio.sleep(0, png(1)))
+        second, _ = await cache.get_or_generate("key-2", lambda: asyncio.sleep(0, png(1)))
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first == second
+    assert len(list((tmp_path / "blobs").glob("*.png"))) == 1
+
+
+@pytest.mark.parametrize("name", ["../keys/key", "abc", "A" * 64, ""])
+def test_path_only_serves_digests(tmp_path, name):
+    assert ImageCache(str(tmp_path)).path(name) is None
+
+
+def test_prompts_are_normalized():
+    assert normalize("A  Bear in the\nforest.") == normalize("a bear in the forest")
+    assert ImageCache.key("A bear!", "dall-e-3", "1024x1024", "standard") == \
+        ImageCache.key("a bear", "dall-e-3", "1024x1024", "standard")
+    assert ImageCache.key("a bear", "dall-e-3", "1024x1024", "hd") != \
+        ImageCache.key("a bear", "dall-e-3", "1024x1024", "standard")
@@ -0,0 +1,128 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Awaitable
+
+
+@dataclass
+class Record:
+    """
+    A message as stored by the broker. Values are opaque bytes, encoding is up to the caller.
+    """
+    topic: str
+    partition: int
+    offset: int
+    key: str | None
+    value: bytes
+    # milliseconds since epoch
+    timestamp: int
+    headers: list[tuple[str, bytes]] = field(default_factory=list)
+
+
+class Consumer(ABC):
+    """
+    A member of a consumer group reading a single topic.
+    """
+
+    @abstractmethod
+    async def poll(self, timeout_ms: int, max_records: int = 500) -> list[Record]:
+        """
+        Fetches the next records of the partitions assigned to this consumer.
+        Records of one partition are returned in offset order.
+        :param timeout_ms: how long to wait for records if none are available
+        :param max_records: upper bound on records returned
+        """
+
+    @abstractmethod
+    async def commit(self, offsets: dict[int, int]):
+        """
+        Commits offsets for the consumer group, used when auto commit is disabled.
+        :param offsets: partition -> offset of the next record to consume
+        """
+
+    @abstractmethod
+    async def lag(self) -> dict[int, int]:
+        """
+        :return: assigned partition -> number of records on the broker this consumer has not fetched yet
+        """
+
+    @abstractmethod
+    async def close(self):
+        """
+        Leaves the consumer group
+        """
+
+
+class Reader(ABC):
+    """
+    Reads every partition of a topic outside of any consumer group, used for replays.
+    Reads what was on the topic when the reader was opened, records published later are not returned.
+    """
+
+    @abstractmethod
+    async def poll(self, max_records: int = 500) -> list[Record]:
+        """
+        Fetches the next records, records of one partition are returned in offset order
+        :return: an empty list once everything is read
+        """
+
+    @abstractmethod
+    async def close(self):
+        pass
+
+
+class Backend(ABC):
+    """
+    Broker used by the pubsub service. Topics are split into partitions, messages with the same key land on the same
+    partition, and consumer groups track their offsets per partition.
+    """
+
+    async def start(self):
+        """
+        Connects to the broker. Called once from the app lifespan before anything is published.
+        """
+
+    @abstractmethod
+    def send(self, topic: str, value: bytes, key: str | None = None,
+             headers: list[tuple[str, bytes]] | None = None) -> Awaitable:
+        """
+        Enqueues a message and returns without waiting for the broker.
+        :return: awaitable that resolves once the broker has acknowledged the message
+        """
+
+    @abstractmethod
+    def consumer(self, topic: str, group_id: str, auto_offset_reset: str = "latest",
+                 enable_auto_commit: bool = True) -> Consumer:
+        """
+        Joins a consumer group for the topic.
+        :param auto_offset_reset: where to start when the group has no committed offset, "latest" or "earliest"
+        :param enable_auto_commit: commit whatever has been polled, otherwise offsets only move with commit()
+        """
+
+    @abstractmethod
+    def reader(self, topic: str, offsets: dict[int, int] | None = None, timestamp: int | None = None) -> Reader:
+        """
+        Opens a reader positioned at the given offsets or time. Partitions without a position start at the earliest
+        record still retained.
+        :param offsets: partition -> offset of the first record to read
+        :param timestamp: read from the first record at or after this time, milliseconds since epoch
+        """
+
+    @abstractmethod
+    async def close(self):
+        """
+        Flushes pending messages and disconnects
+        """
+
+
+def create_backend(name: str) -> Backend:
+    """
+    Creates the backend by name. Backends are imported lazily, so kafka-python is only needed for the kafka backend.
+    :param name: "kafka" or "memory"
+    """
+    if name == "kafka":
+        from kafka_backend import KafkaBackend
+        return KafkaBackend()
+    if name == "memory":
+        from memory_backend import MemoryBackend
+        return MemoryBackend()
+    raise ValueError(f"Unknown pubsub backend: {name}")
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Hashable, Iterable
+
+from subscriptions import Subscription
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Message:
+    data: dict
+    # Sent along with every push, so that subscribers can drop duplicates of at-least-once delivery
+    idempotency_key: str
+    # Called once for every endpoint that received the message or had it parked on the dead letter topic.
+    # None when nothing is waiting for acknowledgements
+    ack: Callable[[], None] | None = None
+
+    def acknowledge(self):
+        if self.ack is not None:
+            self.ack()
+
+
+# Called with (topic, endpoint, messages, batched). Batched pushes send a json array even for a single message.
+# Returns True when the endpoint acknowledges the messages later on its own, like streaming subscribers do
+PostFn = Callable[[str, str, list[Message], bool], Awaitable[bool]]
+# Called with (endpoint, message, error) when a delivery fails. May return an awaitable that completes once the message
+# was retried, delivered or given up on, later messages to the endpoint wait for it
+FailureFn = Callable[[str, Message, "DeliveryError"], Awaitable[None] | None]
+
+
+class DeliveryError(Exception):
+    """
+    Raised when a message could not be delivered to an endpoint.
+    :param retryable: False when retrying will not help, e.g. the endpoint rejected the message as invalid
+    """
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class EndpointWorker:
+    """
+    Delivers messages to a single endpoint, one push at a time and in the order they were queued.
+    Batched subscriptions get everything that queued up, up to their batch size, in a single push.
+    The queue is bounded, so an endpoint that falls too far behind applies backpressure instead of growing memory.
+    Failed deliveries are handed to on_failure one message at a time, and the worker waits until each one is retried,
+    delivered or given up on before it moves on, so a transient failure does not reorder the endpoint's messages.
+    """
+
+    def __init__(self, subscription: Subscription, post: PostFn, on_failure: FailureFn, max_in_flight: int):
+        self.subscription = subscription
+        self.endpoint = subscription.endpoint
+        self._post = post
+        self._on_failure = on_failure
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_in_flight)
+        self._batch: list[Message] = []
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    async def put(self, message: Message):
+        await self._queue.put(message)
+
+    async def _next_batch(self) -> list[Message]:
+        # Collected into self._batch, so drop() sees the messages already taken off the queue if the worker is closed
+        self._batch = batch = [await self._queue.get()]
+        max_messages = self.subscription.batch_max_messages
+        # Take whatever is already waiting, then give the batch up to the latency budget to fill up
+        while len(batch) < max_messages and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.subscription.batch_max_latency_ms / 1000
+        while len(batch) < max_messages and loop.time() < deadline:
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), deadline - loop.time()))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                deferred = await self._post(self.subscription.topic, self.endpoint, batch, self.subscription.batched)
+                if not deferred:
+                    for message in batch:
+                        message.acknowledge()
+            except Exception as e:
+                if not isinstance(e, DeliveryError):
+                    logger.exception(f"Unexpected error delivering to {self.endpoint}: {e}")
+                    e = DeliveryError(str(e))
+                await self._fail(batch, e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            # Only cleared once the batch is done, a batch cut short by close() is still acknowledged by drop()
+            self._batch = []
+
+    async def _fail(self, batch: list[Message], error: DeliveryError):
+        for n, message in enumerate(batch):
+            # Messages not handed over yet are still this worker's, drop() acknowledges them
+            self._batch = batch[n + 1:]
+            resolved = self._on_failure(self.endpoint, message, error)
+            if resolved is not None:
+                # Shielded, closing the worker stops waiting but leaves the retry running
+                await asyncio.shield(resolved)
+
+    async def close(self):
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+
+    async def drop(self):
+        """
+        Stops delivering and acknowledges whatever is still queued or was being delivered, for endpoints that are gone
+        for good
+        """
+        await self.close()
+        dropped, self._batch = self._batch, []
+        while not self._queue.empty():
+            dropped.append(self._queue.get_nowait())
+        for message in dropped:
+            message.acknowledge()
+        if dropped:
+            logger.info(f"Dropped {len(dropped)} messages queued for {self.endpoint}")
+
+
+class TopicDispatcher:
+    """
+    Fans messages of a topic out to every subscribed endpoint. Each endpoint gets its own worker per lane
+    (the partition a message came from), so a slow endpoint only delays its own deliveries, and messages of different
+    lanes are delivered in parallel while each lane stays ordered.
+    """
+
+    def __init__(self, topic: str, post: PostFn, on_failure: FailureFn, max_in_flight: int):
+        self.topic = topic
+        self._post = post
+        self._on_failure = on_failure
+        self._max_in_flight = max_in_flight
+        self._workers: Dict[tuple[str, Hashable], EndpointWorker] = {}
+
+    def _worker(self, subscription: Subscription, lane: Hashable) -> EndpointWorker:
+        worker = self._workers.get((subscription.endpoint, lane))
+        if worker is None:
+            worker = EndpointWorker(subscription, self._post, self._on_failure, self._max_in_flight)
+            self._workers[(subscription.endpoint, lane)] = worker
+        # Picks up changed batch settings when an endpoint subscribes again
+        worker.subscription = subscription
+        return worker
+
+    async def dispatch(self, subscriptions: Iterable[Subscription], message: Message, lane: Hashable = None):
+        for subscription in subscriptions:
+            logger.debug(f"Queueing message to {subscription.endpoint} for topic {self.topic} lane {lane}: "
+                         f"{message.data}")
+            await self._worker(subscription, lane).put(message)
+
+    async def remove(self, endpoint: str):
+        """
+        Drops the workers of an endpoint that unsubscribed
+        """
+        workers = [key for key in self._workers if key[0] == endpoint]
+        await asyncio.gather(*(self._workers.pop(key).drop() for key in workers))
+
+    def depths(self) -> Dict[str, int]:
+        """
+        :return: endpoint -> messages queued for it over all lanes
+        """
+        depths: Dict[str, int] = {}
+        for (endpoint, _), worker in self._workers.items():
+            depths[endpoint] = depths.get(endpoint, 0) + worker.depth
+        return depths
+
+    async def close(self):
+        await asyncio.gather(*(worker.close() for worker in self._workers.values()))
+        self._workers.clear()
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable
+
+from kafka import KafkaConsumer, KafkaProducer
+from kafka.errors import NoBrokersAvailable
+from kafka.structs import OffsetAndMetadata, TopicPartition
+
+from backend import Backend, Consumer, Reader, Record
+
+logger = logging.getLogger(__name__)
+
+KAFKA_BROKER = os.getenv("KAFKA_BROKER", "localhost:9092")
+# Producer batching. Sends are not flushed individually, the producer ships a batch once it is full or lingered enough
+LINGER_MS = int(os.getenv("PUBSUB_LINGER_MS", "5"))
+BATCH_SIZE = int(os.getenv("PUBSUB_BATCH_SIZE", str(64 * 1024)))
+CONNECT_ATTEMPTS = 10
+READ_POLL_TIMEOUT_MS = 500
+
+
+class KafkaTopicConsumer(Consumer):
+    def __init__(self, topic: str, group_id: str, auto_offset_reset: str, enable_auto_commit: bool):
+        self.topic = topic
+        self._group_id = group_id
+        self._auto_offset_reset = auto_offset_reset
+        self._enable_auto_commit = enable_auto_commit
+        self._consumer: KafkaConsumer | None = None
+        # KafkaConsumer is not thread safe and blocks, so every call goes through the same single thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"fetch_{topic}")
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _connect(self) -> KafkaConsumer:
+        if self._consumer is None:
+            self._consumer = KafkaConsumer(
+                self.topic,
+                bootstrap_servers=KAFKA_BROKER,
+                group_id=self._group_id,
+                auto_offset_reset=self._auto_offset_reset,
+                enable_auto_commit=self._enable_auto_commit,
+            )
+        return self._consumer
+
+    def _poll(self, timeout_ms: int, max_records: int) -> list[Record]:
+        batches = self._connect().poll(timeout_ms=timeout_ms, max_records=max_records)
+        return [_record(msg) for records in batches.values() for msg in records]
+
+    async def poll(self, timeout_ms: int, max_records: int = 500) -> list[Record]:
+        return await self._run(self._poll, timeout_ms, max_records)
+
+    def _commit(self, offsets: dict[int, int]):
+        self._connect().commit({
+            TopicPartition(self.topic, partition): OffsetAndMetadata(offset, "", -1)
+            for partition, offset in offsets.items()
+        })
+
+    async def commit(self, offsets: dict[int, int]):
+        await self._run(self._commit, offsets)
+
+    def _lag(self) -> dict[int, int]:
+        if self._consumer is None:
+            return {}
+        assignment = list(self._consumer.assignment())
+        end_offsets = self._consumer.end_offsets(assignment) if assignment else {}
+        return {tp.partition: end_offsets[tp] - self._consumer.position(tp) for tp in assignment}
+
+    async def lag(self) -> dict[int, int]:
+        return await self._run(self._lag)
+
+    async def close(self):
+        if self._consumer is not None:
+            await self._run(self._consumer.close)
+        self._executor.shutdown(wait=False)
+
+
+class KafkaTopicReader(Reader):
+    def __init__(self, topic: str, offsets: dict[int, int] | None, timestamp: int | None):
+        self.topic = topic
+        self._offsets = offsets or {}
+        self._timestamp = timestamp
+        self._consumer: KafkaConsumer | None = None
+        self._ends: dict[TopicPartition, int] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"replay_{topic}")
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _connect(self) -> KafkaConsumer:
+        if self._consumer is None:
+            # No group, so the reader neither joins the topic's consumer group nor commits anything
+            consumer = KafkaConsumer(bootstrap_servers=KAFKA_BROKER, group_id=None, enable_auto_commit=False)
+            partitions = [TopicPartition(self.topic, partition)
+                          for partition in sorted(consumer.partitions_for_topic(self.topic) or [])]
+            consumer.assign(partitions)
+            consumer.seek_to_beginning()
+            by_time = consumer.offsets_for_times({tp: self._timestamp for tp in partitions}) \
+                if self._timestamp is not None else {}
+            self._ends = consumer.end_offsets(partitions)
+            for tp in partitions:
+                if tp.partition in self._offsets:
+                    consumer.seek(tp, max(self._offsets[tp.partition], consumer.beginning_offsets([tp])[tp]))
+                elif tp in by_time:
+                    # None when nothing was published after the timestamp
+                    found = by_time[tp]
+                    consumer.seek(tp, found.offset if found is not None else self._ends[tp])
+            self._consumer = consumer
+        return self._consumer
+
+    def _poll(self, max_records: int) -> list[Record]:
+        consumer = self._connect()
+        while True:
+            remaining = [tp for tp, end in self._ends.items() if consumer.position(tp) < end]
+            if not remaining:
+                return []
+            # Partitions read up to their end are paused, so their new records are not fetched
+            consumer.pause(*(tp for tp in self._ends if tp not in remaining))
+            batches = consumer.poll(timeout_ms=READ_POLL_TIMEOUT_MS, max_records=max_records)
+            records = [_record(msg) for tp, messages in batches.items() for msg in messages
+                       if msg.offset < self._ends[tp]]
+            if records:
+                return records
+
+    async def poll(self, max_records: int = 500) -> list[Record]:
+        return await self._run(self._poll, max_records)
+
+    async def close(self):
+        if self._consumer is not None:
+            await self._run(self._consumer.close)
+        self._executor.shutdown(wait=False)
+
+
+class KafkaBackend(Backend):
+    def __init__(self):
+        self._producer: KafkaProducer | None = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        for _ in range(CONNECT_ATTEMPTS):
+            try:
+                self._producer = await loop.run_in_executor(None, self._create_producer)
+                return
+            except NoBrokersAvailable:
+                logger.warning("Kafka not available yet, retrying...")
+                await asyncio.sleep(1)
+        raise Exception("Kafka not reachable after multiple attempts")
+
+    @staticmethod
+    def _create_producer() -> KafkaProducer:
+        return KafkaProducer(
+            bootstrap_servers=KAFKA_BROKER,
+            linger_ms=LINGER_MS,
+            batch_size=BATCH_SIZE,
+        )
+
+    def send(self, topic: str, value: bytes, key: str | None = None,
+             headers: list[tuple[str, bytes]] | None = None) -> Awaitable:
+        future = self._producer.send(topic, value=value, key=key.encode("utf-8") if key else None, headers=headers)
+        return _as_asyncio_future(future)
+
+    def consumer(self, topic: str, group_id: str, auto_offset_reset: str = "latest",
+                 enable_auto_commit: bool = True) -> Consumer:
+        return KafkaTopicConsumer(topic, group_id, auto_offset_reset, enable_auto_commit)
+
+    def reader(self, topic: str, offsets: dict[int, int] | None = None, timestamp: int | None = None) -> Reader:
+        return KafkaTopicReader(topic, offsets, timestamp)
+
+    async def close(self):
+        if self._producer is not None:
+            # close flushes whatever is still lingering in the producer
+            await asyncio.get_running_loop().run_in_executor(None, self._producer.close)
+
+
+def _record(msg) -> Record:
+    return Record(
+        topic=msg.topic,
+        partition=msg.partition,
+        offset=msg.offset,
+        key=msg.key.decode("utf-8") if msg.key else None,
+        value=msg.value,
+        timestamp=msg.timestamp,
+        headers=list(msg.headers or []),
+    )
+
+
+def _as_asyncio_future(future) -> asyncio.Future:
+    """
+    Bridges kafka's send future, which is completed from the producer's IO thread, into the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    result = loop.create_future()
+
+    def set_result(metadata):
+        if not result.done():
+            result.set_result(metadata)
+
+    def set_exception(exception):
+        if not result.done():
+            result.set_exception(exception)
+
+    future.add_callback(lambda metadata: loop.call_soon_threadsafe(set_result, metadata))
+    future.add_errback(lambda exception: loop.call_soon_threadsafe(set_exception, exception))
+    # Unconfirmed publishes never await the ack, so failures are logged here
+    result.add_done_callback(_log_failure)
+    return result
+
+
+def _log_failure(future: asyncio.Future):
+    if not future.cancelled() and future.exception():
+        logger.error(f"Failed to deliver message to kafka: {future.exception()}")
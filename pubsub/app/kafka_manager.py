@@ -1,90 +1,572 @@
 import asyncio
-import json
 import logging
 import os
-import threading
 import time
+import uuid
 from typing import Dict
 
 import aiohttp
-from kafka import KafkaConsumer, KafkaProducer
-from kafka.errors import NoBrokersAvailable
+
+import metrics
+import encoding
+from backend import Backend, Consumer, Record, create_backend
+from delivery import DeliveryError, Message, TopicDispatcher
+from last_value import LastValueCache
+from offsets import OffsetTracker
+from registry import SubscriptionRegistry
+from replay import Replay
+from retry import PendingDelivery, RetryScheduler
+from routing import session_id
+from streams import STREAM_SCHEME, StreamSubscriber
+from subscriptions import SESSION_ID, Subscription, SubscriptionFilter
 
 logging.basicConfig(level=logging.INFO, )
 logger = logging.getLogger(__name__)
 
-KAFKA_BROKER = os.getenv("KAFKA_BROKER", "localhost:9092")
+# "kafka" or "memory". The in-memory broker needs no Kafka, but only works for a single pubsub instance
+BACKEND = os.getenv("PUBSUB_BACKEND", "kafka")
+# Max number of messages queued per endpoint before the topic consumer waits for that endpoint
+MAX_IN_FLIGHT = int(os.getenv("PUBSUB_MAX_IN_FLIGHT", "100"))
+POLL_TIMEOUT_MS = int(os.getenv("PUBSUB_POLL_TIMEOUT_MS", "500"))
+POST_TIMEOUT_S = float(os.getenv("PUBSUB_POST_TIMEOUT_S", "30"))
+# Failed deliveries are retried with exponential backoff, then parked on the topic's dead letter topic
+RETRY_ATTEMPTS = int(os.getenv("PUBSUB_RETRY_ATTEMPTS", "5"))
+RETRY_BASE_DELAY_MS = int(os.getenv("PUBSUB_RETRY_BASE_DELAY_MS", "500"))
+RETRY_MAX_DELAY_MS = int(os.getenv("PUBSUB_RETRY_MAX_DELAY_MS", "30000"))
+RETRY_CONCURRENCY = int(os.getenv("PUBSUB_RETRY_CONCURRENCY", "10"))
+DEAD_LETTER_SUFFIX = "_dead_letter"
+
+# Delivery modes:
+# "throughput" - offsets are auto committed as soon as messages are fetched, a crash can lose messages in flight
+# "strict" - at-least-once, offsets are committed once every subscriber has acknowledged a contiguous range
+THROUGHPUT = "throughput"
+STRICT = "strict"
+DEFAULT_DELIVERY_MODE = os.getenv("PUBSUB_DELIVERY_MODE", THROUGHPUT)
+# Per topic overrides, e.g. "builder_agent_topic=strict,generator_agent_topic=throughput"
+DELIVERY_MODES: Dict[str, str] = dict(
+    entry.strip().split("=", 1) for entry in os.getenv("PUBSUB_DELIVERY_MODES", "").split(",") if "=" in entry
+)
+COMMIT_INTERVAL_MS = int(os.getenv("PUBSUB_COMMIT_INTERVAL_MS", "1000"))
+# SQLite file keeping push subscriptions across restarts, empty keeps them in memory only
+REGISTRY_PATH = os.getenv("PUBSUB_REGISTRY_PATH", "subscriptions.db")
+LEASE_CHECK_INTERVAL_S = float(os.getenv("PUBSUB_LEASE_CHECK_INTERVAL_S", "5"))
+IDEMPOTENCY_KEY_HEADER = "idempotency_key"
+# How messages are stored on the broker. Records carry the encoding in headers, records without them are plain json
+CONTENT_TYPE_HEADER = "content_type"
+CONTENT_ENCODING_HEADER = "content_encoding"
+STORAGE_CONTENT_TYPE = os.getenv("PUBSUB_STORAGE_CONTENT_TYPE", encoding.MSGPACK)
+STORAGE_CONTENT_ENCODING = os.getenv("PUBSUB_STORAGE_CONTENT_ENCODING", encoding.ZSTD)
+# Replays of a topic to an endpoint run in the background, a few at a time and at a limited rate each
+REPLAY_RATE = float(os.getenv("PUBSUB_REPLAY_RATE", "200"))
+REPLAY_CONCURRENCY = int(os.getenv("PUBSUB_REPLAY_CONCURRENCY", "2"))
+# Finished replays kept around for status requests
+REPLAY_HISTORY = 100
+# Topics with a last value cache and the payload path of their key,
+# e.g. "generator_agent_topic=result.sessionId,builder_agent_topic=params.sessionId"
+LAST_VALUE_TOPICS: Dict[str, str] = dict(
+    entry.strip().split("=", 1) for entry in os.getenv("PUBSUB_LAST_VALUE_TOPICS", "").split(",") if "=" in entry
+)
+LAST_VALUE_MAX_KEYS = int(os.getenv("PUBSUB_LAST_VALUE_MAX_KEYS", "10000"))
+
+_topic_tasks: Dict[str, asyncio.Task] = {}
+# topic -> endpoint -> subscription
+_subscribers: Dict[str, Dict[str, Subscription]] = {}
+# endpoint -> connected streaming subscriber
+_streams: Dict[str, StreamSubscriber] = {}
+# topic -> consumer and dispatcher of the running topic task, for metrics
+_consumers: Dict[str, Consumer] = {}
+_dispatchers: Dict[str, TopicDispatcher] = {}
+_backend: Backend | None = None
+_session: aiohttp.ClientSession | None = None
+_retry_scheduler: RetryScheduler | None = None
+_registry: SubscriptionRegistry | None = None
+_lease_task: asyncio.Task | None = None
+# replay id -> replay, running or recently finished
+_replays: Dict[str, Replay] = {}
+_replay_tasks: Dict[str, asyncio.Task] = {}
+_replay_slots: asyncio.Semaphore | None = None
+_last_values = LastValueCache(LAST_VALUE_TOPICS, LAST_VALUE_MAX_KEYS)
+_last_value_task: asyncio.Task | None = None
+
+
+async def start():
+    """
+    Connects to the broker, must be called from the app lifespan before subscribing or publishing
+    """
+    global _backend, _session, _retry_scheduler, _registry, _lease_task, _replay_slots, _last_value_task
+    _backend = create_backend(BACKEND)
+    await _backend.start()
+    _session = aiohttp.ClientSession()
+    _retry_scheduler = RetryScheduler(_post, _dead_letter, _delivering, max_attempts=RETRY_ATTEMPTS,
+                                      base_delay=RETRY_BASE_DELAY_MS / 1000, max_delay=RETRY_MAX_DELAY_MS / 1000,
+                                      concurrency=RETRY_CONCURRENCY)
+    _retry_scheduler.start()
+    _replay_slots = asyncio.Semaphore(REPLAY_CONCURRENCY)
+    if REGISTRY_PATH:
+        _registry = SubscriptionRegistry(REGISTRY_PATH)
+        _restore_subscriptions()
+    _lease_task = asyncio.create_task(_expire_leases())
+    if LAST_VALUE_TOPICS:
+        _last_value_task = asyncio.create_task(_load_last_values())
+    logger.info(f"Started pubsub with {BACKEND} backend")
+
+
+async def _load_last_values():
+    """
+    Fills the last value cache from what the broker retained, the cache is kept up to date on publish from then on
+    """
+    for topic in LAST_VALUE_TOPICS:
+        reader = _backend.reader(topic)
+        try:
+            loaded = 0
+            while records := await reader.poll():
+                for record in records:
+                    _last_values.update(topic, _decode(record), record.timestamp)
+                loaded += len(records)
+            logger.info(f"Loaded last values of topic {topic} from {loaded} messages")
+        except Exception as e:
+            logger.warning(f"Failed to load last values of topic {topic}: {e}")
+        finally:
+            await reader.close()
+
+
+def latest(topic: str, key: str) -> dict | None:
+    """
+    :return: latest message of the topic with the given key, None if there is none or the topic is not cached
+    """
+    last_value = _last_values.get(topic, key)
+    return last_value.payload if last_value is not None else None
+
+
+def _restore_subscriptions():
+    now = time.time()
+    for subscription in _registry.load():
+        if subscription.expired(now):
+            _registry.delete(subscription.topic, subscription.endpoint)
+            continue
+        _subscribers.setdefault(subscription.topic, {})[subscription.endpoint] = subscription
+        _start_consumer(subscription.topic)
+        logger.info(f"Restored subscription of {subscription.endpoint} to {subscription.topic}")
+
+
+def dead_letter_topic(topic: str) -> str:
+    return f"{topic}{DEAD_LETTER_SUFFIX}"
+
+
+def delivery_mode(topic: str) -> str:
+    return DELIVERY_MODES.get(topic, DEFAULT_DELIVERY_MODE)
+
+
+def subscribe(subscription: Subscription) -> str:
+    """
+    Registers the subscription. Subscribing again with the same topic and endpoint is idempotent,
+    it updates changed settings and renews the lease.
+    :return: "created", "updated" or "renewed"
+    """
+    topic = subscription.topic
+    subscription.renew()
+    existing = _subscribers.get(topic, {}).get(subscription.endpoint)
+    if existing is not None and existing.same_settings(subscription):
+        existing.expires_at = subscription.expires_at
+        subscription, status = existing, "renewed"
+    else:
+        _subscribers.setdefault(topic, {})[subscription.endpoint] = subscription
+        status = "updated" if existing is not None else "created"
+
+    # Streams belong to their connection, only push subscriptions outlive a restart
+    if _registry and not subscription.endpoint.startswith(STREAM_SCHEME) and \
+            (status != "renewed" or subscription.lease_s):
+        _registry.save(subscription)
+    _start_consumer(topic)
+    return status
+
+
+async def unsubscribe(topic: str, endpoint: str) -> bool:
+    """
+    Removes the subscription and drops messages still queued or waiting for a retry for the endpoint.
+    The topic consumer stops with the last subscription, its consumer group keeps the offset for the next one.
+    :return: False if the endpoint was not subscribed to the topic
+    """
+    subscription = _subscribers.get(topic, {}).pop(endpoint, None)
+    if subscription is None:
+        return False
+    if _registry:
+        _registry.delete(topic, endpoint)
+    dispatcher = _dispatchers.get(topic)
+    if dispatcher is not None:
+        await dispatcher.remove(endpoint)
+    if not _subscribers[topic]:
+        del _subscribers[topic]
+        task = _topic_tasks.pop(topic, None)
+        if task is not None:
+            task.cancel()
+    logger.info(f"Unsubscribed {endpoint} from {topic}")
+    return True
+
+
+def subscriptions() -> list[Subscription]:
+    return [subscription for endpoints in _subscribers.values() for subscription in endpoints.values()]
+
+
+def _start_consumer(topic: str):
+    if topic not in _topic_tasks:
+        _topic_tasks[topic] = asyncio.create_task(_consume_topic(topic))
+
+
+def _delivering(topic: str, endpoint: str) -> bool:
+    """
+    Whether retries to the endpoint are still worth it. Retries to a stream are dropped once it disconnected,
+    unless a subscriber reconnected under the same name and took it over.
+    """
+    if endpoint.startswith(STREAM_SCHEME):
+        return endpoint in _streams
+    return endpoint in _subscribers.get(topic, {})
+
+
+async def _expire_leases():
+    """
+    Unsubscribes endpoints that stopped renewing their lease, so dead endpoints don't use up delivery attempts
+    """
+    while True:
+        await asyncio.sleep(LEASE_CHECK_INTERVAL_S)
+        now = time.time()
+        for subscription in subscriptions():
+            if subscription.expired(now):
+                logger.warning(f"Lease of {subscription.endpoint} on {subscription.topic} expired")
+                await unsubscribe(subscription.topic, subscription.endpoint)
+
+
+def subscribe_stream(subscription: Subscription, websocket, credit: int) -> StreamSubscriber:
+    """
+    Subscribes a websocket connection. A subscriber reconnecting under the same name takes over the old stream,
+    including the retries of messages the old stream never acknowledged.
+    :param credit: number of messages that may be written before the subscriber acknowledges any
+    """
+    stream = StreamSubscriber(websocket, subscription.endpoint, credit, _on_failure(subscription.topic))
+    _streams[subscription.endpoint] = stream
+    subscribe(subscription)
+    return stream
+
+
+async def unsubscribe_stream(subscription: Subscription, stream: StreamSubscriber):
+    """
+    Unsubscribes a websocket connection that closed, like unsubscribe. Messages still queued or unacknowledged for
+    the stream are dropped, unless a subscriber reconnected under the same name and took the stream over.
+    """
+    # Only if it was not taken over by a reconnect in the meantime
+    if _streams.get(subscription.endpoint) is stream:
+        del _streams[subscription.endpoint]
+        await unsubscribe(subscription.topic, subscription.endpoint)
+    await stream.close()
 
-_topic_threads: Dict[str, threading.Thread] = {}
-_subscribers: Dict[str, set[str]] = {}
-_producer = None
 
-for _ in range(10):
+async def publish(topic: str, payload: dict, confirm: bool = False, key: str | None = None,
+                  idempotency_key: str | None = None):
+    """
+    Enqueues the payload on the broker and returns. The kafka producer batches sends based on linger/batch settings.
+    :param topic: topic to publish to
+    :param payload: message to publish
+    :param confirm: wait until the broker acknowledges the message
+    :param key: partitioning key, defaults to the session id of the message
+    :param idempotency_key: passed to subscribers to dedupe redeliveries, generated if not provided
+    """
+    ack = _send(topic, payload, key, idempotency_key)
+    if confirm:
+        await ack
+
+
+async def publish_batch(records: list[tuple[str, dict, str | None]], confirm: bool = False):
+    """
+    Enqueues many (topic, payload, key) records at once.
+    :param records: list of (topic, payload, key) to publish in order
+    :param confirm: wait until the broker acknowledges all the messages
+    """
+    acks = [_send(topic, payload, key) for topic, payload, key in records]
+    if confirm:
+        await asyncio.gather(*acks)
+
+
+def _send(topic: str, payload: dict, key: str | None, idempotency_key: str | None = None):
+    # Keying by session keeps a session on a single partition, so its messages stay ordered
+    # while different sessions are consumed in parallel
+    value, content_type, content_encoding = encoding.encode(payload, STORAGE_CONTENT_TYPE, STORAGE_CONTENT_ENCODING)
+    headers = [
+        (IDEMPOTENCY_KEY_HEADER, (idempotency_key or uuid.uuid4().hex).encode("utf-8")),
+        (CONTENT_TYPE_HEADER, content_type.encode("utf-8")),
+        (CONTENT_ENCODING_HEADER, content_encoding.encode("utf-8")),
+    ]
+    metrics.PRODUCED.inc(topic)
+    _last_values.update(topic, payload, int(time.time() * 1000))
+    return _backend.send(topic, value, key=key or session_id(payload), headers=headers)
+
+
+def _header(record: Record, name: str) -> str | None:
+    for header, value in record.headers:
+        if header == name:
+            return value.decode("utf-8")
+    return None
+
+
+def _idempotency_key(record: Record) -> str:
+    return _header(record, IDEMPOTENCY_KEY_HEADER) or f"{record.topic}:{record.partition}:{record.offset}"
+
+
+def _decode(record: Record):
+    return encoding.decode(record.value, _header(record, CONTENT_TYPE_HEADER), _header(record, CONTENT_ENCODING_HEADER))
+
+
+async def replay_dead_letters(topic: str, max_messages: int = 1000) -> int:
+    """
+    Redelivers messages parked on the dead letter topic of `topic` to the endpoints that failed them,
+    each with a fresh retry budget. The replay consumer group remembers its offset, so a message is replayed once.
+    :return: number of messages replayed
+    """
+    consumer = _backend.consumer(dead_letter_topic(topic), group_id=f"replay_{topic}", auto_offset_reset="earliest")
+    letters = []
+    # The first poll also waits for the consumer to join its group
+    timeout_ms = max(POLL_TIMEOUT_MS, 5000)
     try:
-        _producer = KafkaProducer(
-            bootstrap_servers=KAFKA_BROKER,
-            value_serializer=lambda v: json.dumps(v).encode('utf-8')
-        )
-        break
-    except NoBrokersAvailable:
-        print("Kafka not available yet, retrying...")
-        time.sleep(1)
-else:
-    raise Exception("Kafka not reachable after multiple attempts")
+        while len(letters) < max_messages:
+            records = await consumer.poll(timeout_ms, max_records=max_messages - len(letters))
+            if not records:
+                break
+            letters.extend(_decode(record) for record in records)
+            timeout_ms = POLL_TIMEOUT_MS
+    finally:
+        await consumer.close()
 
+    # Scheduled only once reading is done, otherwise letters failing again would be read back by this replay
+    for letter in letters:
+        message = Message(letter["payload"], letter["idempotency_key"])
+        _retry_scheduler.schedule(letter["topic"], letter["endpoint"], message, attempt=0)
+    logger.info(f"Replayed {len(letters)} dead letters of topic {topic}")
+    return len(letters)
 
-# TODO: provide unsubscribe mechanism
-def subscribe(topic: str, endpoint: str):
-    _subscribers.setdefault(topic, set()).add(endpoint)
 
-    if topic not in _topic_threads:
-        t = threading.Thread(target=_run_topic_consumer, args=(topic,), daemon=True)
-        _topic_threads[topic] = t
-        t.start()
+def start_replay(topic: str, endpoint: str, offsets: dict[int, int] | None = None, timestamp: int | None = None,
+                 session: str | None = None, rate: float | None = None, batch_max_messages: int = 1) -> Replay:
+    """
+    Starts redelivering the messages retained on `topic` to `endpoint`, from the given offsets or time on.
+    The endpoint does not have to be subscribed, pushes use its subscription's encoding if it is.
+    :param offsets: partition -> first offset to replay, partitions not listed are replayed from the earliest record
+    :param timestamp: replay messages published at or after this time, milliseconds since epoch
+    :param session: only replay messages of this session
+    :param rate: max messages per second, defaults to PUBSUB_REPLAY_RATE
+    """
+    replay_id = uuid.uuid4().hex
+    message_filter = SubscriptionFilter(SESSION_ID, frozenset([session])) if session else None
+    replay = Replay(replay_id, topic, endpoint, _backend.reader(topic, offsets, timestamp), _post, _decode,
+                    _idempotency_key, message_filter, rate or REPLAY_RATE, batch_max_messages,
+                    max_attempts=RETRY_ATTEMPTS, backoff=_retry_scheduler.backoff)
+    _replays[replay_id] = replay
+    finished = [finished_id for finished_id, other in _replays.items() if other.finished]
+    for finished_id in finished[:max(0, len(finished) - REPLAY_HISTORY)]:
+        del _replays[finished_id]
+    task = asyncio.create_task(replay.run(_replay_slots))
+    _replay_tasks[replay_id] = task
+    task.add_done_callback(lambda _: _replay_tasks.pop(replay_id, None))
+    logger.info(f"Replaying topic {topic} to {endpoint}, replay {replay_id}")
+    return replay
 
 
-def _run_topic_consumer(topic: str):
-    asyncio.run(_consume_topic(topic))
+def replay_status(replay_id: str) -> Replay | None:
+    return _replays.get(replay_id)
 
 
-def publish(topic: str, payload: dict):
-    _producer.send(topic, payload)
-    _producer.flush()
+async def cancel_replay(replay_id: str) -> bool:
+    task = _replay_tasks.get(replay_id)
+    if task is None:
+        return False
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    return True
 
 
-def close():
-    _producer.close()
+async def _dead_letter(delivery: PendingDelivery):
+    metrics.DEAD_LETTERS.inc(delivery.endpoint)
+    logger.error(f"Giving up on {delivery.endpoint} for topic {delivery.topic} after {delivery.attempt} attempts: "
+                 f"{delivery.error}")
+    letter = {
+        "topic": delivery.topic,
+        "endpoint": delivery.endpoint,
+        "attempts": delivery.attempt,
+        "error": delivery.error,
+        "idempotency_key": delivery.message.idempotency_key,
+        "payload": delivery.message.data,
+    }
+    try:
+        await _send(dead_letter_topic(delivery.topic), letter, session_id(delivery.message.data))
+        # Parked is as good as delivered for offset commits, the dead letter topic keeps the message
+        delivery.message.acknowledge()
+    except Exception as e:
+        logger.exception(f"Failed to park message for {delivery.endpoint} on dead letter topic: {e}")
 
 
-async def _consume_topic(topic: str):
-    consumer = KafkaConsumer(
-        topic,
-        bootstrap_servers=KAFKA_BROKER,
-        value_deserializer=lambda m: json.loads(m.decode('utf-8')),
-        group_id=f"group_{topic}",
-        auto_offset_reset="latest"
-    )
-
-    async with aiohttp.ClientSession() as session:
-        for msg in consumer:
-            for endpoint in _subscribers.get(topic, []):
-                logger.debug(f"Pushing message to {endpoint} for topic {topic}: {msg.value}")
-                await _post(session, endpoint, msg.value)
-
-
-async def _post(session: aiohttp.ClientSession, endpoint: str, data: dict, retries: int = 2):
-    for attempt in range(1, retries + 1):
+async def collect_metrics() -> str:
+    """
+    Refreshes the point in time metrics and renders all of them
+    """
+    metrics.CONSUMER_LAG.clear()
+    for topic, consumer in list(_consumers.items()):
         try:
-            timeout = aiohttp.ClientTimeout(total=30)
-            async with session.post(endpoint, json=data, timeout=timeout) as resp:
-                text = await resp.text()
-                logger.info(f"Posted to {endpoint}: {resp.status} - {text}\n {data}")
-                return
-        except aiohttp.ClientError as e:
-            logger.warning(f"[Attempt {attempt}] ClientError posting to {endpoint}: {e}")
-        except asyncio.TimeoutError:
-            logger.warning(f"[Attempt {attempt}] Timeout posting to {endpoint}")
+            for partition, lag in (await consumer.lag()).items():
+                metrics.CONSUMER_LAG.set(lag, topic, str(partition))
         except Exception as e:
-            logger.exception(f"[Attempt {attempt}] Unexpected error posting to {endpoint}: {e}")
+            logger.warning(f"Failed to get consumer lag of topic {topic}: {e}")
+    metrics.IN_FLIGHT.clear()
+    in_flight: Dict[str, int] = {}
+    for dispatcher in _dispatchers.values():
+        for endpoint, depth in dispatcher.depths().items():
+            in_flight[endpoint] = in_flight.get(endpoint, 0) + depth
+    for endpoint, stream in _streams.items():
+        in_flight[endpoint] = in_flight.get(endpoint, 0) + stream.in_flight
+    for endpoint, depth in in_flight.items():
+        metrics.IN_FLIGHT.set(depth, endpoint)
+    metrics.RETRY_DEPTH.set(_retry_scheduler.depth if _retry_scheduler else 0)
+    return metrics.render()
+
+
+async def close():
+    if _lease_task is not None:
+        _lease_task.cancel()
+    if _last_value_task is not None:
+        _last_value_task.cancel()
+    for task in _topic_tasks.values():
+        task.cancel()
+    await asyncio.gather(*_topic_tasks.values(), return_exceptions=True)
+    _topic_tasks.clear()
+    for task in _replay_tasks.values():
+        task.cancel()
+    await asyncio.gather(*_replay_tasks.values(), return_exceptions=True)
+    if _retry_scheduler is not None:
+        await _retry_scheduler.close()
+    if _session is not None:
+        await _session.close()
+    if _backend is not None:
+        await _backend.close()
+    if _registry is not None:
+        _registry.close()
+
+
+async def _consume_topic(topic: str):
+    strict = delivery_mode(topic) == STRICT
+    consumer = _backend.consumer(topic, group_id=f"group_{topic}", auto_offset_reset="latest",
+                                 enable_auto_commit=not strict)
+    tracker = OffsetTracker() if strict else None
+    dispatcher = TopicDispatcher(topic, _post, _on_failure(topic), MAX_IN_FLIGHT)
+    _consumers[topic] = consumer
+    _dispatchers[topic] = dispatcher
+    last_commit = time.monotonic()
+    logger.info(f"Consuming topic {topic} in {delivery_mode(topic)} mode")
+    try:
+        while True:
+            records = await consumer.poll(POLL_TIMEOUT_MS)
+            metrics.CONSUMED.inc(topic, amount=len(records))
+            for record in records:
+                payload = _decode(record)
+                # Filtered out messages need no acknowledgement, in strict mode they are committed right away
+                subscriptions = tuple(subscription for subscription in _subscribers.get(topic, {}).values()
+                                      if subscription.accepts(payload))
+                ack = tracker.track(record.partition, record.offset, len(subscriptions)) if tracker else None
+                if not subscriptions:
+                    continue
+                message = Message(payload, _idempotency_key(record), ack)
+                await dispatcher.dispatch(subscriptions, message, lane=record.partition)
+
+            if tracker and time.monotonic() - last_commit >= COMMIT_INTERVAL_MS / 1000:
+                await _commit(consumer, tracker)
+                last_commit = time.monotonic()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.exception(f"Consumer for topic {topic} stopped: {e}")
+        if _topic_tasks.get(topic) is asyncio.current_task():
+            del _topic_tasks[topic]
+    finally:
+        # A new consumer may have started already if the topic was unsubscribed and subscribed again
+        if _consumers.get(topic) is consumer:
+            del _consumers[topic]
+            del _dispatchers[topic]
+        await dispatcher.close()
+        if tracker:
+            await _commit(consumer, tracker)
+        await consumer.close()
+
+
+async def _commit(consumer: Consumer, tracker: OffsetTracker):
+    offsets = tracker.committable()
+    if not offsets:
+        return
+    try:
+        await consumer.commit(offsets)
+        tracker.mark_committed(offsets)
+    except Exception as e:
+        # Not fatal, the next commit covers the same range
+        logger.warning(f"Failed to commit offsets {offsets}: {e}")
+
+
+def _on_failure(topic: str):
+    def schedule_retry(endpoint: str, message: Message, error: DeliveryError) -> asyncio.Future:
+        attempt = 1 if error.retryable else RETRY_ATTEMPTS
+        resolved = asyncio.get_running_loop().create_future()
+        _retry_scheduler.schedule(topic, endpoint, message, attempt, str(error), resolved)
+        return resolved
+
+    return schedule_retry
+
+
+async def _post(topic: str, endpoint: str, messages: list[Message], batched: bool) -> bool:
+    """
+    Single delivery attempt, retries are up to the caller.
+    Batched pushes send a json array of payloads, with the idempotency keys comma separated in the same order.
+    Streaming subscribers get the messages written to their websocket instead.
+    :return: True if the messages will be acknowledged by a streaming subscriber later
+    :raises DeliveryError: on connection errors, timeouts and error responses. 4xx other than 429 are not retryable.
+    """
+    started = time.perf_counter()
+    try:
+        if endpoint.startswith(STREAM_SCHEME):
+            stream = _streams.get(endpoint)
+            if stream is None:
+                raise DeliveryError(f"Stream {endpoint} is not connected")
+            await stream.send(messages, POST_TIMEOUT_S)
+            deferred = True
+        else:
+            await _push(_subscribers.get(topic, {}).get(endpoint), endpoint, messages, batched)
+            deferred = False
+    finally:
+        metrics.POST_LATENCY.observe(time.perf_counter() - started, endpoint)
+    metrics.DELIVERED.inc(endpoint, amount=len(messages))
+    return deferred
+
+
+async def _push(subscription: Subscription | None, endpoint: str, messages: list[Message], batched: bool):
+    if batched:
+        data = [message.data for message in messages]
+        headers = {"Idempotency-Key": ",".join(message.idempotency_key for message in messages)}
+    else:
+        data = messages[0].data
+        headers = {"Idempotency-Key": messages[0].idempotency_key}
+    # Retries may outlive the subscription, those go out as plain json
+    content_type = subscription.content_type if subscription else encoding.JSON
+    content_encoding = subscription.content_encoding if subscription else encoding.IDENTITY
+    body, content_type, content_encoding = encoding.encode(data, content_type, content_encoding)
+    headers["Content-Type"] = content_type
+    if content_encoding != encoding.IDENTITY:
+        headers["Content-Encoding"] = content_encoding
+    try:
+        timeout = aiohttp.ClientTimeout(total=POST_TIMEOUT_S)
+        async with _session.post(endpoint, data=body, headers=headers, timeout=timeout) as resp:
+            text = await resp.text()
+            logger.debug(f"Posted {len(messages)} to {endpoint}: {resp.status} - {text}\n {data}")
+    except aiohttp.ClientError as e:
+        logger.warning(f"ClientError posting to {endpoint}: {e}")
+        raise DeliveryError(f"ClientError: {e}")
+    except asyncio.TimeoutError:
+        logger.warning(f"Timeout posting to {endpoint}")
+        raise DeliveryError("Timeout")
 
-        await asyncio.sleep(0.5 * attempt)  # exponential-ish backoff
+    if resp.status >= 500 or resp.status == 429:
+        raise DeliveryError(f"{resp.status}: {text}")
+    if resp.status >= 400:
+        raise DeliveryError(f"{resp.status}: {text}", retryable=False)
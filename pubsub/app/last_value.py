@@ -0,0 +1,55 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict
+
+import routing
+from subscriptions import SESSION_ID
+
+
+@dataclass
+class LastValue:
+    payload: Any
+    # Publish time, milliseconds since epoch
+    timestamp: int
+
+
+class LastValueCache:
+    """
+    Latest message per key of a topic, like a compacted topic kept in memory, so late joiners can fetch the current
+    state instead of replaying the topic. Only the configured topics are cached, each keyed by a path into the payload.
+    Messages without the key are not cached. Keys not updated for the longest time are evicted past `max_keys`.
+    """
+
+    def __init__(self, key_paths: Dict[str, str], max_keys: int):
+        """
+        :param key_paths: topic -> "sessionId" or a dotted path such as "result.sessionId"
+        :param max_keys: max keys kept per topic
+        """
+        self.key_paths = key_paths
+        self._max_keys = max_keys
+        self._values: Dict[str, OrderedDict[str, LastValue]] = {topic: OrderedDict() for topic in key_paths}
+
+    def key(self, topic: str, payload: Any) -> str | None:
+        path = self.key_paths[topic]
+        value = routing.session_id(payload) if path == SESSION_ID else routing.get_path(payload, path)
+        return str(value) if value is not None else None
+
+    def update(self, topic: str, payload: Any, timestamp: int):
+        values = self._values.get(topic)
+        if values is None:
+            return
+        key = self.key(topic, payload)
+        if key is None:
+            return
+        current = values.get(key)
+        # Older messages read back from the log must not replace what was published since
+        if current is not None and current.timestamp > timestamp:
+            return
+        values[key] = LastValue(payload, timestamp)
+        values.move_to_end(key)
+        if len(values) > self._max_keys:
+            values.popitem(last=False)
+
+    def get(self, topic: str, key: str) -> LastValue | None:
+        values = self._values.get(topic)
+        return values.get(key) if values is not None else None
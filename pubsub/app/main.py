@@ -1,47 +1,309 @@
 import logging
+import uuid
 from contextlib import asynccontextmanager
+from typing import Literal
 
-from fastapi import FastAPI, Body
-from pydantic import BaseModel
+from fastapi import FastAPI, Body, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, Field
 
+import encoding
 import kafka_manager
+from streams import stream_endpoint
+from subscriptions import Subscription, SubscriptionFilter, SESSION_ID
 
 logging.basicConfig(level=logging.INFO, )
 logger = logging.getLogger(__name__)
 
+# Batched pushes join the idempotency keys of a batch with commas, see kafka_manager._push
+IDEMPOTENCY_KEY_PATTERN = r"^[^,\s]*$"
+
+
+class SubscribeFilter(BaseModel):
+    # "sessionId", or a dotted path into the payload such as "result.status.state"
+    attribute: str = SESSION_ID
+    # attribute in {...}
+    values: list[str] | None = None
+    # attribute starts with prefix
+    prefix: str | None = None
+
+
 class SubscribeRequest(BaseModel):
     topic: str
     endpoint: str
+    # Push up to this many messages at once as a json array, 1 pushes single json objects
+    batch_max_messages: int = Field(default=1, ge=1)
+    # How long a batch may wait to fill up
+    batch_max_latency_ms: int = Field(default=0, ge=0)
+    # Only push messages matching the filter
+    filter: SubscribeFilter | None = None
+    # Expire the subscription unless it is renewed by subscribing again within this many seconds
+    lease_s: float | None = Field(default=None, gt=0)
+    # Encoding of the pushes, compression only applies above PUBSUB_COMPRESSION_THRESHOLD bytes
+    content_type: Literal[encoding.CONTENT_TYPES] = encoding.JSON
+    content_encoding: Literal[encoding.CONTENT_ENCODINGS] = encoding.IDENTITY
+
+
+class UnsubscribeRequest(BaseModel):
+    topic: str
+    endpoint: str
+
+
+class StreamSubscribeRequest(BaseModel):
+    """
+    First frame of a streaming subscription, sending it again on the same socket updates the subscription
+    """
+    topic: str
+    # Identifies the subscriber, reconnecting with the same name picks up its pending retries
+    name: str = Field(default_factory=lambda: uuid.uuid4().hex)
+    # Messages written before the subscriber has to acknowledge any
+    credit: int = Field(default=100, ge=1)
+    batch_max_messages: int = Field(default=1, ge=1)
+    batch_max_latency_ms: int = Field(default=0, ge=0)
+    filter: SubscribeFilter | None = None
 
 
 class PublishRequest(BaseModel):
     topic: str
     payload: dict
+    # Partitioning key, defaults to the sessionId found in the payload
+    key: str | None = None
+    # Passed to subscribers in the Idempotency-Key header, generated if not provided. No commas or whitespace
+    idempotency_key: str | None = Field(default=None, pattern=IDEMPOTENCY_KEY_PATTERN)
+    # Wait for the broker to acknowledge the message before responding
+    confirm: bool = False
+
+
+class PublishRecord(BaseModel):
+    topic: str
+    payload: dict
+    key: str | None = None
+
+
+class PublishBatchRequest(BaseModel):
+    records: list[PublishRecord]
+    confirm: bool = False
+
+
+class ReplayDeadLettersRequest(BaseModel):
+    max_messages: int = 1000
+
+
+class ReplayRequest(BaseModel):
+    topic: str
+    endpoint: str
+    # Where to start, partition -> offset. Partitions not listed start at the earliest retained message
+    from_offsets: dict[int, int] | None = None
+    # Or start at the first message published at or after this time, milliseconds since epoch
+    from_timestamp_ms: int | None = None
+    # Only replay messages of this session
+    session_id: str | None = None
+    # Max messages per second, defaults to PUBSUB_REPLAY_RATE
+    rate: float | None = Field(default=None, gt=0)
+    batch_max_messages: int = Field(default=1, ge=1)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    await kafka_manager.start()
     yield  # App runs during this time
-    kafka_manager.close()
+    await kafka_manager.close()
+
+
+class EncodedRequest(Request):
+    """
+    Request body decoded according to its Content-Type and Content-Encoding headers, e.g. zstd compressed msgpack
+    """
+
+    async def json(self):
+        if not hasattr(self, "_json"):
+            try:
+                self._json = encoding.decode(await self.body(), self.headers.get("x-original-content-type"),
+                                             self.headers.get("content-encoding"))
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Failed to decode request body: {e}")
+        return self._json
+
+
+class EncodedRoute(APIRoute):
+    """
+    Lets clients publish msgpack and compressed bodies to the same routes and models as plain json
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request):
+            content_type = encoding.media_type(request.headers.get("content-type"))
+            if content_type == encoding.JSON and "content-encoding" not in request.headers:
+                return await handler(request)
+            if content_type not in encoding.CONTENT_TYPES:
+                raise HTTPException(status_code=415, detail=f"Unsupported content type: {content_type}")
+            # FastAPI only parses json bodies, so the decoded body is presented as one
+            headers = [(name, value) for name, value in request.scope["headers"] if name != b"content-type"]
+            headers += [(b"content-type", encoding.JSON.encode()),
+                        (b"x-original-content-type", content_type.encode())]
+            return await handler(EncodedRequest({**request.scope, "headers": headers}, request.receive))
+
+        return route_handler
 
 
 app = FastAPI(lifespan=lifespan)
+app.router.route_class = EncodedRoute
+
+
+def _subscription(req: SubscribeRequest | StreamSubscribeRequest, endpoint: str) -> Subscription:
+    subscription_filter = None
+    if req.filter:
+        values = frozenset(req.filter.values) if req.filter.values is not None else None
+        subscription_filter = SubscriptionFilter(req.filter.attribute, values, req.filter.prefix)
+    if isinstance(req, StreamSubscribeRequest):
+        # Stream frames are json text
+        return Subscription(req.topic, endpoint, req.batch_max_messages, req.batch_max_latency_ms, subscription_filter)
+    return Subscription(req.topic, endpoint, req.batch_max_messages, req.batch_max_latency_ms, subscription_filter,
+                        req.lease_s, content_type=req.content_type, content_encoding=req.content_encoding)
 
 
 @app.post("/subscribe")
-def subscribe(req: SubscribeRequest):
-    kafka_manager.subscribe(req.topic, req.endpoint)
-    return {"message": f"Subscribed {req.endpoint} to {req.topic}"}
+async def subscribe(req: SubscribeRequest):
+    """
+    Idempotent, subscribing again updates the settings and renews the lease
+    """
+    status = kafka_manager.subscribe(_subscription(req, req.endpoint))
+    return {"message": f"Subscribed {req.endpoint} to {req.topic}", "status": status}
+
+
+@app.post("/unsubscribe")
+async def unsubscribe(req: UnsubscribeRequest):
+    if not await kafka_manager.unsubscribe(req.topic, req.endpoint):
+        raise HTTPException(status_code=404, detail=f"{req.endpoint} is not subscribed to {req.topic}")
+    return {"message": f"Unsubscribed {req.endpoint} from {req.topic}"}
+
+
+@app.get("/subscriptions")
+async def list_subscriptions():
+    return [
+        {"topic": subscription.topic, "endpoint": subscription.endpoint, "expires_at": subscription.expires_at}
+        for subscription in kafka_manager.subscriptions()
+    ]
+
+
+@app.websocket("/subscribe/stream")
+async def subscribe_stream(websocket: WebSocket):
+    """
+    Streaming subscription, for subscribers that can't expose a push endpoint or want to skip the request per message.
+    Client frames: the StreamSubscribeRequest first, then {"type": "ack", "ids": [...]} for processed messages,
+    {"type": "nack", "ids": [...], "error": "..."} for failed ones and {"type": "credit", "credit": n} for more credit.
+    Server frames: {"type": "messages", "messages": [{"id": ..., "idempotency_key": ..., "data": {...}}]}
+    """
+    await websocket.accept()
+    req = StreamSubscribeRequest.model_validate(await websocket.receive_json())
+    subscription = _subscription(req, stream_endpoint(req.name))
+    stream = kafka_manager.subscribe_stream(subscription, websocket, req.credit)
+    await websocket.send_json({"type": "subscribed", "endpoint": subscription.endpoint})
+    logger.info(f"Streaming {req.topic} to {subscription.endpoint}")
+    try:
+        while True:
+            frame = await websocket.receive_json()
+            frame_type = frame.get("type")
+            if frame_type == "ack":
+                await stream.ack(frame["ids"])
+            elif frame_type == "nack":
+                await stream.nack(frame["ids"], frame.get("error", "Rejected by subscriber"))
+            elif frame_type == "credit":
+                await stream.grant(frame["credit"])
+            else:
+                update = StreamSubscribeRequest.model_validate({**frame, "topic": req.topic, "name": req.name})
+                subscription = _subscription(update, subscription.endpoint)
+                kafka_manager.subscribe(subscription)
+    except WebSocketDisconnect:
+        logger.info(f"Stream {subscription.endpoint} disconnected")
+    finally:
+        await kafka_manager.unsubscribe_stream(subscription, stream)
 
 
 @app.post("/publish")
-def publish(req: PublishRequest):
-    kafka_manager.publish(req.topic, req.payload)
+async def publish(req: PublishRequest):
+    try:
+        await kafka_manager.publish(req.topic, req.payload, confirm=req.confirm, key=req.key,
+                                    idempotency_key=req.idempotency_key)
+    except Exception as e:
+        logger.error(f"Failed to publish to {req.topic}: {e}")
+        raise HTTPException(status_code=503, detail=f"Failed to publish to {req.topic}: {e}")
     return {"message": f"Published to {req.topic}"}
 
 
+@app.post("/publish/batch")
+async def publish_batch(req: PublishBatchRequest):
+    try:
+        await kafka_manager.publish_batch([(record.topic, record.payload, record.key) for record in req.records],
+                                          confirm=req.confirm)
+    except Exception as e:
+        logger.error(f"Failed to publish batch of {len(req.records)}: {e}")
+        raise HTTPException(status_code=503, detail=f"Failed to publish batch: {e}")
+    return {"message": f"Published {len(req.records)} messages"}
+
+
+@app.post("/topics/{topic}/dead-letters/replay")
+async def replay_dead_letters(topic: str, req: ReplayDeadLettersRequest | None = None):
+    req = req or ReplayDeadLettersRequest()
+    replayed = await kafka_manager.replay_dead_letters(topic, req.max_messages)
+    return {"message": f"Replayed {replayed} dead letters of {topic}", "replayed": replayed}
+
+
+@app.get("/topics/{topic}/latest/{key}")
+async def get_latest(topic: str, key: str):
+    """
+    Latest message published to the topic with the given key, for topics listed in PUBSUB_LAST_VALUE_TOPICS
+    """
+    if topic not in kafka_manager.LAST_VALUE_TOPICS:
+        raise HTTPException(status_code=404, detail=f"Topic {topic} has no last value cache")
+    payload = kafka_manager.latest(topic, key)
+    if payload is None:
+        raise HTTPException(status_code=404, detail=f"No message with key {key} on topic {topic}")
+    return payload
+
+
+@app.post("/replay", status_code=202)
+async def replay(req: ReplayRequest):
+    """
+    Redelivers the messages retained on a topic to an endpoint in the background, e.g. to rebuild a session.
+    Replayed messages get new idempotency keys, so subscribers do not drop them as duplicates.
+    """
+    if req.from_offsets is not None and req.from_timestamp_ms is not None:
+        raise HTTPException(status_code=400, detail="Pass either from_offsets or from_timestamp_ms")
+    started = kafka_manager.start_replay(req.topic, req.endpoint, req.from_offsets, req.from_timestamp_ms,
+                                         req.session_id, req.rate, req.batch_max_messages)
+    return started.status()
+
+
+@app.get("/replay/{replay_id}")
+async def get_replay(replay_id: str):
+    found = kafka_manager.replay_status(replay_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail=f"Replay {replay_id} not found")
+    return found.status()
+
+
+@app.delete("/replay/{replay_id}")
+async def cancel_replay(replay_id: str):
+    if not await kafka_manager.cancel_replay(replay_id):
+        raise HTTPException(status_code=404, detail=f"Replay {replay_id} is not running")
+    return kafka_manager.replay_status(replay_id).status()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Prometheus text format: produced/consumed counts per topic, consumer lag per partition, push latency,
+    delivered/retry/dead letter counts and in-flight depth per endpoint
+    """
+    return await kafka_manager.collect_metrics()
+
+
 @app.post("/echo")
-def echo(payload: dict = Body(...)):
+def echo(payload: dict | list = Body(...)):
     return payload
 
 
@@ -57,4 +319,12 @@ curl -X POST http://127.0.0.1:8000/subscribe \
 curl -X POST http://127.0.0.1:8000/publish \
   -H "Content-Type: application/json" \
   -d '{"topic": "my_topic", "payload": {"message": "hello world"}}'
+
+curl -X POST http://127.0.0.1:8000/publish/batch \
+  -H "Content-Type: application/json" \
+  -d '{"records": [{"topic": "my_topic", "payload": {"message": "hello"}}, {"topic": "my_topic", "payload": {"message": "world"}}]}'
+
+curl -X POST http://127.0.0.1:8000/replay \
+  -H "Content-Type: application/json" \
+  -d '{"topic": "my_topic", "endpoint": "http://localhost:8000/echo", "from_timestamp_ms": 1700000000000, "rate": 50}'
 """
\ No newline at end of file
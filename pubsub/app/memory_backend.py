@@ -0,0 +1,248 @@
+import asyncio
+import bisect
+import itertools
+import logging
+import os
+import time
+import zlib
+from typing import Awaitable, Dict
+
+from backend import Backend, Consumer, Reader, Record
+
+logger = logging.getLogger(__name__)
+
+PARTITIONS = int(os.getenv("PUBSUB_MEMORY_PARTITIONS", "8"))
+# Records kept per partition, older records are dropped like with a retention policy
+RETENTION = int(os.getenv("PUBSUB_MEMORY_RETENTION", "10000"))
+
+
+class _Partition:
+    """
+    Append-only log. Offsets are absolute and keep growing when old records are dropped.
+    """
+
+    def __init__(self, retention: int):
+        self._retention = retention
+        self._records: list[Record] = []
+        self.start_offset = 0
+
+    @property
+    def end_offset(self) -> int:
+        return self.start_offset + len(self._records)
+
+    def append(self, record: Record):
+        self._records.append(record)
+        # Trim in bulk so appends stay amortized O(1)
+        if len(self._records) >= 2 * self._retention:
+            dropped = len(self._records) - self._retention
+            del self._records[:dropped]
+            self.start_offset += dropped
+
+    def offset_for_time(self, timestamp: int) -> int:
+        """
+        :return: offset of the first record at or after the timestamp, records are appended in time order
+        """
+        return self.start_offset + bisect.bisect_left(self._records, timestamp, key=lambda record: record.timestamp)
+
+    def read(self, offset: int, max_records: int) -> list[Record]:
+        start = max(offset, self.start_offset) - self.start_offset
+        return self._records[start:start + max_records]
+
+
+class _Topic:
+    def __init__(self, name: str, partitions: int, retention: int):
+        self.name = name
+        self.partitions = [_Partition(retention) for _ in range(partitions)]
+        self._round_robin = itertools.cycle(range(partitions))
+        self._waiters: list[asyncio.Future] = []
+
+    def partition_for(self, key: str | None) -> int:
+        if key is None:
+            return next(self._round_robin)
+        # crc32 instead of hash() so the same key maps to the same partition across restarts
+        return zlib.crc32(key.encode("utf-8")) % len(self.partitions)
+
+    def append(self, value: bytes, key: str | None, headers: list[tuple[str, bytes]]) -> Record:
+        partition = self.partition_for(key)
+        log = self.partitions[partition]
+        record = Record(topic=self.name, partition=partition, offset=log.end_offset, key=key, value=value,
+                        timestamp=int(time.time() * 1000), headers=headers)
+        log.append(record)
+        self._wake_up()
+        return record
+
+    async def wait(self, timeout_ms: int):
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout_ms / 1000)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _wake_up(self):
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+class _Group:
+    """
+    Consumer group of a topic. Partitions are spread over the members, and committed offsets survive members leaving.
+    """
+
+    def __init__(self, topic: _Topic):
+        self.topic = topic
+        self.members: list["MemoryConsumer"] = []
+        self.committed: Dict[int, int] = {}
+
+    def join(self, member: "MemoryConsumer"):
+        self.members.append(member)
+        self._rebalance()
+
+    def leave(self, member: "MemoryConsumer"):
+        member.auto_commit()
+        self.members.remove(member)
+        self._rebalance()
+
+    def _rebalance(self):
+        for member in self.members:
+            member.auto_commit()
+        for index, member in enumerate(self.members):
+            member.assign(range(index, len(self.topic.partitions), len(self.members)))
+
+
+class MemoryConsumer(Consumer):
+    def __init__(self, group: _Group, auto_offset_reset: str, enable_auto_commit: bool):
+        self._group = group
+        self._topic = group.topic
+        self._auto_offset_reset = auto_offset_reset
+        self._enable_auto_commit = enable_auto_commit
+        # next offset to read per assigned partition
+        self._positions: Dict[int, int] = {}
+        self._polls = 0
+        group.join(self)
+
+    def assign(self, partitions):
+        positions = {}
+        for partition in partitions:
+            if partition in self._group.committed:
+                positions[partition] = self._group.committed[partition]
+            elif self._auto_offset_reset == "earliest":
+                positions[partition] = self._topic.partitions[partition].start_offset
+            else:
+                positions[partition] = self._topic.partitions[partition].end_offset
+        self._positions = positions
+
+    def auto_commit(self):
+        """
+        Everything returned by previous polls counts as consumed
+        """
+        if self._enable_auto_commit:
+            self._group.committed.update(self._positions)
+
+    async def commit(self, offsets: dict[int, int]):
+        self._group.committed.update(offsets)
+
+    def _fetch(self, max_records: int) -> list[Record]:
+        records = []
+        # Start from a different partition every poll, so a busy partition can't starve the others
+        partitions = list(self._positions)
+        start = self._polls % len(partitions) if partitions else 0
+        self._polls += 1
+        for partition in partitions[start:] + partitions[:start]:
+            position = self._positions[partition]
+            batch = self._topic.partitions[partition].read(position, max_records - len(records))
+            if batch:
+                self._positions[partition] = batch[-1].offset + 1
+                records.extend(batch)
+            if len(records) >= max_records:
+                break
+        return records
+
+    async def poll(self, timeout_ms: int, max_records: int = 500) -> list[Record]:
+        self.auto_commit()
+        records = self._fetch(max_records)
+        if not records:
+            await self._topic.wait(timeout_ms)
+            records = self._fetch(max_records)
+        return records
+
+    async def lag(self) -> dict[int, int]:
+        return {partition: self._topic.partitions[partition].end_offset - position
+                for partition, position in self._positions.items()}
+
+    async def close(self):
+        self._group.leave(self)
+
+
+class MemoryReader(Reader):
+    def __init__(self, topic: _Topic, offsets: dict[int, int] | None, timestamp: int | None):
+        self._topic = topic
+        self._positions: Dict[int, int] = {}
+        self._ends = {partition: log.end_offset for partition, log in enumerate(topic.partitions)}
+        for partition, log in enumerate(topic.partitions):
+            if offsets and partition in offsets:
+                self._positions[partition] = max(offsets[partition], log.start_offset)
+            elif timestamp is not None:
+                self._positions[partition] = log.offset_for_time(timestamp)
+            else:
+                self._positions[partition] = log.start_offset
+
+    async def poll(self, max_records: int = 500) -> list[Record]:
+        records = []
+        for partition, position in self._positions.items():
+            limit = min(max_records - len(records), self._ends[partition] - position)
+            batch = self._topic.partitions[partition].read(position, limit) if limit > 0 else []
+            if batch:
+                self._positions[partition] = batch[-1].offset + 1
+                records.extend(batch)
+            if len(records) >= max_records:
+                break
+        return records
+
+    async def close(self):
+        pass
+
+
+class MemoryBackend(Backend):
+    """
+    In-process broker for single node deployments and hermetic benchmarks. Messages do not survive a restart.
+    """
+
+    def __init__(self, partitions: int = PARTITIONS, retention: int = RETENTION):
+        self._partitions = partitions
+        self._retention = retention
+        self._topics: Dict[str, _Topic] = {}
+        self._groups: Dict[tuple[str, str], _Group] = {}
+
+    def _topic(self, name: str) -> _Topic:
+        topic = self._topics.get(name)
+        if topic is None:
+            topic = _Topic(name, self._partitions, self._retention)
+            self._topics[name] = topic
+        return topic
+
+    def send(self, topic: str, value: bytes, key: str | None = None,
+             headers: list[tuple[str, bytes]] | None = None) -> Awaitable:
+        record = self._topic(topic).append(value, key, headers or [])
+        ack = asyncio.get_running_loop().create_future()
+        ack.set_result(record)
+        return ack
+
+    def consumer(self, topic: str, group_id: str, auto_offset_reset: str = "latest",
+                 enable_auto_commit: bool = True) -> Consumer:
+        group = self._groups.get((group_id, topic))
+        if group is None:
+            group = _Group(self._topic(topic))
+            self._groups[(group_id, topic)] = group
+        return MemoryConsumer(group, auto_offset_reset, enable_auto_commit)
+
+    def reader(self, topic: str, offsets: dict[int, int] | None = None, timestamp: int | None = None) -> Reader:
+        return MemoryReader(self._topic(topic), offsets, timestamp)
+
+    async def close(self):
+        logger.info(f"Closing in-memory broker with {len(self._topics)} topics")
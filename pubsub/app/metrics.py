@@ -0,0 +1,121 @@
+import bisect
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable
+
+# Seconds, from a fast local push up to the post timeout
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    labels = ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+    return f"{{{labels}}}" if labels else ""
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+
+    @abstractmethod
+    def _lines(self) -> list[str]:
+        """
+        Sample lines of the metric, after its HELP and TYPE lines
+        """
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}", *self._lines()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def _lines(self) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """
+    Point in time value, refreshed right before rendering
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self._values: Dict[tuple, float] = {}
+
+    def set(self, value: float, *label_values: str):
+        self._values[label_values] = value
+
+    def clear(self):
+        self._values.clear()
+
+    def _lines(self) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+        # label values -> (count per bucket, the last one being +Inf, sum)
+        self._values: Dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        counts, total = self._values.setdefault(label_values, ([0] * (len(self.buckets) + 1), [0.0]))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def _lines(self) -> list[str]:
+        lines = []
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = _format_labels((*self.labels, "le"), (*key, bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {total[0]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+PRODUCED = Counter("pubsub_messages_produced_total", "Messages published to a topic", ("topic",))
+CONSUMED = Counter("pubsub_messages_consumed_total", "Messages read from a topic by its consumer", ("topic",))
+CONSUMER_LAG = Gauge("pubsub_consumer_lag", "Records on the broker not fetched by the consumer yet",
+                     ("topic", "partition"))
+POST_LATENCY = Histogram("pubsub_post_duration_seconds", "Time to deliver a push or write a stream frame",
+                         ("endpoint",))
+DELIVERED = Counter("pubsub_messages_delivered_total", "Messages delivered to an endpoint", ("endpoint",))
+RETRIES = Counter("pubsub_retries_total", "Failed deliveries queued for a retry", ("endpoint",))
+DEAD_LETTERS = Counter("pubsub_dead_letters_total", "Messages given up on and parked on the dead letter topic",
+                       ("endpoint",))
+IN_FLIGHT = Gauge("pubsub_in_flight", "Messages queued for an endpoint or waiting for a stream acknowledgement",
+                  ("endpoint",))
+RETRY_DEPTH = Gauge("pubsub_retry_queue_depth", "Deliveries waiting for or running a retry")
+
+REGISTRY: list[_Metric] = [PRODUCED, CONSUMED, CONSUMER_LAG, POST_LATENCY, DELIVERED, RETRIES, DEAD_LETTERS,
+                           IN_FLIGHT, RETRY_DEPTH]
+
+
+def render() -> str:
+    """
+    All metrics in the Prometheus text format
+    """
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
@@ -0,0 +1,54 @@
+import functools
+from typing import Callable, Dict
+
+
+class OffsetTracker:
+    """
+    Tracks which records of a topic every subscriber has acknowledged. The committable offset of a partition is the
+    lowest offset still waiting for an acknowledgement, so only contiguous acknowledged ranges get committed.
+    """
+
+    def __init__(self):
+        # partition -> {offset: acknowledgements still missing}, offsets are tracked in increasing order
+        self._pending: Dict[int, Dict[int, int]] = {}
+        # partition -> offset after the last tracked record
+        self._next: Dict[int, int] = {}
+        self._committed: Dict[int, int] = {}
+
+    def track(self, partition: int, offset: int, acks: int) -> Callable[[], None] | None:
+        """
+        Starts tracking a record that needs `acks` acknowledgements.
+        :return: callback to call once per acknowledgement, None if the record needs none
+        """
+        self._next[partition] = offset + 1
+        if acks <= 0:
+            return None
+        self._pending.setdefault(partition, {})[offset] = acks
+        return functools.partial(self._ack, partition, offset)
+
+    def _ack(self, partition: int, offset: int):
+        pending = self._pending.get(partition, {})
+        if offset not in pending:
+            return
+        pending[offset] -= 1
+        if pending[offset] <= 0:
+            del pending[offset]
+
+    @property
+    def pending(self) -> int:
+        return sum(len(offsets) for offsets in self._pending.values())
+
+    def committable(self) -> Dict[int, int]:
+        """
+        :return: partition -> next offset to consume, for partitions that moved since the last commit
+        """
+        offsets = {}
+        for partition, next_offset in self._next.items():
+            pending = self._pending.get(partition)
+            offset = next(iter(pending)) if pending else next_offset
+            if self._committed.get(partition) != offset:
+                offsets[partition] = offset
+        return offsets
+
+    def mark_committed(self, offsets: Dict[int, int]):
+        self._committed.update(offsets)
@@ -0,0 +1,81 @@
+import json
+import logging
+import sqlite3
+
+from subscriptions import Subscription, SubscriptionFilter
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriptionRegistry:
+    """
+    Keeps push subscriptions in SQLite, so they survive a pubsub restart.
+    Writes only happen on subscribe, renew and unsubscribe, so the synchronous sqlite calls are cheap enough.
+    """
+
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                topic TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                batch_max_messages INTEGER NOT NULL,
+                batch_max_latency_ms INTEGER NOT NULL,
+                filter TEXT,
+                lease_s REAL,
+                expires_at REAL,
+                content_type TEXT NOT NULL DEFAULT 'application/json',
+                content_encoding TEXT NOT NULL DEFAULT 'identity',
+                PRIMARY KEY (topic, endpoint)
+            )
+        """)
+        # Registries created before pushes could be encoded
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(subscriptions)")}
+        if "content_type" not in columns:
+            self._db.execute("ALTER TABLE subscriptions ADD COLUMN content_type TEXT NOT NULL "
+                             "DEFAULT 'application/json'")
+            self._db.execute("ALTER TABLE subscriptions ADD COLUMN content_encoding TEXT NOT NULL DEFAULT 'identity'")
+        self._db.commit()
+
+    def load(self) -> list[Subscription]:
+        rows = self._db.execute("SELECT topic, endpoint, batch_max_messages, batch_max_latency_ms, filter, lease_s, "
+                                "expires_at, content_type, content_encoding FROM subscriptions").fetchall()
+        return [
+            Subscription(topic, endpoint, batch_max_messages, batch_max_latency_ms, _load_filter(subscription_filter),
+                         lease_s, expires_at, content_type, content_encoding)
+            for topic, endpoint, batch_max_messages, batch_max_latency_ms, subscription_filter, lease_s, expires_at,
+            content_type, content_encoding in rows
+        ]
+
+    def save(self, subscription: Subscription):
+        self._db.execute(
+            "INSERT OR REPLACE INTO subscriptions (topic, endpoint, batch_max_messages, batch_max_latency_ms, filter, "
+            "lease_s, expires_at, content_type, content_encoding) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (subscription.topic, subscription.endpoint, subscription.batch_max_messages,
+             subscription.batch_max_latency_ms, _dump_filter(subscription.filter), subscription.lease_s,
+             subscription.expires_at, subscription.content_type, subscription.content_encoding))
+        self._db.commit()
+
+    def delete(self, topic: str, endpoint: str):
+        self._db.execute("DELETE FROM subscriptions WHERE topic = ? AND endpoint = ?", (topic, endpoint))
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+
+def _dump_filter(subscription_filter: SubscriptionFilter | None) -> str | None:
+    if subscription_filter is None:
+        return None
+    values = sorted(subscription_filter.values) if subscription_filter.values is not None else None
+    return json.dumps({"attribute": subscription_filter.attribute, "values": values,
+                       "prefix": subscription_filter.prefix})
+
+
+def _load_filter(data: str | None) -> SubscriptionFilter | None:
+    if data is None:
+        return None
+    subscription_filter = json.loads(data)
+    values = subscription_filter["values"]
+    return SubscriptionFilter(subscription_filter["attribute"], frozenset(values) if values is not None else None,
+                              subscription_filter["prefix"])
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable
+
+from backend import Reader, Record
+from delivery import DeliveryError, Message, PostFn
+from subscriptions import SubscriptionFilter
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class Replay:
+    """
+    Redelivers the messages retained on a topic to one endpoint, in log order and at a limited rate, so rebuilding
+    a session from the log does not starve live deliveries.
+    Messages go out one push (or one batch) at a time. A failed push is retried here, holding up the rest of the replay,
+    and the replay fails once the attempts run out.
+    """
+
+    def __init__(self,
+                 replay_id: str,
+                 topic: str,
+                 endpoint: str,
+                 reader: Reader,
+                 post: PostFn,
+                 decode: Callable[[Record], Any],
+                 idempotency_key: Callable[[Record], str],
+                 message_filter: SubscriptionFilter | None,
+                 rate: float,
+                 batch_max_messages: int,
+                 max_attempts: int,
+                 backoff: Callable[[int], float]):
+        self.id = replay_id
+        self.topic = topic
+        self.endpoint = endpoint
+        self._reader = reader
+        self._post = post
+        self._decode = decode
+        self._idempotency_key = idempotency_key
+        self._filter = message_filter
+        self._interval = 1 / rate if rate > 0 else 0
+        self._batch_max_messages = batch_max_messages
+        self._max_attempts = max_attempts
+        self._backoff = backoff
+        self.state = PENDING
+        self.scanned = 0
+        self.delivered = 0
+        self.error: str | None = None
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (DONE, FAILED, CANCELLED)
+
+    def status(self) -> dict:
+        return {"replay_id": self.id, "topic": self.topic, "endpoint": self.endpoint, "state": self.state,
+                "scanned": self.scanned, "delivered": self.delivered, "error": self.error,
+                "started_at": self.started_at, "finished_at": self.finished_at}
+
+    async def run(self, slots: asyncio.Semaphore):
+        """
+        :param slots: limits the replays running at once, the replay stays pending until it gets one
+        """
+        try:
+            async with slots:
+                self.state = RUNNING
+                self.started_at = time.time()
+                await self._replay()
+            self.state = DONE
+            logger.info(f"Replay {self.id} of topic {self.topic} delivered {self.delivered} of {self.scanned} "
+                        f"messages to {self.endpoint}")
+        except asyncio.CancelledError:
+            self.state = CANCELLED
+            raise
+        except Exception as e:
+            self.state = FAILED
+            self.error = str(e)
+            logger.warning(f"Replay {self.id} of topic {self.topic} to {self.endpoint} failed: {e}")
+        finally:
+            self.finished_at = time.time()
+            await self._reader.close()
+
+    async def _replay(self):
+        # Time the next push may go out, pushes are spaced by the rate
+        next_push = time.monotonic()
+        while True:
+            records = await self._reader.poll(max_records=500)
+            if not records:
+                break
+            self.scanned += len(records)
+            messages = []
+            for record in records:
+                payload = self._decode(record)
+                if self._filter is None or self._filter.matches(payload):
+                    # Keys of their own, subscribers that saw the original messages would drop them otherwise
+                    messages.append(Message(payload, f"replay-{self.id}:{self._idempotency_key(record)}"))
+            for start in range(0, len(messages), self._batch_max_messages):
+                batch = messages[start:start + self._batch_max_messages]
+                delay = next_push - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self._deliver(batch)
+                self.delivered += len(batch)
+                next_push = max(next_push, time.monotonic()) + self._interval * len(batch)
+
+    async def _deliver(self, messages: list[Message]):
+        attempt = 0
+        while True:
+            try:
+                # Nothing waits for the acknowledgement of replayed messages, so deferred deliveries are fine as is
+                await self._post(self.topic, self.endpoint, messages, self._batch_max_messages > 1)
+                return
+            except DeliveryError as e:
+                attempt += 1
+                if not e.retryable or attempt >= self._max_attempts:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
@@ -0,0 +1,155 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+import metrics
+from delivery import DeliveryError, Message, PostFn
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(order=True)
+class PendingDelivery:
+    due: float
+    seq: int
+    topic: str = field(compare=False)
+    endpoint: str = field(compare=False)
+    message: Message = field(compare=False)
+    attempt: int = field(compare=False)
+    error: str = field(compare=False, default="")
+    # Resolved once the delivery is done: delivered, parked on the dead letter topic or dropped
+    resolved: asyncio.Future | None = field(compare=False, default=None)
+
+    def resolve(self):
+        if self.resolved is not None and not self.resolved.done():
+            self.resolved.set_result(None)
+
+
+class RetryScheduler:
+    """
+    Delay queue for failed deliveries. Retries happen off the topic consumer with exponential backoff and jitter,
+    and deliveries that run out of attempts are handed to the dead letter callback. Callers that must not deliver
+    anything else to the endpoint meanwhile wait for the `resolved` future of the delivery.
+    """
+
+    def __init__(self,
+                 post: PostFn,
+                 dead_letter: Callable[[PendingDelivery], Awaitable[None]],
+                 active: Callable[[str, str], bool],
+                 max_attempts: int,
+                 base_delay: float,
+                 max_delay: float,
+                 concurrency: int):
+        self._post = post
+        self._dead_letter = dead_letter
+        self._active = active
+        self.max_attempts = max_attempts
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._heap: list[PendingDelivery] = []
+        self._seq = itertools.count()
+        self._wake_up = asyncio.Event()
+        self._attempts: set[asyncio.Task] = set()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def depth(self) -> int:
+        return len(self._heap) + len(self._attempts)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Delay before the given retry attempt (1 based). Half of it is random so retries of a burst spread out.
+        """
+        delay = min(self._max_delay, self._base_delay * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def schedule(self, topic: str, endpoint: str, message: Message, attempt: int, error: str = "",
+                 resolved: asyncio.Future | None = None):
+        """
+        Queues a delivery that failed `attempt` times. Attempt 0 is delivered right away, used for replays.
+        Deliveries to endpoints that are no longer subscribed to the topic are dropped.
+        :param resolved: future resolved once the delivery is done, whichever way
+        """
+        if not self._active(topic, endpoint):
+            logger.info(f"Dropping delivery to {endpoint} for topic {topic}, it is no longer subscribed")
+            message.acknowledge()
+            if resolved is not None and not resolved.done():
+                resolved.set_result(None)
+            return
+        if attempt >= self.max_attempts:
+            self._spawn(self._park(PendingDelivery(time.monotonic(), next(self._seq), topic, endpoint, message,
+                                                   attempt, error, resolved)))
+            return
+        if attempt:
+            metrics.RETRIES.inc(endpoint)
+        due = time.monotonic() + (self.backoff(attempt) if attempt else 0)
+        heapq.heappush(self._heap, PendingDelivery(due, next(self._seq), topic, endpoint, message, attempt, error,
+                                                   resolved))
+        self._wake_up.set()
+
+    async def _run(self):
+        while True:
+            self._wake_up.clear()
+            now = time.monotonic()
+            while self._heap and self._heap[0].due <= now:
+                pending = heapq.heappop(self._heap)
+                if self._active(pending.topic, pending.endpoint):
+                    self._spawn(self._attempt(pending))
+                else:
+                    logger.info(f"Dropping retry to {pending.endpoint} for topic {pending.topic}, it unsubscribed")
+                    pending.message.acknowledge()
+                    pending.resolve()
+            timeout = self._heap[0].due - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wake_up.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._attempts.add(task)
+        task.add_done_callback(self._attempts.discard)
+
+    async def _park(self, pending: PendingDelivery):
+        try:
+            await self._dead_letter(pending)
+        finally:
+            pending.resolve()
+
+    async def _attempt(self, pending: PendingDelivery):
+        async with self._semaphore:
+            try:
+                # Retries go out one message at a time, batched subscribers accept single messages as well
+                if not await self._post(pending.topic, pending.endpoint, [pending.message], False):
+                    pending.message.acknowledge()
+                logger.info(f"Retry {pending.attempt} to {pending.endpoint} for topic {pending.topic} succeeded")
+                pending.resolve()
+            except DeliveryError as e:
+                attempt = pending.attempt + 1 if e.retryable else self.max_attempts
+                self.schedule(pending.topic, pending.endpoint, pending.message, attempt, str(e), pending.resolved)
+            except Exception as e:
+                logger.exception(f"Unexpected error retrying {pending.endpoint} for topic {pending.topic}: {e}")
+                self.schedule(pending.topic, pending.endpoint, pending.message, pending.attempt + 1, str(e),
+                              pending.resolved)
+
+    async def close(self):
+        """
+        Stops retrying and parks everything still waiting on the dead letter topics, so nothing is lost on shutdown
+        """
+        if self._task:
+            self._task.cancel()
+        # attempts in flight may still reschedule or dead letter their delivery
+        while self._attempts:
+            await asyncio.gather(*self._attempts, return_exceptions=True)
+        pending, self._heap = self._heap, []
+        for delivery in pending:
+            await self._park(delivery)
@@ -0,0 +1,30 @@
+from typing import Any
+
+# Where the A2A models keep the session id:
+# requests -> params.sessionId, SendTaskResponse -> result.sessionId,
+# streaming events -> result.metadata.sessionId, anything else -> metadata.sessionId
+SESSION_ID_PATHS = ("params.sessionId", "result.sessionId", "result.metadata.sessionId", "metadata.sessionId")
+
+
+def get_path(payload: Any, path: str) -> Any:
+    """
+    Looks up a dotted path such as "result.sessionId" in a json payload.
+    :return: the value, or None if any part of the path is missing
+    """
+    value = payload
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def session_id(payload: dict) -> str | None:
+    """
+    Finds the session id of an A2A message, used as the message key so that a session always lands on one partition
+    """
+    for path in SESSION_ID_PATHS:
+        value = get_path(payload, path)
+        if value:
+            return str(value)
+    return None
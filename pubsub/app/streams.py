@@ -0,0 +1,121 @@
+import asyncio
+import itertools
+import json
+import logging
+
+from fastapi import WebSocket
+
+from delivery import DeliveryError, FailureFn, Message
+
+logger = logging.getLogger(__name__)
+
+# Endpoint of streaming subscribers, e.g. stream://breba_app-generator_agent_topic
+STREAM_SCHEME = "stream://"
+
+
+def stream_endpoint(name: str) -> str:
+    return f"{STREAM_SCHEME}{name}"
+
+
+class StreamSubscriber:
+    """
+    Subscriber connected over a websocket instead of exposing an endpoint for pushes.
+    Messages are written as frames while the subscriber has credit. Every message takes one credit, and
+    acknowledging it gives the credit back, so a slow subscriber stops the flow instead of piling up frames.
+    Messages that are not acknowledged when the socket closes go through the usual retries.
+    """
+
+    def __init__(self, websocket: WebSocket, endpoint: str, credit: int, on_failure: FailureFn):
+        self.endpoint = endpoint
+        self._websocket = websocket
+        self._credit = credit
+        self._on_failure = on_failure
+        self._credit_changed = asyncio.Condition()
+        self._write_lock = asyncio.Lock()
+        self._ids = itertools.count()
+        # frame message id -> message waiting for the subscriber's acknowledgement
+        self._unacked: dict[int, Message] = {}
+        self.closed = False
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._unacked)
+
+    async def send(self, messages: list[Message], timeout: float):
+        """
+        Writes the messages, in as many frames as the credit allows. Returns once written, the messages are
+        acknowledged when the subscriber acks them.
+        :raises DeliveryError: if the subscriber has no credit for the first message within the timeout, or is gone
+        """
+        sent = 0
+        while sent < len(messages):
+            try:
+                async with self._credit_changed:
+                    await asyncio.wait_for(self._credit_changed.wait_for(lambda: self._credit > 0 or self.closed),
+                                           timeout)
+                    if self.closed:
+                        raise DeliveryError("Stream closed")
+                    chunk = messages[sent:sent + self._credit]
+                    self._credit -= len(chunk)
+            except (asyncio.TimeoutError, DeliveryError) as e:
+                error = e if isinstance(e, DeliveryError) else DeliveryError("Timeout waiting for stream credit")
+                if not sent:
+                    raise error
+                # Part of the batch is out already, fail only the rest
+                for message in messages[sent:]:
+                    self._on_failure(self.endpoint, message, error)
+                return
+            await self._write(chunk)
+            sent += len(chunk)
+
+    async def _write(self, messages: list[Message]):
+        frame = []
+        for message in messages:
+            message_id = next(self._ids)
+            self._unacked[message_id] = message
+            frame.append({"id": message_id, "idempotency_key": message.idempotency_key, "data": message.data})
+        try:
+            async with self._write_lock:
+                await self._websocket.send_text(json.dumps({"type": "messages", "messages": frame}))
+        except Exception as e:
+            # The socket is gone, close() hands everything unacknowledged to retries
+            logger.warning(f"Failed to write to {self.endpoint}: {e}")
+
+    async def grant(self, credit: int):
+        async with self._credit_changed:
+            self._credit += credit
+            self._credit_changed.notify_all()
+
+    async def ack(self, ids: list[int]):
+        """
+        Acknowledges delivered messages, each one returns a credit
+        """
+        acked = 0
+        for message_id in ids:
+            message = self._unacked.pop(message_id, None)
+            if message is not None:
+                message.acknowledge()
+                acked += 1
+        await self.grant(acked)
+
+    async def nack(self, ids: list[int], error: str):
+        """
+        The subscriber failed to process the messages, they are retried like a failed push
+        """
+        failed = 0
+        for message_id in ids:
+            message = self._unacked.pop(message_id, None)
+            if message is not None:
+                self._on_failure(self.endpoint, message, DeliveryError(error))
+                failed += 1
+        await self.grant(failed)
+
+    async def close(self):
+        async with self._credit_changed:
+            self.closed = True
+            self._credit_changed.notify_all()
+        unacked, self._unacked = self._unacked, {}
+        for message in unacked.values():
+            self._on_failure(self.endpoint, message, DeliveryError("Stream closed before acknowledgement"))
+        if unacked:
+            logger.info(f"Stream {self.endpoint} closed with {len(unacked)} unacknowledged messages")
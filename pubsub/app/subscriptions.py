@@ -0,0 +1,71 @@
+import time
+from dataclasses import dataclass
+from typing import Any
+
+import encoding
+import routing
+
+SESSION_ID = "sessionId"
+
+
+@dataclass(frozen=True)
+class SubscriptionFilter:
+    """
+    Attribute filter evaluated by pubsub before pushing, so subscribers only receive the messages they care about.
+    A message matches when the attribute is one of `values` and starts with `prefix`, whichever are set.
+    """
+    # "sessionId" finds the session id wherever the A2A message keeps it, anything else is a dotted path into the payload
+    attribute: str = SESSION_ID
+    values: frozenset[str] | None = None
+    prefix: str | None = None
+
+    def matches(self, payload: Any) -> bool:
+        if self.attribute == SESSION_ID:
+            value = routing.session_id(payload)
+        else:
+            value = routing.get_path(payload, self.attribute)
+        if value is None:
+            return False
+        value = str(value)
+        if self.values is not None and value not in self.values:
+            return False
+        return self.prefix is None or value.startswith(self.prefix)
+
+
+@dataclass
+class Subscription:
+    topic: str
+    endpoint: str
+    # Messages are pushed as a json array of up to batch_max_messages payloads.
+    # 1 pushes every message on its own, as a single json object
+    batch_max_messages: int = 1
+    # How long to wait for a batch to fill up before pushing what is there
+    batch_max_latency_ms: int = 0
+    # Only messages matching the filter are pushed, no filter pushes everything
+    filter: SubscriptionFilter | None = None
+    # Subscriptions with a lease expire unless renewed by subscribing again within lease_s seconds
+    lease_s: float | None = None
+    # Wall clock time, so that leases keep counting across pubsub restarts
+    expires_at: float | None = None
+    # Encoding of pushes, compression only applies to bodies above the compression threshold
+    content_type: str = encoding.JSON
+    content_encoding: str = encoding.IDENTITY
+
+    @property
+    def batched(self) -> bool:
+        return self.batch_max_messages > 1
+
+    def renew(self):
+        self.expires_at = time.time() + self.lease_s if self.lease_s else None
+
+    def expired(self, now: float) -> bool:
+        return self.expires_at is not None and self.expires_at <= now
+
+    def same_settings(self, other: "Subscription") -> bool:
+        return (self.batch_max_messages, self.batch_max_latency_ms, self.filter, self.lease_s, self.content_type,
+                self.content_encoding) == \
+            (other.batch_max_messages, other.batch_max_latency_ms, other.filter, other.lease_s, other.content_type,
+             other.content_encoding)
+
+    def accepts(self, payload: Any) -> bool:
+        return self.filter is None or self.filter.matches(payload)
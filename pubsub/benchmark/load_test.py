@@ -0,0 +1,260 @@
+"""
+End-to-end load test of the pubsub service: publishes at a fixed rate to a number of topics, receives the pushes on
+stand-in subscribers with tunable latency and failure rate, and reports publish->push latency and throughput.
+
+By default a pubsub instance with the in-memory broker is started for the run, pass --pubsub-url to test a running
+one instead (e.g. docker compose with kafka, with --receive-host set to an address the container can reach).
+
+python load_test.py --topics 4 --rate 200 --duration 20 --payload tag
+python load_test.py --payload html --subscriber-latency-ms 50 --subscriber-failure-rate 0.05
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import httpx
+from aiohttp import web
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+
+# A streamed html tag, as published by the generator agent
+TAG_TEXT = "<p>Lorem ipsum dolor sit amet, consectetur.</p>"
+# A complete page, as published when the generator finishes
+HTML_TEXT = ("<!DOCTYPE html><html><head><title>Bench</title><style>body { font-family: sans-serif; }</style></head>"
+             "<body>" + "<section><h2>Section</h2><p>" + "Lorem ipsum dolor sit amet. " * 40 + "</p></section>" * 20
+             + "</body></html>")
+
+
+def make_payload(kind: str, session_id: str, seq: int, size: int | None) -> dict:
+    text = HTML_TEXT if kind == "html" else TAG_TEXT
+    if size:
+        text = (text * (size // len(text) + 1))[:size]
+    return {
+        "jsonrpc": "2.0",
+        "response_method": "tasks/sendSubscribe",
+        "result": {
+            "id": f"task-{session_id}",
+            "artifact": {"parts": [{"type": "text", "text": text}], "index": 0},
+            "status": {"state": "working"},
+            "metadata": {"sessionId": session_id, "benchSeq": seq, "benchSentAt": time.time()},
+        },
+    }
+
+
+@dataclass
+class Stats:
+    published: int = 0
+    publish_errors: int = 0
+    # Pushes the stand-in subscribers answered with an error on purpose
+    rejected: int = 0
+    duplicates: int = 0
+    latencies: list[float] = field(default_factory=list)
+    delivered_keys: set[str] = field(default_factory=set)
+    first_delivery: float | None = None
+    last_delivery: float | None = None
+
+
+class StandInSubscriber:
+    """
+    Push endpoint that sleeps for the configured latency, fails a share of the pushes with a 503,
+    and records publish->push latency of everything it accepts
+    """
+
+    def __init__(self, stats: Stats, latency_ms: float, failure_rate: float):
+        self._stats = stats
+        self._latency = latency_ms / 1000
+        self._failure_rate = failure_rate
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        if random.random() < self._failure_rate:
+            self._stats.rejected += 1
+            return web.Response(status=503)
+        body = await request.json()
+        payloads = body if isinstance(body, list) else [body]
+        keys = request.headers.get("Idempotency-Key", "").split(",")
+        now = time.time()
+        for payload, key in zip(payloads, keys):
+            # Every subscriber of a topic receives the same keys
+            delivery = f"{request.path}:{key}"
+            if delivery in self._stats.delivered_keys:
+                self._stats.duplicates += 1
+                continue
+            self._stats.delivered_keys.add(delivery)
+            self._stats.latencies.append(now - payload["result"]["metadata"]["benchSentAt"])
+        self._stats.first_delivery = self._stats.first_delivery or now
+        self._stats.last_delivery = now
+        return web.json_response({"status": "success"})
+
+
+async def start_subscribers(subscriber: StandInSubscriber, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_post("/push/{topic}/{index}", subscriber.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    return runner
+
+
+def start_pubsub(port: int) -> subprocess.Popen:
+    # No registry, benchmark subscriptions must not be restored by the next real start of pubsub
+    env = {**os.environ, "PUBSUB_BACKEND": os.getenv("PUBSUB_BACKEND", "memory"), "PUBSUB_REGISTRY_PATH": ""}
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                            cwd=APP_DIR, env=env)
+
+
+async def wait_until_ready(client: httpx.AsyncClient, pubsub_url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            (await client.get(f"{pubsub_url}/metrics")).raise_for_status()
+            return
+        except httpx.HTTPError:
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"pubsub at {pubsub_url} did not come up")
+
+
+async def publish_at_rate(client: httpx.AsyncClient, pubsub_url: str, topic: str, args, stats: Stats,
+                          semaphore: asyncio.Semaphore):
+    """
+    Open loop publishing: messages are sent on schedule whether or not earlier publishes have returned,
+    so a slow service shows up as latency instead of a lower offered rate
+    """
+    sessions = [f"bench-{uuid.uuid4().hex[:8]}" for _ in range(args.sessions)]
+    interval = 1 / args.rate
+    start = time.monotonic()
+    pending = set()
+    for seq in range(int(args.rate * args.duration)):
+        delay = start + seq * interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        kind = random.choice(["tag"] * args.tags_per_page + ["html"]) if args.payload == "mixed" else args.payload
+        payload = make_payload(kind, sessions[seq % len(sessions)], seq, args.payload_size)
+        task = asyncio.create_task(publish_one(client, pubsub_url, topic, payload, stats, semaphore))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    await asyncio.gather(*pending)
+
+
+async def publish_one(client: httpx.AsyncClient, pubsub_url: str, topic: str, payload: dict, stats: Stats,
+                      semaphore: asyncio.Semaphore):
+    async with semaphore:
+        try:
+            response = await client.post(f"{pubsub_url}/publish", json={"topic": topic, "payload": payload})
+            response.raise_for_status()
+            stats.published += 1
+        except httpx.HTTPError:
+            stats.publish_errors += 1
+
+
+async def wait_for_drain(stats: Stats, expected: int, timeout: float):
+    deadline = time.monotonic() + timeout
+    while len(stats.delivered_keys) < expected and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+async def lag(client: httpx.AsyncClient, pubsub_url: str) -> int:
+    metrics = (await client.get(f"{pubsub_url}/metrics")).text
+    return sum(int(float(line.rsplit(" ", 1)[1])) for line in metrics.splitlines()
+               if line.startswith("pubsub_consumer_lag{"))
+
+
+def report(args, stats: Stats, expected: int, remaining_lag: int):
+    delivered = len(stats.delivered_keys)
+    elapsed = (stats.last_delivery - stats.first_delivery) if delivered > 1 else float("nan")
+    print(f"topics={args.topics} subscribers/topic={args.subscribers} rate/topic={args.rate}/s "
+          f"duration={args.duration}s payload={args.payload} batch={args.batch_max_messages}")
+    print(f"published       {stats.published} ({stats.publish_errors} errors)")
+    print(f"delivered       {delivered} of {expected} expected, {stats.duplicates} duplicates, "
+          f"{stats.rejected} pushes rejected on purpose")
+    print(f"throughput      {delivered / elapsed if elapsed else float('nan'):.0f} deliveries/s")
+    print("latency (ms)    " + "  ".join(f"p{p}={percentile(stats.latencies, p) * 1000:.1f}" for p in (50, 90, 99))
+          + f"  max={max(stats.latencies, default=float('nan')) * 1000:.1f}")
+    print(f"consumer lag    {remaining_lag}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="End-to-end publish->push load test of the pubsub service")
+    parser.add_argument("--pubsub-url", help="test a running pubsub instead of starting one with the memory broker")
+    parser.add_argument("--pubsub-port", type=int, default=8100)
+    parser.add_argument("--receive-host", default="127.0.0.1", help="host pubsub uses to reach the subscribers")
+    parser.add_argument("--subscriber-port", type=int, default=8101)
+    parser.add_argument("--topics", type=int, default=2)
+    parser.add_argument("--subscribers", type=int, default=1, help="subscribers per topic")
+    parser.add_argument("--rate", type=float, default=100, help="messages per second per topic")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of publishing")
+    parser.add_argument("--sessions", type=int, default=10, help="sessions per topic, each one is a message key")
+    parser.add_argument("--payload", choices=["tag", "html", "mixed"], default="tag",
+                        help="generator tag stream, full html pages, or a page every --tags-per-page tags")
+    parser.add_argument("--tags-per-page", type=int, default=50)
+    parser.add_argument("--payload-size", type=int, help="pad or cut the payload text to this many characters")
+    parser.add_argument("--subscriber-latency-ms", type=float, default=0)
+    parser.add_argument("--subscriber-failure-rate", type=float, default=0)
+    parser.add_argument("--batch-max-messages", type=int, default=1)
+    parser.add_argument("--batch-max-latency-ms", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=200, help="max publish requests in flight")
+    parser.add_argument("--drain-timeout", type=float, default=30)
+    args = parser.parse_args()
+
+    pubsub = None
+    pubsub_url = args.pubsub_url
+    if pubsub_url is None:
+        pubsub = start_pubsub(args.pubsub_port)
+        pubsub_url = f"http://127.0.0.1:{args.pubsub_port}"
+
+    stats = Stats()
+    runner = await start_subscribers(
+        StandInSubscriber(stats, args.subscriber_latency_ms, args.subscriber_failure_rate), args.subscriber_port)
+    run_id = uuid.uuid4().hex[:6]
+    topics = [f"bench_{run_id}_{index}" for index in range(args.topics)]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+            await wait_until_ready(client, pubsub_url)
+            subscribed = []
+            try:
+                for topic in topics:
+                    for index in range(args.subscribers):
+                        endpoint = f"http://{args.receive_host}:{args.subscriber_port}/push/{topic}/{index}"
+                        response = await client.post(f"{pubsub_url}/subscribe", json={
+                            "topic": topic, "endpoint": endpoint, "batch_max_messages": args.batch_max_messages,
+                            "batch_max_latency_ms": args.batch_max_latency_ms})
+                        response.raise_for_status()
+                        subscribed.append((topic, endpoint))
+                # Consumers join their group in the background and start from the latest offset
+                await asyncio.sleep(2)
+
+                semaphore = asyncio.Semaphore(args.concurrency)
+                await asyncio.gather(*(publish_at_rate(client, pubsub_url, topic, args, stats, semaphore)
+                                       for topic in topics))
+                expected = stats.published * args.subscribers
+                await wait_for_drain(stats, expected, args.drain_timeout)
+                report(args, stats, expected, await lag(client, pubsub_url))
+            finally:
+                # A running pubsub given with --pubsub-url would otherwise keep pushing to the stand-in subscribers
+                for topic, endpoint in subscribed:
+                    await client.post(f"{pubsub_url}/unsubscribe", json={"topic": topic, "endpoint": endpoint})
+    finally:
+        await runner.cleanup()
+        if pubsub is not None:
+            pubsub.terminate()
+            pubsub.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
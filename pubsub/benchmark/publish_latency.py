@@ -0,0 +1,68 @@
+"""
+Per message publish latency with a fresh httpx client per publish, which is what common.utils used to do,
+against the shared keep-alive client of common.http_client. Run against a running pubsub:
+
+python publish_latency.py --count 500
+PUBSUB_URL=https://pubsub.example.com python publish_latency.py  # with TLS the handshake dominates a fresh client
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+
+from common.http_client import close_client, get_client  # noqa: E402
+from publish_throughput import PUBSUB_URL, TAG_PAYLOAD  # noqa: E402
+
+
+async def publish_fresh(topic: str) -> None:
+    async with httpx.AsyncClient() as client:
+        response = await client.post(f"{PUBSUB_URL}/publish", json={"topic": topic, "payload": TAG_PAYLOAD})
+        response.raise_for_status()
+
+
+async def publish_shared(topic: str) -> None:
+    response = await get_client().post(f"{PUBSUB_URL}/publish", json={"topic": topic, "payload": TAG_PAYLOAD})
+    response.raise_for_status()
+
+
+async def measure(publish, topic: str, count: int) -> list[float]:
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        await publish(topic)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Per message /publish latency, fresh vs shared http client")
+    parser.add_argument("--topic", default="bench_topic")
+    parser.add_argument("--count", type=int, default=500)
+    args = parser.parse_args()
+
+    # Warms up pubsub and the shared pool, so neither run pays for the first connection
+    await measure(publish_shared, args.topic, 10)
+    results = {
+        "fresh client per publish": await measure(publish_fresh, args.topic, args.count),
+        "shared client": await measure(publish_shared, args.topic, args.count),
+    }
+    await close_client()
+
+    for name, latencies in results.items():
+        print(f"{name:<26} " + "  ".join(f"p{p}={percentile(latencies, p) * 1000:.2f}ms" for p in (50, 90, 99))
+              + f"  mean={sum(latencies) / len(latencies) * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+
+PUBSUB_URL = os.getenv("PUBSUB_URL", "http://localhost:8000")
+
+# Roughly the size of a streamed html tag wrapped in a SendTaskStreamingResponse
+TAG_PAYLOAD = {
+    "jsonrpc": "2.0",
+    "response_method": "tasks/sendSubscribe",
+    "result": {
+        "id": "task-bench",
+        "artifact": {"parts": [{"type": "text", "text": "<p>Lorem ipsum dolor sit amet, consectetur.</p>"}],
+                     "index": 0},
+        "status": {"state": "working"},
+        "metadata": {"sessionId": "bench-session"},
+    },
+}
+
+
+async def publish_single(client: httpx.AsyncClient, topic: str, count: int, confirm: bool) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        response = await client.post(f"{PUBSUB_URL}/publish",
+                                     json={"topic": topic, "payload": TAG_PAYLOAD, "confirm": confirm})
+        response.raise_for_status()
+    return count / (time.perf_counter() - start)
+
+
+async def publish_batched(client: httpx.AsyncClient, topic: str, count: int, batch_size: int, confirm: bool) -> float:
+    start = time.perf_counter()
+    for offset in range(0, count, batch_size):
+        records = [{"topic": topic, "payload": TAG_PAYLOAD} for _ in range(min(batch_size, count - offset))]
+        response = await client.post(f"{PUBSUB_URL}/publish/batch", json={"records": records, "confirm": confirm})
+        response.raise_for_status()
+    return count / (time.perf_counter() - start)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measures /publish and /publish/batch throughput in messages/sec")
+    parser.add_argument("--topic", default="bench_topic")
+    parser.add_argument("--count", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    async with httpx.AsyncClient() as client:
+        # confirm=True waits for the broker ack on every message, which is what the old flush-per-send path did
+        results = {
+            "single, confirmed (flush per message)": await publish_single(client, args.topic, args.count, True),
+            "single, async": await publish_single(client, args.topic, args.count, False),
+            f"batch of {args.batch_size}, confirmed": await publish_batched(client, args.topic, args.count,
+                                                                           args.batch_size, True),
+            f"batch of {args.batch_size}, async": await publish_batched(client, args.topic, args.count,
+                                                                       args.batch_size, False),
+        }
+
+    for name, rate in results.items():
+        print(f"{name:<40} {rate:>10.0f} msg/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
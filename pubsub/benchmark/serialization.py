@@ -0,0 +1,61 @@
+"""
+Serialization cost of a streamed artifact update, the message the generator publishes for every coalesced chunk of html.
+Compares model_dump + json.dumps / json.loads + validate_python, which is what publishing and push handlers used to do,
+against the fast path of common.encoding and common.model: pydantic-core straight to bytes and validate_json.
+
+python serialization.py --count 20000
+python serialization.py --chunk-chars 16384  # a chunk flushed because the coalescing buffer was full
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+
+from common import encoding  # noqa: E402
+from common.google_pub_sub import validate_push  # noqa: E402
+from common.model import (A2AResponse, A2AResponsePush, Artifact, SendTaskStreamingResponse,  # noqa: E402
+                          TaskArtifactUpdateEvent, TextPart)
+
+
+def artifact_update(chunk_chars: int) -> SendTaskStreamingResponse:
+    html = ('<section class="hero"><h1>Fresh bread every morning</h1><p>Baked on site</p></section>' * (
+            chunk_chars // 80 + 1))[:chunk_chars]
+    artifact = Artifact(parts=[TextPart(text=html)], append=True)
+    return SendTaskStreamingResponse(
+        result=TaskArtifactUpdateEvent(id="task-1", artifact=artifact, metadata={"sessionId": "user-1-session-1"}))
+
+
+def measure(name: str, fn, count: int):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<44} {elapsed / count * 1e6:8.2f}us/msg")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serialization cost of a streamed artifact update")
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--chunk-chars", type=int, default=400, help="html characters in the artifact")
+    args = parser.parse_args()
+
+    response = artifact_update(args.chunk_chars)
+    publish_request = {"topic": "generator_agent_topic", "payload": response}
+    body = encoding.serialize(response, encoding.JSON)
+    print(f"artifact update of {args.chunk_chars} html characters, {len(body)} bytes as json")
+
+    measure("publish: model_dump + json.dumps",
+            lambda: json.dumps({"topic": "generator_agent_topic",
+                                "payload": response.model_dump(exclude_none=True)}).encode("utf-8"),
+            args.count)
+    measure("publish: encoding.serialize", lambda: encoding.serialize(publish_request, encoding.JSON), args.count)
+    measure("push: json.loads + validate_python", lambda: A2AResponse.validate_python(json.loads(body)), args.count)
+    measure("push: validate_json", lambda: A2AResponse.validate_json(body), args.count)
+    measure("push: validate_push (single or batch)", lambda: validate_push(body, A2AResponsePush), args.count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# pubsub modules import each other by name, the way they run from pubsub/app
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
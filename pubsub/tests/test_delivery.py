@@ -0,0 +1,174 @@
+import asyncio
+
+from delivery import DeliveryError, EndpointWorker, Message
+from retry import RetryScheduler
+from subscriptions import Subscription
+
+TOPIC = "topic"
+ENDPOINT = "http://subscriber/push"
+
+
+class Acks:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+
+
+async def wait_for(condition, timeout_s=2.0):
+    async with asyncio.timeout(timeout_s):
+        while not condition():
+            await asyncio.sleep(0.001)
+
+
+def test_drop_acknowledges_the_batch_being_posted():
+    async def run():
+        posting = asyncio.Event()
+
+        async def post(topic, endpoint, messages, batched):
+            posting.set()
+            await asyncio.sleep(10)
+            return False
+
+        worker = EndpointWorker(Subscription(TOPIC, ENDPOINT), post, lambda *args: None, max_in_flight=10)
+        acks = [Acks(), Acks()]
+        for n, ack in enumerate(acks):
+            await worker.put(Message({"n": n}, f"key-{n}", ack))
+        await posting.wait()
+        await worker.drop()
+        assert [ack.count for ack in acks] == [1, 1]
+
+    asyncio.run(run())
+
+
+def test_drop_acknowledges_a_batch_still_filling_up():
+    async def run():
+        async def post(topic, endpoint, messages, batched):
+            return False
+
+        subscription = Subscription(TOPIC, ENDPOINT, batch_max_messages=10, batch_max_latency_ms=10_000)
+        worker = EndpointWorker(subscription, post, lambda *args: None, max_in_flight=10)
+        ack = Acks()
+        await worker.put(Message({"n": 1}, "key-1", ack))
+        await wait_for(lambda: worker.depth == 0)
+        await worker.drop()
+        assert ack.count == 1
+
+    asyncio.run(run())
+
+
+def test_delivered_batches_are_not_acknowledged_again_by_drop():
+    async def run():
+        async def post(topic, endpoint, messages, batched):
+            return False
+
+        worker = EndpointWorker(Subscription(TOPIC, ENDPOINT), post, lambda *args: None, max_in_flight=10)
+        ack = Acks()
+        await worker.put(Message({"n": 1}, "key-1", ack))
+        await wait_for(lambda: ack.count)
+        await asyncio.sleep(0.01)
+        await worker.drop()
+        assert ack.count == 1
+
+    asyncio.run(run())
+
+
+def test_later_messages_wait_for_the_retry_of_a_failed_one():
+    async def run():
+        pushed = []
+
+        async def post(topic, endpoint, messages, batched):
+            pushed.extend(message.data["n"] for message in messages)
+            if pushed == [1]:
+                raise DeliveryError("503: busy")
+            return False
+
+        dead_letters = []
+
+        async def dead_letter(delivery):
+            dead_letters.append(delivery)
+
+        retries = RetryScheduler(post, dead_letter, lambda topic, endpoint: True, max_attempts=3, base_delay=0.01,
+                                 max_delay=0.01, concurrency=2)
+        retries.start()
+
+        def on_failure(endpoint, message, error):
+            resolved = asyncio.get_running_loop().create_future()
+            retries.schedule(TOPIC, endpoint, message, 1, str(error), resolved)
+            return resolved
+
+        worker = EndpointWorker(Subscription(TOPIC, ENDPOINT), post, on_failure, max_in_flight=10)
+        acks = [Acks() for _ in range(3)]
+        for n, ack in enumerate(acks, start=1):
+            await worker.put(Message({"n": n}, f"key-{n}", ack))
+        await wait_for(lambda: all(ack.count for ack in acks))
+        await worker.close()
+        await retries.close()
+        assert pushed == [1, 1, 2, 3]
+        assert dead_letters == []
+
+    asyncio.run(run())
+
+
+def test_a_failed_batch_is_retried_in_order_before_the_next_batch():
+    async def run():
+        pushed = []
+        resolutions = []
+
+        async def post(topic, endpoint, messages, batched):
+            pushed.append([message.data["n"] for message in messages])
+            return False
+
+        def on_failure(endpoint, message, error):
+            resolved = asyncio.get_running_loop().create_future()
+            resolutions.append((message.data["n"], resolved))
+            return resolved
+
+        async def fail_first(topic, endpoint, messages, batched):
+            if not pushed:
+                pushed.append([message.data["n"] for message in messages])
+                raise DeliveryError("503: busy")
+            return await post(topic, endpoint, messages, batched)
+
+        subscription = Subscription(TOPIC, ENDPOINT, batch_max_messages=2)
+        worker = EndpointWorker(subscription, fail_first, on_failure, max_in_flight=10)
+        for n in range(1, 5):
+            await worker.put(Message({"n": n}, f"key-{n}"))
+        await wait_for(lambda: len(resolutions) == 1)
+        await asyncio.sleep(0.01)
+        # The second message of the failed batch is handed over only once the first one is resolved
+        assert [n for n, _ in resolutions] == [1]
+        resolutions[0][1].set_result(None)
+        await wait_for(lambda: len(resolutions) == 2)
+        assert pushed == [[1, 2]]
+        resolutions[1][1].set_result(None)
+        await wait_for(lambda: len(pushed) == 2)
+        assert pushed == [[1, 2], [3, 4]]
+        await worker.close()
+
+    asyncio.run(run())
+
+
+def test_drop_while_waiting_for_a_retry_acknowledges_what_was_not_handed_over():
+    async def run():
+        async def post(topic, endpoint, messages, batched):
+            raise DeliveryError("503: busy")
+
+        handed_over = []
+
+        def on_failure(endpoint, message, error):
+            handed_over.append(message)
+            return asyncio.get_running_loop().create_future()
+
+        subscription = Subscription(TOPIC, ENDPOINT, batch_max_messages=2)
+        worker = EndpointWorker(subscription, post, on_failure, max_in_flight=10)
+        acks = [Acks() for _ in range(3)]
+        for n, ack in enumerate(acks, start=1):
+            await worker.put(Message({"n": n}, f"key-{n}", ack))
+        await wait_for(lambda: handed_over)
+        await worker.drop()
+        # The first message belongs to its retry, the rest is dropped
+        assert [ack.count for ack in acks] == [0, 1, 1]
+
+    asyncio.run(run())
@@ -0,0 +1,43 @@
+import pytest
+
+import encoding
+
+PAYLOAD = {"jsonrpc": "2.0", "result": {"id": "task-1", "sessionId": "session-1",
+                                        "artifact": {"parts": [{"type": "text", "text": "<p>é</p>" * 1000}]}}}
+
+
+@pytest.mark.parametrize("content_type", encoding.CONTENT_TYPES)
+@pytest.mark.parametrize("content_encoding", encoding.CONTENT_ENCODINGS)
+def test_round_trips(content_type, content_encoding):
+    data, applied_type, applied_encoding = encoding.encode(PAYLOAD, content_type, content_encoding, threshold=0)
+    assert (applied_type, applied_encoding) == (content_type, content_encoding)
+    assert encoding.decode(data, applied_type, applied_encoding) == PAYLOAD
+
+
+@pytest.mark.parametrize("content_encoding", [encoding.GZIP, encoding.ZSTD])
+def test_compresses_repetitive_payloads(content_encoding):
+    plain, _, _ = encoding.encode(PAYLOAD, encoding.JSON, encoding.IDENTITY)
+    compressed, _, _ = encoding.encode(PAYLOAD, encoding.JSON, content_encoding, threshold=0)
+    assert len(compressed) < len(plain) / 10
+
+
+def test_small_payloads_are_not_compressed():
+    data, _, applied = encoding.encode({"n": 1}, encoding.MSGPACK, encoding.ZSTD, threshold=4096)
+    assert applied == encoding.IDENTITY
+    assert encoding.decode(data, encoding.MSGPACK, applied) == {"n": 1}
+
+
+def test_missing_headers_mean_plain_json():
+    assert encoding.decode(b'{"n": 1}') == {"n": 1}
+
+
+def test_media_type_drops_parameters():
+    assert encoding.media_type("Application/MsgPack; charset=utf-8") == encoding.MSGPACK
+    assert encoding.media_type(None) == encoding.JSON
+
+
+@pytest.mark.parametrize("content_type, content_encoding", [("text/plain", encoding.IDENTITY),
+                                                            (encoding.JSON, "br")])
+def test_rejects_unsupported_encodings(content_type, content_encoding):
+    with pytest.raises(ValueError):
+        encoding.encode(PAYLOAD, content_type, content_encoding, threshold=0)
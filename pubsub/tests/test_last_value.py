@@ -0,0 +1,49 @@
+from last_value import LastValueCache
+
+TOPIC = "generator"
+
+
+def response(session_id: str, text: str) -> dict:
+    return {"result": {"sessionId": session_id, "text": text}}
+
+
+def test_keeps_the_latest_value_per_key():
+    cache = LastValueCache({TOPIC: "sessionId"}, max_keys=10)
+    cache.update(TOPIC, response("a", "first"), timestamp=1)
+    cache.update(TOPIC, response("a", "second"), timestamp=2)
+    cache.update(TOPIC, response("b", "other"), timestamp=3)
+    assert cache.get(TOPIC, "a").payload["result"]["text"] == "second"
+    assert cache.get(TOPIC, "a").timestamp == 2
+    assert cache.get(TOPIC, "b").payload["result"]["text"] == "other"
+
+
+def test_older_messages_do_not_replace_newer_ones():
+    cache = LastValueCache({TOPIC: "sessionId"}, max_keys=10)
+    cache.update(TOPIC, response("a", "new"), timestamp=5)
+    cache.update(TOPIC, response("a", "old"), timestamp=4)
+    assert cache.get(TOPIC, "a").payload["result"]["text"] == "new"
+
+
+def test_keys_by_path_and_skips_messages_without_one():
+    cache = LastValueCache({TOPIC: "result.text"}, max_keys=10)
+    cache.update(TOPIC, response("a", "page"), timestamp=1)
+    cache.update(TOPIC, {"result": {}}, timestamp=2)
+    assert cache.get(TOPIC, "page") is not None
+    assert cache.get(TOPIC, "None") is None
+
+
+def test_only_configured_topics_are_cached():
+    cache = LastValueCache({TOPIC: "sessionId"}, max_keys=10)
+    cache.update("builder", response("a", "spec"), timestamp=1)
+    assert cache.get("builder", "a") is None
+
+
+def test_evicts_the_keys_not_updated_for_longest():
+    cache = LastValueCache({TOPIC: "sessionId"}, max_keys=2)
+    cache.update(TOPIC, response("a", "1"), timestamp=1)
+    cache.update(TOPIC, response("b", "2"), timestamp=2)
+    cache.update(TOPIC, response("a", "3"), timestamp=3)
+    cache.update(TOPIC, response("c", "4"), timestamp=4)
+    assert cache.get(TOPIC, "b") is None
+    assert cache.get(TOPIC, "a") is not None
+    assert cache.get(TOPIC, "c") is not None
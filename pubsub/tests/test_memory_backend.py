@@ -0,0 +1,101 @@
+import asyncio
+
+from memory_backend import MemoryBackend
+
+TOPIC = "topic"
+
+
+def test_consumer_reads_each_key_in_publish_order():
+    async def run():
+        backend = MemoryBackend(partitions=4, retention=100)
+        consumer = backend.consumer(TOPIC, "group")
+        for n in range(30):
+            await backend.send(TOPIC, str(n).encode(), key=f"session-{n % 3}")
+        records = []
+        while len(records) < 30:
+            records.extend(await consumer.poll(timeout_ms=100, max_records=7))
+        for session in range(3):
+            values = [int(record.value) for record in records if record.key == f"session-{session}"]
+            assert values == list(range(session, 30, 3))
+        assert len({record.partition for record in records if record.key == "session-0"}) == 1
+        await consumer.close()
+
+    asyncio.run(run())
+
+
+def test_send_resolves_with_the_stored_record():
+    async def run():
+        backend = MemoryBackend(partitions=1, retention=100)
+        first = await backend.send(TOPIC, b"a", key="k", headers=[("content-type", b"application/json")])
+        second = await backend.send(TOPIC, b"b", key="k")
+        assert (first.offset, second.offset) == (0, 1)
+        assert first.headers == [("content-type", b"application/json")]
+
+    asyncio.run(run())
+
+
+def test_poll_waits_for_a_message():
+    async def run():
+        backend = MemoryBackend(partitions=2, retention=100)
+        consumer = backend.consumer(TOPIC, "group")
+        poll = asyncio.create_task(consumer.poll(timeout_ms=2000))
+        await asyncio.sleep(0.01)
+        await backend.send(TOPIC, b"late", key="k")
+        assert [record.value for record in await asyncio.wait_for(poll, 1)] == [b"late"]
+        await consumer.close()
+
+    asyncio.run(run())
+
+
+def test_latest_consumers_skip_earlier_messages_and_groups_resume_from_their_commit():
+    async def run():
+        backend = MemoryBackend(partitions=1, retention=100)
+        await backend.send(TOPIC, b"before")
+        consumer = backend.consumer(TOPIC, "group", enable_auto_commit=False)
+        await backend.send(TOPIC, b"first")
+        await backend.send(TOPIC, b"second")
+        records = await consumer.poll(timeout_ms=100)
+        assert [record.value for record in records] == [b"first", b"second"]
+        await consumer.commit({0: records[0].offset + 1})
+        await consumer.close()
+
+        resumed = backend.consumer(TOPIC, "group")
+        assert [record.value for record in await resumed.poll(timeout_ms=100)] == [b"second"]
+        await resumed.close()
+
+    asyncio.run(run())
+
+
+def test_groups_split_partitions_between_members():
+    async def run():
+        backend = MemoryBackend(partitions=4, retention=100)
+        first = backend.consumer(TOPIC, "group")
+        second = backend.consumer(TOPIC, "group")
+        for n in range(40):
+            await backend.send(TOPIC, str(n).encode(), key=f"session-{n}")
+        records = await first.poll(timeout_ms=100) + await second.poll(timeout_ms=100)
+        assert sorted(int(record.value) for record in records) == list(range(40))
+        await first.close()
+        await second.close()
+
+    asyncio.run(run())
+
+
+def test_readers_only_see_retained_messages_published_before_they_opened():
+    async def run():
+        backend = MemoryBackend(partitions=1, retention=5)
+        for n in range(12):
+            await backend.send(TOPIC, str(n).encode())
+        reader = backend.reader(TOPIC)
+        await backend.send(TOPIC, b"after")
+        values = []
+        while records := await reader.poll(max_records=3):
+            values.extend(int(record.value) for record in records)
+        # Retention trims in bulk, at least the last 5 are kept
+        assert values == list(range(values[0], 12))
+        assert values[0] <= 7
+
+        from_offset = backend.reader(TOPIC, offsets={0: 10})
+        assert [record.value for record in await from_offset.poll()] == [b"10", b"11", b"after"]
+
+    asyncio.run(run())
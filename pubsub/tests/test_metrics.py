@@ -0,0 +1,58 @@
+import pytest
+
+import metrics
+
+from metrics import Counter, Gauge, Histogram, _Metric
+
+
+def test_renders_a_counter():
+    counter = Counter("pubsub_test_total", "Test messages", ("topic",))
+    counter.inc("a")
+    counter.inc("a", amount=2)
+    counter.inc('b"\n')
+    assert counter.render() == [
+        "# HELP pubsub_test_total Test messages",
+        "# TYPE pubsub_test_total counter",
+        'pubsub_test_total{topic="a"} 3',
+        'pubsub_test_total{topic="b\\"\\n"} 1',
+    ]
+
+
+def test_renders_a_gauge_without_labels():
+    gauge = Gauge("pubsub_test_depth", "Test depth")
+    assert gauge.render() == ["# HELP pubsub_test_depth Test depth", "# TYPE pubsub_test_depth gauge"]
+    gauge.set(4)
+    gauge.set(2)
+    assert gauge.render()[2:] == ["pubsub_test_depth 2"]
+    gauge.clear()
+    assert gauge.render()[2:] == []
+
+
+def test_renders_cumulative_histogram_buckets():
+    histogram = Histogram("pubsub_test_seconds", "Test latency", ("endpoint",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, "http://subscriber/push")
+    assert histogram.render() == [
+        "# HELP pubsub_test_seconds Test latency",
+        "# TYPE pubsub_test_seconds histogram",
+        'pubsub_test_seconds_bucket{endpoint="http://subscriber/push",le="0.1"} 2',
+        'pubsub_test_seconds_bucket{endpoint="http://subscriber/push",le="1.0"} 3',
+        'pubsub_test_seconds_bucket{endpoint="http://subscriber/push",le="+Inf"} 4',
+        'pubsub_test_seconds_sum{endpoint="http://subscriber/push"} 3.65',
+        'pubsub_test_seconds_count{endpoint="http://subscriber/push"} 4',
+    ]
+
+
+def test_metrics_must_render_their_samples():
+    class Incomplete(_Metric):
+        kind = "gauge"
+
+    with pytest.raises(TypeError):
+        Incomplete("pubsub_incomplete", "No samples")
+
+
+def test_renders_every_registered_metric():
+    text = metrics.render()
+    assert text.endswith("\n")
+    for metric in metrics.REGISTRY:
+        assert f"# TYPE {metric.name} {metric.kind}\n" in text
@@ -0,0 +1,58 @@
+from offsets import OffsetTracker
+
+
+def test_commits_up_to_the_lowest_unacknowledged_offset():
+    tracker = OffsetTracker()
+    acks = {offset: tracker.track(0, offset, 1) for offset in range(10, 15)}
+    assert tracker.committable() == {0: 10}
+
+    acks[11]()
+    acks[12]()
+    assert tracker.committable() == {0: 10}
+
+    acks[10]()
+    assert tracker.committable() == {0: 13}
+    assert tracker.pending == 2
+
+    acks[14]()
+    acks[13]()
+    assert tracker.committable() == {0: 15}
+    assert tracker.pending == 0
+
+
+def test_waits_for_every_subscriber():
+    tracker = OffsetTracker()
+    ack = tracker.track(0, 5, 2)
+    ack()
+    assert tracker.committable() == {0: 5}
+    ack()
+    assert tracker.committable() == {0: 6}
+    # Extra acknowledgements, e.g. a retry succeeding after a dead letter, change nothing
+    ack()
+    assert tracker.committable() == {0: 6}
+
+
+def test_records_without_subscribers_are_committed_right_away():
+    tracker = OffsetTracker()
+    assert tracker.track(0, 7, 0) is None
+    assert tracker.committable() == {0: 8}
+
+
+def test_partitions_are_tracked_independently():
+    tracker = OffsetTracker()
+    slow = tracker.track(0, 0, 1)
+    tracker.track(1, 0, 1)()
+    assert tracker.committable() == {0: 0, 1: 1}
+    slow()
+    assert tracker.committable() == {0: 1, 1: 1}
+
+
+def test_only_moved_partitions_are_committed_again():
+    tracker = OffsetTracker()
+    tracker.track(0, 0, 1)()
+    tracker.track(1, 0, 1)()
+    tracker.mark_committed(tracker.committable())
+    assert tracker.committable() == {}
+
+    tracker.track(1, 1, 1)()
+    assert tracker.committable() == {1: 2}
@@ -0,0 +1,12 @@
+import pytest
+from pydantic import ValidationError
+
+from main import PublishRequest
+
+
+def test_idempotency_keys_cannot_break_batched_pushes():
+    assert PublishRequest(topic="topic", payload={}, idempotency_key="task-1:chunk-2").idempotency_key == "task-1:chunk-2"
+    assert PublishRequest(topic="topic", payload={}).idempotency_key is None
+    for key in ["a,b", "a b", "a\nb"]:
+        with pytest.raises(ValidationError):
+            PublishRequest(topic="topic", payload={}, idempotency_key=key)
@@ -0,0 +1,122 @@
+import asyncio
+import time
+
+import pytest
+
+import encoding
+import kafka_manager
+from registry import SubscriptionRegistry
+from subscriptions import SESSION_ID, Subscription, SubscriptionFilter
+
+TOPIC = "registry_topic"
+ENDPOINT = "http://subscriber/push"
+
+
+@pytest.fixture
+def memory_pubsub(monkeypatch, tmp_path):
+    monkeypatch.setattr(kafka_manager, "BACKEND", "memory")
+    monkeypatch.setattr(kafka_manager, "REGISTRY_PATH", str(tmp_path / "subscriptions.db"))
+    monkeypatch.setattr(kafka_manager, "LEASE_CHECK_INTERVAL_S", 0.01)
+    # Fresh module state for every test, restored afterwards
+    for name in ("_subscribers", "_streams", "_topic_tasks", "_consumers", "_dispatchers"):
+        monkeypatch.setattr(kafka_manager, name, {})
+    monkeypatch.setattr(kafka_manager, "_registry", None)
+
+
+def test_registry_round_trips_every_setting(tmp_path):
+    subscription = Subscription(TOPIC, ENDPOINT, batch_max_messages=50, batch_max_latency_ms=20,
+                                filter=SubscriptionFilter(SESSION_ID, frozenset(["b", "a"]), "user-"),
+                                lease_s=30, expires_at=1234.5, content_type=encoding.MSGPACK,
+                                content_encoding=encoding.ZSTD)
+    registry = SubscriptionRegistry(str(tmp_path / "subscriptions.db"))
+    registry.save(subscription)
+    registry.save(Subscription("other_topic", ENDPOINT))
+    registry.delete("other_topic", ENDPOINT)
+    registry.close()
+
+    registry = SubscriptionRegistry(str(tmp_path / "subscriptions.db"))
+    assert registry.load() == [subscription]
+    registry.close()
+
+
+def test_subscribing_again_is_idempotent(memory_pubsub):
+    async def run():
+        await kafka_manager.start()
+        try:
+            assert kafka_manager.subscribe(Subscription(TOPIC, ENDPOINT)) == "created"
+            assert kafka_manager.subscribe(Subscription(TOPIC, ENDPOINT)) == "renewed"
+            assert kafka_manager.subscribe(Subscription(TOPIC, ENDPOINT, batch_max_messages=10)) == "updated"
+            assert [s.batch_max_messages for s in kafka_manager.subscriptions()] == [10]
+        finally:
+            await kafka_manager.close()
+
+    asyncio.run(run())
+
+
+def test_subscriptions_survive_a_restart_until_unsubscribed(memory_pubsub):
+    async def run():
+        await kafka_manager.start()
+        try:
+            kafka_manager.subscribe(Subscription(TOPIC, ENDPOINT, batch_max_messages=5))
+            kafka_manager.subscribe(Subscription(TOPIC, "http://other/push"))
+        finally:
+            await kafka_manager.close()
+        kafka_manager._subscribers.clear()
+
+        await kafka_manager.start()
+        try:
+            assert sorted((s.endpoint, s.batch_max_messages) for s in kafka_manager.subscriptions()) == \
+                   [("http://other/push", 1), (ENDPOINT, 5)]
+            assert TOPIC in kafka_manager._topic_tasks
+            assert await kafka_manager.unsubscribe(TOPIC, "http://other/push")
+            assert not await kafka_manager.unsubscribe(TOPIC, "http://other/push")
+        finally:
+            await kafka_manager.close()
+        kafka_manager._subscribers.clear()
+
+        await kafka_manager.start()
+        try:
+            assert [s.endpoint for s in kafka_manager.subscriptions()] == [ENDPOINT]
+            await kafka_manager.unsubscribe(TOPIC, ENDPOINT)
+        finally:
+            await kafka_manager.close()
+
+    asyncio.run(run())
+
+
+def test_leases_expire_unless_renewed(memory_pubsub):
+    async def run():
+        await kafka_manager.start()
+        try:
+            kafka_manager.subscribe(Subscription(TOPIC, ENDPOINT, lease_s=0.2))
+            kafka_manager.subscribe(Subscription(TOPIC, "http://renewing/push", lease_s=0.2))
+            for _ in range(5):
+                await asyncio.sleep(0.1)
+                kafka_manager.subscribe(Subscription(TOPIC, "http://renewing/push", lease_s=0.2))
+            assert [s.endpoint for s in kafka_manager.subscriptions()] == ["http://renewing/push"]
+
+            await asyncio.sleep(0.3)
+            assert kafka_manager.subscriptions() == []
+            assert TOPIC not in kafka_manager._topic_tasks
+        finally:
+            await kafka_manager.close()
+
+    asyncio.run(run())
+
+
+def test_expired_subscriptions_are_not_restored(memory_pubsub):
+    registry = SubscriptionRegistry(kafka_manager.REGISTRY_PATH)
+    registry.save(Subscription(TOPIC, ENDPOINT, lease_s=10, expires_at=time.time() - 1))
+    registry.close()
+
+    async def run():
+        await kafka_manager.start()
+        try:
+            assert kafka_manager.subscriptions() == []
+        finally:
+            await kafka_manager.close()
+
+    asyncio.run(run())
+    registry = SubscriptionRegistry(kafka_manager.REGISTRY_PATH)
+    assert registry.load() == []
+    registry.close()
@@ -0,0 +1,85 @@
+import asyncio
+import json
+
+from delivery import DeliveryError
+from memory_backend import MemoryBackend
+from replay import DONE, FAILED, Replay
+from subscriptions import SubscriptionFilter
+
+TOPIC = "topic"
+ENDPOINT = "http://subscriber/push"
+
+
+def replay(backend: MemoryBackend, post, message_filter=None, batch_max_messages=1, max_attempts=3) -> Replay:
+    return Replay("replay-1", TOPIC, ENDPOINT, backend.reader(TOPIC), post,
+                  decode=lambda record: json.loads(record.value),
+                  idempotency_key=lambda record: f"{record.partition}:{record.offset}",
+                  message_filter=message_filter, rate=0, batch_max_messages=batch_max_messages,
+                  max_attempts=max_attempts, backoff=lambda attempt: 0.001)
+
+
+async def publish(backend: MemoryBackend, sessions: list[str]):
+    for n, session in enumerate(sessions):
+        await backend.send(TOPIC, json.dumps({"metadata": {"sessionId": session}, "n": n}).encode(), key=session)
+
+
+def test_replays_matching_messages_in_log_order_with_keys_of_their_own():
+    async def run():
+        backend = MemoryBackend(partitions=1, retention=100)
+        await publish(backend, ["a", "b", "a", "a"])
+        pushes = []
+
+        async def post(topic, endpoint, messages, batched):
+            pushes.append(([message.data["n"] for message in messages], batched,
+                           [message.idempotency_key for message in messages]))
+            return False
+
+        job = replay(backend, post, SubscriptionFilter(values=frozenset({"a"})), batch_max_messages=2)
+        await job.run(asyncio.Semaphore(1))
+        assert job.state == DONE
+        assert (job.scanned, job.delivered) == (4, 3)
+        assert [numbers for numbers, _, _ in pushes] == [[0, 2], [3]]
+        assert all(batched for _, batched, _ in pushes)
+        assert pushes[0][2] == ["replay-replay-1:0:0", "replay-replay-1:0:2"]
+
+    asyncio.run(run())
+
+
+def test_failed_pushes_are_retried_in_place():
+    async def run():
+        backend = MemoryBackend(partitions=1, retention=100)
+        await publish(backend, ["a", "a"])
+        pushes = []
+
+        async def post(topic, endpoint, messages, batched):
+            pushes.append(messages[0].data["n"])
+            if len(pushes) == 1:
+                raise DeliveryError("503: busy")
+            return False
+
+        job = replay(backend, post)
+        await job.run(asyncio.Semaphore(1))
+        assert job.state == DONE
+        assert pushes == [0, 0, 1]
+
+    asyncio.run(run())
+
+
+def test_fails_once_attempts_run_out():
+    async def run():
+        backend = MemoryBackend(partitions=1, retention=100)
+        await publish(backend, ["a", "a"])
+        pushes = []
+
+        async def post(topic, endpoint, messages, batched):
+            pushes.append(messages[0].data["n"])
+            raise DeliveryError("503: busy")
+
+        job = replay(backend, post, max_attempts=2)
+        await job.run(asyncio.Semaphore(1))
+        assert job.state == FAILED
+        assert job.error == "503: busy"
+        assert pushes == [0, 0]
+        assert job.delivered == 0
+
+    asyncio.run(run())
@@ -0,0 +1,165 @@
+import asyncio
+
+from delivery import DeliveryError, Message
+from retry import RetryScheduler
+
+TOPIC = "topic"
+ENDPOINT = "http://subscriber/push"
+
+
+class Acks:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+
+
+def scheduler(post, dead_letters: list, active=lambda topic, endpoint: True, max_attempts=3, base_delay=0.001,
+              max_delay=0.01) -> RetryScheduler:
+    async def dead_letter(delivery):
+        dead_letters.append(delivery)
+
+    return RetryScheduler(post, dead_letter, active, max_attempts=max_attempts, base_delay=base_delay,
+                          max_delay=max_delay, concurrency=2)
+
+
+async def wait_for(condition, timeout_s=2.0):
+    async with asyncio.timeout(timeout_s):
+        while not condition():
+            await asyncio.sleep(0.001)
+
+
+def test_backoff_doubles_with_jitter_up_to_max_delay():
+    async def run():
+        retries = scheduler(None, [], base_delay=1, max_delay=8)
+        for attempt, delay in [(1, 1), (2, 2), (3, 4), (4, 8), (10, 8)]:
+            for _ in range(50):
+                assert delay / 2 <= retries.backoff(attempt) <= delay
+
+    asyncio.run(run())
+
+
+def test_retries_until_delivered_and_acknowledges_once():
+    async def run():
+        attempts = []
+
+        async def post(topic, endpoint, messages, batched):
+            attempts.append(batched)
+            if len(attempts) < 2:
+                raise DeliveryError("503: busy")
+            return False
+
+        dead_letters = []
+        retries = scheduler(post, dead_letters)
+        retries.start()
+        ack = Acks()
+        retries.schedule(TOPIC, ENDPOINT, Message({"n": 1}, "key-1", ack), attempt=1, error="503: busy")
+        await wait_for(lambda: ack.count)
+        await retries.close()
+        assert attempts == [False, False]
+        assert ack.count == 1
+        assert dead_letters == []
+
+    asyncio.run(run())
+
+
+def test_dead_letters_after_max_attempts():
+    async def run():
+        attempts = []
+
+        async def post(topic, endpoint, messages, batched):
+            attempts.append(messages[0].idempotency_key)
+            raise DeliveryError("503: down")
+
+        dead_letters = []
+        retries = scheduler(post, dead_letters, max_attempts=3)
+        retries.start()
+        retries.schedule(TOPIC, ENDPOINT, Message({"n": 1}, "key-1"), attempt=1, error="503: down")
+        await wait_for(lambda: dead_letters)
+        await retries.close()
+        assert len(attempts) == 2
+        assert dead_letters[0].attempt == 3
+        assert dead_letters[0].error == "503: down"
+
+    asyncio.run(run())
+
+
+def test_rejected_delivery_is_dead_lettered_without_retrying():
+    async def run():
+        attempts = []
+
+        async def post(topic, endpoint, messages, batched):
+            attempts.append(1)
+            raise DeliveryError("400: invalid", retryable=False)
+
+        dead_letters = []
+        retries = scheduler(post, dead_letters, max_attempts=5)
+        retries.start()
+        retries.schedule(TOPIC, ENDPOINT, Message({"n": 1}, "key-1"), attempt=1)
+        await wait_for(lambda: dead_letters)
+        await retries.close()
+        assert len(attempts) == 1
+        assert dead_letters[0].attempt == 5
+
+    asyncio.run(run())
+
+
+def test_close_dead_letters_pending_retries():
+    async def run():
+        async def post(topic, endpoint, messages, batched):
+            raise AssertionError("retries are not due yet")
+
+        dead_letters = []
+        retries = scheduler(post, dead_letters, base_delay=60, max_delay=60)
+        retries.start()
+        for n in range(3):
+            retries.schedule(TOPIC, ENDPOINT, Message({"n": n}, f"key-{n}"), attempt=1)
+        assert retries.depth == 3
+        await retries.close()
+        assert sorted(delivery.message.data["n"] for delivery in dead_letters) == [0, 1, 2]
+
+    asyncio.run(run())
+
+
+def test_drops_retries_of_unsubscribed_endpoints():
+    async def run():
+        async def post(topic, endpoint, messages, batched):
+            raise AssertionError("unsubscribed endpoints are not retried")
+
+        subscribed = {ENDPOINT}
+        dead_letters = []
+        retries = scheduler(post, dead_letters, active=lambda topic, endpoint: endpoint in subscribed,
+                            base_delay=0.05, max_delay=0.05)
+        retries.start()
+        ack = Acks()
+        retries.schedule(TOPIC, ENDPOINT, Message({"n": 1}, "key-1", ack), attempt=1)
+        subscribed.clear()
+        await wait_for(lambda: ack.count)
+        retries.schedule(TOPIC, ENDPOINT, Message({"n": 2}, "key-2", ack), attempt=1)
+        await retries.close()
+        assert ack.count == 2
+        assert dead_letters == []
+
+    asyncio.run(run())
+
+
+def test_resolves_deliveries_that_are_parked_or_dropped():
+    async def run():
+        async def post(topic, endpoint, messages, batched):
+            raise DeliveryError("503: busy")
+
+        dead_letters = []
+        active = {ENDPOINT}
+        retries = scheduler(post, dead_letters, active=lambda topic, endpoint: endpoint in active, max_attempts=2)
+        retries.start()
+        loop = asyncio.get_running_loop()
+        parked, dropped = loop.create_future(), loop.create_future()
+        retries.schedule(TOPIC, ENDPOINT, Message({"n": 1}, "key-1"), attempt=1, resolved=parked)
+        retries.schedule(TOPIC, "http://gone/push", Message({"n": 2}, "key-2"), attempt=1, resolved=dropped)
+        async with asyncio.timeout(2):
+            await asyncio.gather(parked, dropped)
+        await retries.close()
+        assert [delivery.message.data for delivery in dead_letters] == [{"n": 1}]
+
+    asyncio.run(run())
@@ -0,0 +1,98 @@
+import asyncio
+import json
+
+import pytest
+
+import kafka_manager
+from streams import stream_endpoint
+from subscriptions import Subscription
+
+TOPIC = "stream_topic"
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.frames = []
+
+    async def send_text(self, text: str):
+        self.frames.append(json.loads(text))
+
+    @property
+    def messages(self) -> list[dict]:
+        return [message for frame in self.frames for message in frame["messages"]]
+
+
+@pytest.fixture
+def memory_pubsub(monkeypatch):
+    monkeypatch.setattr(kafka_manager, "BACKEND", "memory")
+    monkeypatch.setattr(kafka_manager, "REGISTRY_PATH", "")
+    monkeypatch.setattr(kafka_manager, "RETRY_BASE_DELAY_MS", 1)
+    monkeypatch.setattr(kafka_manager, "POLL_TIMEOUT_MS", 20)
+    # Fresh module state for every test, restored afterwards
+    for name in ("_subscribers", "_streams", "_topic_tasks", "_consumers", "_dispatchers"):
+        monkeypatch.setattr(kafka_manager, name, {})
+    monkeypatch.setattr(kafka_manager, "_registry", None)
+
+
+async def wait_for(condition, timeout_s=2.0):
+    async with asyncio.timeout(timeout_s):
+        while not condition():
+            await asyncio.sleep(0.005)
+
+
+def test_closed_stream_is_unsubscribed_and_its_messages_dropped(memory_pubsub):
+    async def run():
+        await kafka_manager.start()
+        try:
+            websocket = FakeWebSocket()
+            subscription = Subscription(TOPIC, stream_endpoint("subscriber"))
+            stream = kafka_manager.subscribe_stream(subscription, websocket, credit=1)
+            # The topic consumer starts at the end of the topic, give it time to get there
+            await asyncio.sleep(0.1)
+            for n in range(3):
+                await kafka_manager.publish(TOPIC, {"n": n}, key="session")
+            # One message is written with the only credit, the next waits for credit and the last one is queued
+            await wait_for(lambda: websocket.messages)
+            await wait_for(lambda: sum(kafka_manager._dispatchers[TOPIC].depths().values()) == 1)
+
+            await kafka_manager.unsubscribe_stream(subscription, stream)
+
+            assert kafka_manager.subscriptions() == []
+            assert TOPIC not in kafka_manager._topic_tasks
+            assert not kafka_manager._delivering(TOPIC, subscription.endpoint)
+            await wait_for(lambda: TOPIC not in kafka_manager._dispatchers)
+            # The unacknowledged message is dropped rather than retried and dead lettered
+            await asyncio.sleep(0.05)
+            assert kafka_manager._retry_scheduler.depth == 0
+            dead_letters = kafka_manager._backend.reader(kafka_manager.dead_letter_topic(TOPIC))
+            assert await dead_letters.poll() == []
+            assert [message["data"] for message in websocket.messages] == [{"n": 0}]
+        finally:
+            await kafka_manager.close()
+
+    asyncio.run(run())
+
+
+def test_stream_taken_over_by_a_reconnect_keeps_its_messages(memory_pubsub):
+    async def run():
+        await kafka_manager.start()
+        try:
+            old_websocket, new_websocket = FakeWebSocket(), FakeWebSocket()
+            subscription = Subscription(TOPIC, stream_endpoint("subscriber"))
+            old_stream = kafka_manager.subscribe_stream(subscription, old_websocket, credit=10)
+            await asyncio.sleep(0.1)
+            await kafka_manager.publish(TOPIC, {"n": 0})
+            await wait_for(lambda: old_websocket.messages)
+
+            # The subscriber reconnects before pubsub notices that the old socket is gone
+            kafka_manager.subscribe_stream(Subscription(TOPIC, subscription.endpoint), new_websocket, credit=10)
+            await kafka_manager.unsubscribe_stream(subscription, old_stream)
+
+            assert [s.endpoint for s in kafka_manager.subscriptions()] == [subscription.endpoint]
+            assert kafka_manager._delivering(TOPIC, subscription.endpoint)
+            await wait_for(lambda: new_websocket.messages)
+            assert [message["data"] for message in new_websocket.messages] == [{"n": 0}]
+        finally:
+            await kafka_manager.close()
+
+    asyncio.run(run())
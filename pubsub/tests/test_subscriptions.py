@@ -0,0 +1,46 @@
+from subscriptions import SESSION_ID, Subscription, SubscriptionFilter
+
+REQUEST = {"method": "tasks/send", "params": {"id": "task-1", "sessionId": "user-1-session-1"}}
+RESPONSE = {"result": {"id": "task-1", "sessionId": "user-1-session-2", "status": {"state": "completed"}}}
+ARTIFACT_UPDATE = {"result": {"id": "task-1", "metadata": {"sessionId": "user-2-session-1"}}}
+
+
+def test_session_id_is_found_wherever_the_message_keeps_it():
+    session_filter = SubscriptionFilter(SESSION_ID, values=frozenset(["user-1-session-1", "user-2-session-1"]))
+    assert session_filter.matches(REQUEST)
+    assert not session_filter.matches(RESPONSE)
+    assert session_filter.matches(ARTIFACT_UPDATE)
+    assert not session_filter.matches({"payload": "without a session"})
+
+
+def test_prefix_matches_the_start_of_the_value():
+    user_filter = SubscriptionFilter(SESSION_ID, prefix="user-1-")
+    assert user_filter.matches(REQUEST)
+    assert user_filter.matches(RESPONSE)
+    assert not user_filter.matches(ARTIFACT_UPDATE)
+
+
+def test_values_and_prefix_must_both_match():
+    both = SubscriptionFilter(SESSION_ID, values=frozenset(["user-1-session-1", "user-2-session-1"]), prefix="user-1-")
+    assert both.matches(REQUEST)
+    assert not both.matches(ARTIFACT_UPDATE)
+
+
+def test_dotted_path_into_the_payload():
+    completed = SubscriptionFilter("result.status.state", values=frozenset(["completed"]))
+    assert completed.matches(RESPONSE)
+    assert not completed.matches(ARTIFACT_UPDATE)
+    # A path through something that is not an object does not match
+    assert not completed.matches({"result": {"status": "completed"}})
+    assert not completed.matches({"result": None})
+
+
+def test_non_string_values_are_compared_as_strings():
+    assert SubscriptionFilter("result.index", values=frozenset(["0"])).matches({"result": {"index": 0}})
+
+
+def test_subscription_without_filter_accepts_everything():
+    assert Subscription("topic", "http://subscriber/push").accepts({"anything": True})
+    filtered = Subscription("topic", "http://subscriber/push", filter=SubscriptionFilter(SESSION_ID, prefix="user-2-"))
+    assert filtered.accepts(ARTIFACT_UPDATE)
+    assert not filtered.accepts(REQUEST)